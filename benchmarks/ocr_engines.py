@@ -0,0 +1,111 @@
+"""
+Compares the OCR engines (see OCR_ENGINES) on samples/: model load time,
+median OCR latency per receipt, peak RSS, and accuracy relative to easyocr
+(token recall and whether the parsed total / item count agree).
+
+Each engine runs in its own subprocess so peak memory is not shared and
+one backend's imports (torch) do not skew another's.
+
+    python -m benchmarks.ocr_engines [--engines easyocr onnx onnx-int8] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from scanner.config import OCR_ENGINES, STORAGE_FOLDER
+from scanner.engines import ENGINE_ENV
+
+from .preprocess_profiles import sample_images, token_recall
+
+
+def _worker(engine: str, images: list[str], repeat: int):
+    """Runs in the subprocess: one engine over all images, JSON report on stdout."""
+    os.environ[ENGINE_ENV] = engine
+    from scanner.cache import set_cache
+    from scanner.ocr import run_ocr, warm_reader
+    from scanner.preprocess import preprocess_receipt
+
+    set_cache(None)
+    start = time.perf_counter()
+    warm_reader()
+    load = time.perf_counter() - start
+
+    latencies, tokens = [], []
+    for path in images:
+        img = preprocess_receipt(path)
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run_ocr(img)
+            runs.append(time.perf_counter() - start)
+        latencies.append(statistics.median(runs))
+        tokens.append(result)
+
+    # ru_maxrss is KiB on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    json.dump({"load": load, "latencies": latencies, "tokens": tokens, "rss_mb": rss}, sys.stdout)
+
+
+def run_engine(engine: str, images: list[str], repeat: int) -> dict | None:
+    cmd = [sys.executable, "-m", "benchmarks.ocr_engines", "--worker", engine, "--repeat", str(repeat), *images]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(f"{engine}: failed\n{proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else ''}")
+        return None
+    return json.loads(proc.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR engines.")
+    parser.add_argument("images", nargs="*", help=argparse.SUPPRESS)
+    parser.add_argument("--samples", default=STORAGE_FOLDER, help="Folder with receipt images")
+    parser.add_argument("--engines", nargs="+", default=list(OCR_ENGINES), choices=OCR_ENGINES)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per image")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(args.worker, args.images, args.repeat)
+        return
+
+    from scanner.parser import parse_receipt
+
+    images = sample_images(args.samples)
+    if not images:
+        parser.error(f"No images in {args.samples}")
+
+    reports = {}
+    for engine in args.engines:
+        report = run_engine(engine, images, args.repeat)
+        if report is not None:
+            reports[engine] = report
+            print(f"done: {engine}")
+
+    reference = reports.get("easyocr")
+    print(f"\n{len(images)} image(s), {args.repeat} run(s) each, median seconds\n")
+    header = f"{'engine':<11}{'load':>8}{'ocr':>9}{'rss MB':>9}{'recall':>9}{'agree':>8}"
+    print(header)
+    print("-" * len(header))
+
+    for engine, report in reports.items():
+        row = f"{engine:<11}{report['load']:>8.2f}{statistics.median(report['latencies']):>9.2f}{report['rss_mb']:>9.0f}"
+        if reference is None:
+            row += f"{'-':>9}{'-':>8}"
+        else:
+            recalls, agree = [], 0
+            for ref_tokens, tokens in zip(reference["tokens"], report["tokens"]):
+                recalls.append(token_recall(ref_tokens, tokens))
+                ref_parsed, parsed = parse_receipt(ref_tokens), parse_receipt(tokens)
+                if parsed["total"] == ref_parsed["total"] and len(parsed["items"]) == len(ref_parsed["items"]):
+                    agree += 1
+            row += f"{statistics.mean(recalls):>9.1%}{agree:>5}/{len(images)}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Parser throughput on synthetic receipts (benchmarks/synthetic.py): tokens
+per second and peak allocated memory per call for each parsing stage, at
+several receipt sizes.
+
+    python -m benchmarks.parser_throughput [--sizes 10 100 1000 10000] [--save]
+
+Stages:
+    price_from       every token text through price_from
+    merge_split      merge_split_prices over the token texts
+    reconstruct      reconstruct_lines (rows from token boxes)
+    parse            parse_receipt on tokens with boxes
+    parse_nobox      parse_receipt on tokens without boxes (token order)
+
+--save stores the results as the baseline (benchmarks/baselines/parser.json);
+later runs print the change against it. Baselines only compare on the same
+machine and Python.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+
+from scanner.layout import reconstruct_lines
+from scanner.parser import merge_split_prices, parse_receipt
+from scanner.utils import price_from
+
+from .synthetic import synthetic_receipt
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "parser.json")
+
+
+def _machine() -> str:
+    return f"{platform.system()} {platform.machine()} {os.cpu_count()} cpu"
+
+
+def _stages(tokens: list[dict]) -> dict:
+    texts = [t["text"] for t in tokens]
+    plain = [{k: v for k, v in t.items() if k != "box"} for t in tokens]
+    return {
+        "price_from": lambda: [price_from(t) for t in texts],
+        "merge_split": lambda: merge_split_prices(texts),
+        "reconstruct": lambda: reconstruct_lines(tokens),
+        "parse": lambda: parse_receipt(tokens),
+        "parse_nobox": lambda: parse_receipt(plain),
+    }
+
+
+def measure(fn, min_time: float, repeat: int) -> tuple[float, float]:
+    """(median seconds per call, peak KiB allocated during one call)."""
+    fn()
+    runs = []
+    for _ in range(repeat):
+        calls, start = 0, time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        runs.append(elapsed / calls)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(runs), peak / 1024
+
+
+def run(sizes: list[int], min_time: float, repeat: int, seed: int) -> dict:
+    results: dict = {}
+    for size in sizes:
+        tokens, _ = synthetic_receipt(lines=size, seed=seed)
+        for stage, fn in _stages(tokens).items():
+            sec, peak = measure(fn, min_time, repeat)
+            results.setdefault(stage, {})[str(size)] = {
+                "tokens": len(tokens),
+                "tok_per_s": len(tokens) / sec,
+                "peak_kib": peak,
+            }
+        print(f"done: {size} lines ({len(tokens)} tokens)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parser stages on synthetic receipts.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Receipt lengths in lines")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds per timed run")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage and size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE, help=f"Baseline file (default: {BASELINE})")
+    parser.add_argument("--save", action="store_true", help="Store this run as the baseline")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.min_time, args.repeat, args.seed)
+
+    baseline = None
+    if not args.save and os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("python") != platform.python_version() or baseline.get("machine") != _machine():
+            print(f"note: baseline is from {baseline.get('machine')} / Python {baseline.get('python')}")
+
+    print(f"\ntokens/sec (peak KiB per call){', change vs baseline' if baseline else ''}\n")
+    header = f"{'stage':<13}" + "".join(f"{size:>24}" for size in args.sizes)
+    print(header)
+    print("-" * len(header))
+    for stage, by_size in results.items():
+        row = f"{stage:<13}"
+        for size in args.sizes:
+            r = by_size[str(size)]
+            cell = f"{r['tok_per_s']:,.0f} ({r['peak_kib']:,.0f})"
+            base = (baseline or {}).get("results", {}).get(stage, {}).get(str(size))
+            if base:
+                cell += f" {r['tok_per_s'] / base['tok_per_s'] - 1:+.0%}"
+            row += f"{cell:>24}"
+        print(row)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "machine": _machine(),
+                "python": platform.python_version(),
+                "seed": args.seed,
+                "results": results,
+            }, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Per-stage timing of the preprocessing profiles on samples/, plus the OCR
+accuracy delta of each profile against "quality".
+
+There is no ground truth for the samples, so accuracy is measured relative
+to the quality profile: token recall (share of quality tokens the profile
+also reads) and whether the parsed total / item count agree.
+
+    python -m benchmarks.preprocess_profiles [--repeat 3] [--no-ocr]
+"""
+import argparse
+import glob
+import os
+import statistics
+import time
+from collections import Counter
+
+from scanner.cache import set_cache
+from scanner.config import ALLOWED_IMAGE_EXTENSIONS, PREPROCESS_PROFILES, STORAGE_FOLDER
+from scanner.parser import parse_receipt
+from scanner.utils import norm
+
+
+def sample_images(folder: str) -> list[str]:
+    paths = glob.glob(os.path.join(folder, "*"))
+    return sorted(p for p in paths if os.path.splitext(p)[1].lower() in ALLOWED_IMAGE_EXTENSIONS)
+
+
+def token_recall(reference: list[dict], candidate: list[dict]) -> float:
+    ref = Counter(norm(t["text"]).lower() for t in reference)
+    cand = Counter(norm(t["text"]).lower() for t in candidate)
+    total = sum(ref.values())
+    return sum((ref & cand).values()) / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing profiles.")
+    parser.add_argument("--samples", default=STORAGE_FOLDER, help="Folder with receipt images")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per image and profile")
+    parser.add_argument("--no-ocr", action="store_true", help="Only time preprocessing")
+    args = parser.parse_args()
+
+    # Measure the real work, not cache hits
+    set_cache(None)
+
+    from scanner.ocr import run_ocr
+    from scanner.preprocess import preprocess_receipt
+
+    images = sample_images(args.samples)
+    stage_times = {p: {} for p in PREPROCESS_PROFILES}
+    totals = {p: [] for p in PREPROCESS_PROFILES}
+    ocr_times = {p: [] for p in PREPROCESS_PROFILES}
+    recalls = {p: [] for p in PREPROCESS_PROFILES}
+    agree = {p: 0 for p in PREPROCESS_PROFILES}
+
+    for path in images:
+        reference = None
+        for profile in PREPROCESS_PROFILES:
+            img = None
+            for _ in range(args.repeat):
+                timings = {}
+                start = time.perf_counter()
+                img = preprocess_receipt(path, profile=profile, timings=timings)
+                totals[profile].append(time.perf_counter() - start)
+                for stage, sec in timings.items():
+                    stage_times[profile].setdefault(stage, []).append(sec)
+
+            if args.no_ocr:
+                continue
+
+            start = time.perf_counter()
+            tokens = run_ocr(img)
+            ocr_times[profile].append(time.perf_counter() - start)
+            parsed = parse_receipt(tokens)
+
+            if reference is None:
+                reference = (tokens, parsed)
+            ref_tokens, ref_parsed = reference
+            recalls[profile].append(token_recall(ref_tokens, tokens))
+            if parsed["total"] == ref_parsed["total"] and len(parsed["items"]) == len(ref_parsed["items"]):
+                agree[profile] += 1
+
+        print(f"done: {os.path.basename(path)}")
+
+    print(f"\n{len(images)} image(s), {args.repeat} run(s) each, median seconds\n")
+    stages = sorted({s for p in stage_times.values() for s in p})
+    header = f"{'profile':<10}" + "".join(f"{s:>11}" for s in stages) + f"{'total':>11}"
+    if not args.no_ocr:
+        header += f"{'ocr':>9}{'recall':>9}{'agree':>8}"
+    print(header)
+    print("-" * len(header))
+
+    for profile in PREPROCESS_PROFILES:
+        row = f"{profile:<10}"
+        for stage in stages:
+            vals = stage_times[profile].get(stage)
+            row += f"{statistics.median(vals):>11.3f}" if vals else f"{'-':>11}"
+        row += f"{statistics.median(totals[profile]):>11.3f}"
+        if not args.no_ocr:
+            row += f"{statistics.median(ocr_times[profile]):>9.2f}"
+            row += f"{statistics.mean(recalls[profile]):>9.1%}"
+            row += f"{agree[profile]:>5}/{len(images)}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Synthetic raw-OCR token lists shaped like Publix receipts, for parser
+benchmarks: a header, item rows (plain, deals, quantities, weights, voids,
+promotions, "You Saved" lines), a footer with totals, plus the noise EasyOCR
+leaves behind (tax flags, split prices, OCR slips in digits).
+
+    from benchmarks.synthetic import synthetic_receipt
+    tokens, expected = synthetic_receipt(lines=500, seed=1)
+"""
+import random
+
+ITEM_WORDS = (
+    "APPLE", "JUICE", "MILK", "BREAD", "EGGS", "CHICK", "BREAST", "BNLS", "TOMATOES", "DICED",
+    "PASTE", "PARM", "SHRD", "SOUR", "CREAM", "ALMOND", "BREEZE", "LOTION", "BABY", "WSH",
+    "BISCOTTI", "TEA", "BAG", "SIRLOIN", "BURG", "VANIL", "WHEAT", "PUB", "PBX", "FNCY",
+)
+HEADER = ("Publix", "Sea Ranch Lakes", "4703 N Ocean Drive", "Lauderdale By The Sea, FL 33308", "Store Manager: Frank")
+NOISE = ("t", "F", "t F", "{F", "3)")
+
+LINE_HEIGHT = 30
+NAME_X = 40
+PRICE_X = 600
+CHAR_W = 14
+
+
+def _price(rng: random.Random, low: float = 0.5, high: float = 25.0) -> float:
+    return round(rng.uniform(low, high), 2)
+
+
+def _slip(rng: random.Random, text: str, rate: float) -> str:
+    """OCR slips the parser is expected to undo: comma decimals, O for 0, spaced points."""
+    if rng.random() >= rate:
+        return text
+    kind = rng.randrange(3)
+    if kind == 0:
+        return text.replace(".", ",")
+    if kind == 1 and text.endswith("0"):
+        return text[:-1] + "O"
+    return text.replace(".", " . ")
+
+
+class _Page:
+    def __init__(self, rng: random.Random, boxes: bool):
+        self.rng = rng
+        self.boxes = boxes
+        self.y = 20
+        self.tokens: list[dict] = []
+
+    def token(self, text: str, x: int, conf: float | None = None):
+        tok = {"text": text, "confidence": round(conf if conf is not None else self.rng.uniform(0.6, 1.0), 3)}
+        if self.boxes:
+            jitter = self.rng.randint(-2, 2)
+            tok["box"] = [x, self.y + jitter, x + CHAR_W * len(text), self.y + jitter + LINE_HEIGHT - 8]
+        self.tokens.append(tok)
+
+    def row(self, name: str | None = None, price: str | None = None):
+        if name is not None:
+            self.token(name, NAME_X)
+        if price is not None:
+            self.token(price, PRICE_X)
+        self.y += LINE_HEIGHT
+
+
+def synthetic_receipt(
+    lines: int = 100,
+    seed: int = 0,
+    noise: float = 0.1,
+    boxes: bool = True,
+) -> tuple[list[dict], dict]:
+    """
+    Tokens for a receipt of about `lines` rows, and the expected parse
+    ({"items": count, "total": total}; a promotion is its own entry).
+    `noise` is the share of rows that get a stray token, a split price or
+    an OCR slip; with noise=0 the parser reproduces the expected values. `boxes=False` drops geometry,
+    leaving token order only (hand-built / legacy input).
+    """
+    rng = random.Random(seed)
+    page = _Page(rng, boxes)
+    items, total = 0, 0.0
+
+    for line in HEADER:
+        page.row(line)
+
+    while page.y < 20 + LINE_HEIGHT * (len(HEADER) + max(lines - 8, 1)):
+        name = " ".join(rng.sample(ITEM_WORDS, rng.randint(1, 3)))
+        kind = rng.random()
+        if kind < 0.6:
+            price = _price(rng)
+            if rng.random() < noise / 3:
+                # The detector split "3.49" into "3" and "49"
+                dollars, cents = f"{price:.2f}".split(".")
+                page.token(name, NAME_X)
+                page.token(dollars, PRICE_X)
+                page.token(cents, PRICE_X + CHAR_W * (len(dollars) + 1))
+                page.row()
+            else:
+                page.row(name, _slip(rng, f"{price:.2f}", noise))
+        elif kind < 0.7:
+            # "2 FOR 5.00" deal, final price on the same row
+            buy = rng.randint(2, 4)
+            price = _price(rng)
+            page.row(name)
+            page.row(f"1 @ {buy} FOR {price * buy:.2f}", f"{price:.2f}")
+        elif kind < 0.78:
+            qty = rng.randint(2, 6)
+            unit = _price(rng, 0.5, 6)
+            price = round(qty * unit, 2)
+            page.row(name)
+            page.row(f"{qty} @ {unit:.2f}", f"{price:.2f}")
+        elif kind < 0.86:
+            weight, unit = round(rng.uniform(0.3, 3), 2), _price(rng, 1, 9)
+            price = round(weight * unit, 2)
+            page.row(name)
+            page.row(f"{weight:.2f} lb @ {unit:.2f}/ lb", f"{price:.2f}")
+        elif kind < 0.92:
+            # Item then its promotion: two entries, the discount negative
+            price = _price(rng, 3, 25)
+            off = round(price / 3, 2)
+            page.row(name, f"{price:.2f}")
+            page.row("Promotion", f"-{off:.2f}")
+            page.row(f"You Saved {off:.2f}")
+            items += 2
+            total += price - off
+            continue
+        else:
+            price = _price(rng)
+            page.row("VOIDED ITEM")
+            page.row(name, f"-{price:.2f}")
+            items += 1
+            total -= price
+            continue
+
+        items += 1
+        total += price
+        if rng.random() < noise:
+            page.token(rng.choice(NOISE), PRICE_X + 120, conf=rng.uniform(0.1, 0.6))
+
+    total = round(total, 2)
+    tax = round(total * 0.07, 2)
+    page.row("SUBTOTAL", f"{total:.2f}")
+    page.row("Sales Tax", f"{tax:.2f}")
+    page.row("Grand Total", f"{total + tax:.2f}")
+    page.row("Credit", f"{total + tax:.2f}")
+    page.row("Change", "0.00")
+    return page.tokens, {"items": items, "total": round(total, 2)}
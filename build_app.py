@@ -32,6 +32,10 @@ def build():
         # Explicitly add CustomTkinter data
         f"--add-data={ctk_path}{sep}customtkinter",
 
+        # Store templates are discovered from their sources and imported lazily
+        f"--add-data=scanner/templates/*.py{sep}scanner/templates",
+        "--collect-submodules", "scanner.templates",
+
         # Hidden imports - Exhaustive list for stability
         "--hidden-import", "customtkinter",
         "--hidden-import", "PIL",
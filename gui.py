@@ -15,7 +15,7 @@ from PIL import Image
 
 # Import scanner logic
 from scanner.manager import ScannerManager
-from scanner.ocr import preprocess_receipt
+from scanner.preprocess import ReceiptImage
 from scanner.storage import save_to_file
 
 
@@ -282,24 +282,22 @@ class App(ctk.CTk):
 
         if path:
             self.current_image_path = path
-            self.show_image_preview(path)
-            self.start_processing(path)
+            # The preview is a reduced color decode of its own; the OCR
+            # pipeline decodes the file in grayscale on the worker thread
+            receipt = ReceiptImage(path)
+            self.show_image_preview(receipt)
+            self.start_processing(receipt)
 
-    def show_image_preview(self, path):
+    def show_image_preview(self, receipt):
         try:
             self.img_placeholder.place_forget()
 
-            # Load and scale image for preview
-            img = Image.open(path)
-
             # Scale logic: Fixed width, variable height
-            w, h = img.size
             canvas_w = 550 # Wider canvas for Continuum
             target_w = canvas_w - 40
-            scale = target_w / w
-            target_h = int(h * scale)
+            img = Image.fromarray(receipt.preview(target_w))
+            target_w, target_h = img.size
 
-            img = img.resize((target_w, target_h), Image.Resampling.LANCZOS)
             ctk_img = ctk.CTkImage(light_image=img, dark_image=img, size=(target_w, target_h))
 
             self.image_label.configure(image=ctk_img)
@@ -307,35 +305,59 @@ class App(ctk.CTk):
         except Exception as e:
             print(f"Preview error: {e}")
 
-    def start_processing(self, path):
+    def start_processing(self, receipt):
         self.processing = True
         self.open_button.configure(state="disabled")
         self.progress_bar.start()
         self.label_status.configure(text="Processing...", text_color="#dce4ee")
         self.engine_info.configure(text="Mode: Detecting Path...", text_color="#1f6aa5")
+        self.duplicate_note = None
 
         self.store_entry.delete(0, "end")
         self.store_entry.insert(0, "Scanning Digital Ink...")
         self.clear_results()
 
         print(f"[DEBUG] Starting Smart Scan Sequence...")
-        threading.Thread(target=self.process_image, args=(path,), daemon=True).start()
+        threading.Thread(target=self.process_image, args=(receipt,), daemon=True).start()
 
-    def process_image(self, path):
+    def process_image(self, receipt):
         try:
             self.after(0, lambda: self.label_status.configure(text="Preparing Optics..."))
-            img = preprocess_receipt(path)
-
-            self.after(0, lambda: self.label_status.configure(text="Smart Routing..."))
-
-            # Use the new Smart Manager
-            self.current_data = ScannerManager.process(img)
 
-            self.after(0, self.update_ui)
+            # Rows appear as the pipeline produces them; Tk is only touched from the main loop
+            for event in ScannerManager.process_iter(receipt):
+                self.after(0, self.on_scan_event, event)
         except Exception as e:
             err_msg = str(e)
             self.after(0, lambda: self.handle_error(err_msg))
 
+    def on_scan_event(self, event):
+        kind = event["event"]
+        if kind == "preprocessed":
+            self.label_status.configure(text="Smart Routing...")
+        elif kind == "duplicate":
+            source = event["of"].get("source")
+            self.duplicate_note = f"Duplicate of {os.path.basename(source) if source else 'an earlier scan'}"
+            self.engine_info.configure(text=f"Mode: {self.duplicate_note}", text_color="#e4a84f")
+        elif kind == "store":
+            self.store_entry.delete(0, "end")
+            self.store_entry.insert(0, event["store"] or "New Store")
+            if event["via"] != "duplicate":
+                mode = {"vision": "Vision AI", "generic": "Generic Parser"}.get(event["via"], "Local Template")
+                if self.duplicate_note:
+                    # Re-scanned anyway; keep the warning visible
+                    self.engine_info.configure(text=f"Mode: {mode} ({self.duplicate_note})", text_color="#e4a84f")
+                else:
+                    self.engine_info.configure(text=f"Mode: {mode}", text_color="#1f6aa5")
+            self.label_status.configure(text="Reading Items...")
+        elif kind == "item":
+            item = event["item"]
+            self.add_item_row(item.get("name", ""), item.get("price", 0.0))
+            self.recalculate_total()
+        elif kind == "done":
+            self.current_data = event["result"]
+            self.update_ui()
+
     def update_ui(self):
         self.processing = False
         self.open_button.configure(state="normal")
@@ -348,21 +370,9 @@ class App(ctk.CTk):
             self.store_entry.insert(0, "Extraction Error")
             return
 
-        # Header Info
-        self.store_entry.delete(0, "end")
-        self.store_entry.insert(0, self.current_data.get("store", "New Store"))
-
-        t_val = self.current_data.get("total", 0.0)
-        self.total_entry.delete(0, "end")
-        self.total_entry.insert(0, f"{t_val:.2f}" if t_val is not None else "0.00")
+        # Header Info and rows arrived as events; the total is checked against them
         self.total_entry.bind("<KeyRelease>", lambda e: self.validate_entry_color(self.total_entry))
 
-        # Table Rows
-        self.clear_results()
-        items = self.current_data.get("items", [])
-        for item in items:
-            self.add_item_row(item.get("name", ""), item.get("price", 0.0))
-
         # IMPORTANT: Recalculate total from items to ensure initial UI consistency
         self.recalculate_total()
 
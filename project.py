@@ -1,12 +1,29 @@
 import argparse
 import logging
+import multiprocessing
 import os
-import cv2
 
-from scanner.config import ALLOWED_IMAGE_EXTENSIONS, SAVE_EXTENSIONS, STORAGE_FOLDER
-from scanner.ocr import preprocess_receipt
-from scanner.manager import ScannerManager
-from scanner.storage import dict_to_table, save_to_file
+from scanner.archive import ARCHIVE_ENV, get_archive, reparse_archive
+from scanner.batch import collect_images, run_batch
+from scanner.cache import CACHE_ENV, get_cache
+from scanner.config import (
+    ALLOWED_IMAGE_EXTENSIONS,
+    MEMORY_BUDGET_MB,
+    OCR_BATCH_SIZE,
+    OCR_ENGINE,
+    OCR_ENGINES,
+    PIPELINE_VISION_WORKERS,
+    PREPROCESS_PROFILE,
+    PREPROCESS_PROFILES,
+    SAVE_EXTENSIONS,
+    STORAGE_FOLDER,
+    WRITER_FSYNC,
+)
+from scanner.daemon import scan_via_daemon
+from scanner.dedup import DEDUP_ENV
+from scanner.engines import ENGINE_ENV
+from scanner.pipeline import run_pipeline
+from scanner.storage import FSYNC_POLICIES, dict_to_table, save_to_file
 
 def get_args():
     """Parse and validate command lines arguments."""
@@ -20,9 +37,171 @@ def get_args():
         help="Output file path(default: invoices.jsonl)",
     )
     parser.add_argument("-v", "--verbose", action="store_true", help="Show detailed logs")
+    parser.add_argument(
+        "-b",
+        "--batch",
+        nargs="+",
+        metavar="PATH",
+        help="Batch mode: directories, globs or image files to process without prompting",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=max(1, (os.cpu_count() or 2) // 2),
+        help="Worker processes for batch mode (default: half the CPU cores)",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="Checkpoint file for batch mode (default: <output>.manifest.jsonl)",
+    )
+    parser.add_argument(
+        "--ocr-batch",
+        type=int,
+        default=OCR_BATCH_SIZE,
+        help=f"Receipts per batched OCR call in batch mode (default: {OCR_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Batch mode: stream receipts through preprocess/OCR/Vision AI/store stages that run concurrently",
+    )
+    parser.add_argument(
+        "--vision-workers",
+        type=int,
+        default=PIPELINE_VISION_WORKERS,
+        help=f"With --pipeline, Vision AI requests in flight at once (default: {PIPELINE_VISION_WORKERS})",
+    )
+    parser.add_argument(
+        "--fsync",
+        choices=FSYNC_POLICIES,
+        default=WRITER_FSYNC,
+        help=f"When batch/re-parse output is fsynced: after every buffered flush, at the end, or never (default: {WRITER_FSYNC})",
+    )
+    parser.add_argument(
+        "--rotate-mb",
+        type=int,
+        default=0,
+        help="Start a new numbered output file once batch/re-parse output reaches this size (default: off)",
+    )
+
+    parser.add_argument(
+        "-p",
+        "--profile",
+        choices=PREPROCESS_PROFILES,
+        default=PREPROCESS_PROFILE,
+        help=f"Preprocessing profile, quality vs speed (default: {PREPROCESS_PROFILE})",
+    )
+    parser.add_argument(
+        "--no-crop",
+        action="store_true",
+        help="Don't detect and crop the receipt out of the photo before preprocessing",
+    )
+    parser.add_argument(
+        "--fixed-resolution",
+        action="store_true",
+        help="Use the fixed 2000px / 2560 canvas rule instead of sizing from measured glyph height",
+    )
+    parser.add_argument(
+        "--memory-mb",
+        type=int,
+        default=MEMORY_BUDGET_MB,
+        help=f"Peak memory per receipt; huge photos are decoded and OCR-ed smaller to fit (default: {MEMORY_BUDGET_MB})",
+    )
+    parser.add_argument(
+        "--tile-workers",
+        type=int,
+        default=0,
+        help="OCR long receipts as overlapping strips on this many processes (default: off)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=OCR_ENGINES,
+        default=None,
+        help=f"OCR backend (default: $INVOICE_SCANNER_ENGINE or {OCR_ENGINE}); onnx needs exported models",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Run OCR in this process even if the OCR daemon is running",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always re-run preprocessing and OCR instead of using the on-disk cache",
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="Scan every image, even copies of receipts scanned before",
+    )
+    parser.add_argument(
+        "--no-archive",
+        action="store_true",
+        help="Don't append the raw OCR of scanned receipts to the OCR archive",
+    )
+    parser.add_argument(
+        "--reparse",
+        action="store_true",
+        help="Re-parse every receipt in the raw OCR archive (no OCR) into --output, using --workers processes",
+    )
+    parser.add_argument(
+        "--reparse-all",
+        action="store_true",
+        help="With --reparse, use every archived scan instead of the latest one per receipt",
+    )
 
     args = parser.parse_args()
 
+    # Job switches as environment variables: batch workers inherit them, and
+    # the OCR daemon applies them to this job (scanner/settings.py)
+    args.settings = {}
+    if args.no_cache:
+        args.settings[CACHE_ENV] = "off"
+    if args.no_dedup:
+        args.settings[DEDUP_ENV] = "off"
+    if args.no_archive:
+        args.settings[ARCHIVE_ENV] = "off"
+    if args.engine:
+        args.settings[ENGINE_ENV] = args.engine
+    os.environ.update(args.settings)
+
+    if args.reparse:
+        if args.image or args.batch:
+            parser.error("--reparse reads the OCR archive; don't pass images")
+        if args.workers < 1:
+            parser.error("--workers must be at least 1")
+        if get_archive() is None:
+            parser.error(f"The OCR archive is disabled ({ARCHIVE_ENV}=off)")
+        out_ext = os.path.splitext(args.output)[1].lower()
+        if out_ext not in SAVE_EXTENSIONS - {".json"}:
+            parser.error("Re-parse appends results. Use: .csv, .jsonl, .sqlite")
+        args.output = os.path.abspath(args.output)
+        return args
+
+    if args.batch:
+        if args.image:
+            parser.error("Pass either a single image or --batch, not both")
+        if args.workers < 1:
+            parser.error("--workers must be at least 1")
+        if args.ocr_batch < 1:
+            parser.error("--ocr-batch must be at least 1")
+        if args.vision_workers < 1:
+            parser.error("--vision-workers must be at least 1")
+
+        out_ext = os.path.splitext(args.output)[1].lower()
+        if out_ext not in SAVE_EXTENSIONS - {".json"}:
+            parser.error("Batch mode appends results. Use: .csv, .jsonl, .sqlite")
+
+        args.batch = collect_images(args.batch)
+        if not args.batch:
+            parser.error("No supported images found for batch mode")
+
+        args.output = os.path.abspath(args.output)
+        return args
+
     # If no image path provided, we'll launch GUI in main()
     if not args.image:
         return args
@@ -54,7 +233,7 @@ def main():
     args = get_args()
 
     # Launch GUI if no image path provided
-    if not args.image:
+    if not args.image and not args.batch and not args.reparse:
         try:
             from gui import App
             app = App()
@@ -72,17 +251,75 @@ def main():
     logging.getLogger("easyocr").setLevel(logging.WARNING)
     logging.getLogger("PIL").setLevel(logging.WARNING)
 
+    receipt_options = {
+        "profile": args.profile,
+        "crop": not args.no_crop,
+        "adaptive": not args.fixed_resolution,
+        "memory_budget": args.memory_mb << 20,
+    }
+
+    writer_options = {"fsync": args.fsync, "max_bytes": args.rotate_mb << 20}
+
+    if args.reparse:
+        stats = reparse_archive(
+            get_archive(), args.output, workers=args.workers, latest=not args.reparse_all, writer_options=writer_options,
+        )
+        logging.info(
+            "Re-parse finished: %d ok, %d failed (of %d). Results in %s",
+            stats["ok"], stats["failed"], stats["records"], args.output,
+        )
+        return
+
+    if args.batch:
+        if args.pipeline:
+            stats = run_pipeline(
+                args.batch, args.output, workers=args.workers, manifest_path=args.manifest,
+                receipt_options=receipt_options, writer_options=writer_options, vision_workers=args.vision_workers,
+            )
+        else:
+            stats = run_batch(
+                args.batch, args.output, workers=args.workers, manifest_path=args.manifest,
+                receipt_options=receipt_options, batch_size=args.ocr_batch, writer_options=writer_options,
+            )
+        logging.info(
+            "Batch finished: %d ok, %d failed, %d duplicate(s), %d skipped (of %d). Results in %s",
+            stats["ok"], stats["failed"], stats["duplicates"], stats["skipped"], stats["total"], args.output,
+        )
+        return
+
     logging.info("++++++++++ PROCESSING IMAGE +++++++++++")
     try:
-        # 1. Preprocess
-        preprocessed_img = preprocess_receipt(args.image)
+        # Warm daemon first: no model load, no torch import here
+        result = None
+        if not args.no_daemon:
+            result = scan_via_daemon(args.image, receipt_options, tile_workers=args.tile_workers, settings=args.settings)
+            if result is not None:
+                logging.info("Processed by the OCR daemon")
+
+        if result is None:
+            # Heavy imports only when OCR runs in this process
+            from scanner.manager import ScannerManager
+            from scanner.preprocess import ReceiptImage
 
-        # 2. Smart Routing (Template or Vision)
-        result = ScannerManager.process(preprocessed_img)
+            # 1. Preprocess (stages run lazily, as the pipeline pulls them)
+            receipt = ReceiptImage(args.image, **receipt_options)
+
+            # 2. Smart Routing (Template or Vision)
+            result = ScannerManager.process(receipt, tile_workers=args.tile_workers)
+            logging.debug("Preprocessing stages (s): %s", {k: round(v, 3) for k, v in receipt.timings.items()})
 
         # 3. Display Results
+        if result.get("duplicate_of"):
+            logging.warning(
+                "This looks like another copy of %s (it was scanned again; --no-dedup skips the check)",
+                result["duplicate_of"]["source"],
+            )
         dict_to_table(result)
 
+        cache = get_cache()
+        if cache is not None:
+            logging.debug("OCR cache: %s", cache.stats())
+
         # 4. Save Options
         choice = input("\nSave extracted data to file? (Y/n): ").strip().lower()
         if choice not in ['n', 'no']:
@@ -95,4 +332,6 @@ def main():
         logging.error(f"Failed to process image: {e}")
 
 if __name__ == "__main__":
+    # Needed for the process pool inside frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,276 @@
+"""
+Append-only archive of raw OCR output, so parser and template fixes can be
+applied to past receipts without OCR-ing them again.
+
+Every receipt scanned locally appends one record: the full-page tokens
+(text, confidence, box) and the parameters that produced them (engine,
+preprocessing, canvas, template). Vision AI results carry no OCR and are
+not archived.
+
+Record layout (little endian):
+    b"OCR\\x01" | u32 meta length | u32 body length | u32 crc32(meta + body) | meta | body
+meta is JSON, body is zlib-compressed JSON tokens. Reads skip torn or
+corrupt records by seeking to the next magic, so a crash mid-append costs
+that one record. Appends take an exclusive file lock (POSIX), so batch
+workers can share one archive.
+
+    python project.py --reparse -o fresh.jsonl [-w 8] [--reparse-all]
+    python -m scanner.archive stats
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .config import ARCHIVE_PATH
+from .settings import disabled
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends rely on O_APPEND alone
+    fcntl = None
+
+# Set INVOICE_SCANNER_ARCHIVE to another file, or to "off"
+ARCHIVE_ENV = "INVOICE_SCANNER_ARCHIVE"
+
+MAGIC = b"OCR\x01"
+HEADER = struct.Struct("<4sIII")
+# Records are small; anything larger is a misread length
+MAX_RECORD = 64 << 20
+
+
+def encode_record(tokens: list[dict], meta: dict) -> bytes:
+    boxes = [t.get("box") for t in tokens]
+    body = {
+        "text": [t["text"] for t in tokens],
+        "confidence": [round(float(t.get("confidence") or 0), 3) for t in tokens],
+        "box": None if any(b is None for b in boxes) else [[int(v) for v in b] for b in boxes],
+    }
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode()
+    body_bytes = zlib.compress(json.dumps(body, separators=(",", ":")).encode(), 6)
+    crc = zlib.crc32(body_bytes, zlib.crc32(meta_bytes))
+    return HEADER.pack(MAGIC, len(meta_bytes), len(body_bytes), crc) + meta_bytes + body_bytes
+
+
+def decode_tokens(body: bytes) -> list[dict]:
+    data = json.loads(zlib.decompress(body))
+    boxes = data["box"]
+    tokens = []
+    for i, (text, conf) in enumerate(zip(data["text"], data["confidence"])):
+        tok = {"text": text, "confidence": conf}
+        if boxes is not None:
+            tok["box"] = boxes[i]
+        tokens.append(tok)
+    return tokens
+
+
+class OcrArchive:
+    """The archive file at `path`; see the module docstring for the format."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, tokens: list[dict], **meta):
+        record = encode_record(tokens, {"time": round(time.time(), 3), **meta})
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with self._lock, open(self.path, "ab") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                # One write per record, so concurrent appenders never interleave
+                f.write(record)
+                f.flush()
+        except OSError as e:
+            logging.warning(f"OCR archive write failed: {e}")
+
+    def scan(self, with_tokens: bool = False):
+        """
+        Yields (offset, meta, tokens or None) for every intact record in
+        file order. Pass offsets to read() to fetch tokens later.
+        """
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "rb") as f:
+            offset = 0
+            while True:
+                f.seek(offset)
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                magic, meta_len, body_len, crc = HEADER.unpack(header)
+                payload = f.read(meta_len + body_len) if magic == MAGIC and meta_len + body_len <= MAX_RECORD else b""
+                if len(payload) != meta_len + body_len or not payload or zlib.crc32(payload) != crc:
+                    nxt = self._resync(f, offset + 1)
+                    if nxt is None:
+                        return
+                    logging.warning(f"OCR archive: skipped {nxt - offset} damaged byte(s) at {offset}")
+                    offset = nxt
+                    continue
+
+                meta = json.loads(payload[:meta_len])
+                tokens = decode_tokens(payload[meta_len:]) if with_tokens else None
+                yield offset, meta, tokens
+                offset += HEADER.size + meta_len + body_len
+
+    def read(self, offset: int) -> tuple[dict, list[dict]]:
+        """(meta, tokens) of the record at `offset` (from scan())."""
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            _, meta_len, body_len, _ = HEADER.unpack(f.read(HEADER.size))
+            payload = f.read(meta_len + body_len)
+        return json.loads(payload[:meta_len]), decode_tokens(payload[meta_len:])
+
+    @staticmethod
+    def _resync(f, start: int) -> int | None:
+        """Offset of the next magic at or after `start`, or None at EOF."""
+        f.seek(start)
+        carry = b""
+        pos = start
+        while True:
+            chunk = f.read(1 << 16)
+            if not chunk:
+                return None
+            buf = carry + chunk
+            hit = buf.find(MAGIC)
+            if hit >= 0:
+                return pos - len(carry) + hit
+            carry = buf[-(len(MAGIC) - 1):]
+            pos += len(chunk)
+
+    def stats(self) -> dict:
+        records, receipts = 0, set()
+        for _, meta, _ in self.scan():
+            records += 1
+            receipts.add(meta.get("digest") or meta.get("path"))
+        size = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+        return {"path": self.path, "records": records, "receipts": len(receipts), "bytes": size}
+
+
+_ARCHIVE: OcrArchive | None = None
+_ARCHIVE_READY = False
+
+
+def get_archive() -> OcrArchive | None:
+    """
+    Process-wide archive, or None when disabled through
+    INVOICE_SCANNER_ARCHIVE=off (for the process, or the current job).
+    """
+    global _ARCHIVE, _ARCHIVE_READY
+    if disabled(ARCHIVE_ENV):
+        return None
+    if not _ARCHIVE_READY:
+        path = os.getenv(ARCHIVE_ENV, ARCHIVE_PATH)
+        if path and path.lower() not in ("off", "0", "false", "none"):
+            _ARCHIVE = OcrArchive(path)
+        _ARCHIVE_READY = True
+    return _ARCHIVE
+
+
+def set_archive(archive: OcrArchive | None):
+    """Overrides the process-wide archive (None disables archiving)."""
+    global _ARCHIVE, _ARCHIVE_READY
+    _ARCHIVE = archive
+    _ARCHIVE_READY = True
+
+
+# ---------- re-parse ----------
+
+def reparse_tokens(meta: dict, tokens: list[dict]) -> dict:
+    """
+    Parses archived tokens the way ScannerManager would today: template by
+    header keywords (the archived template if those no longer match), else
+    the generic parser.
+    """
+    from .config import HEADER_FRACTION
+    from .manager import TEMPLATES
+    from .parser import parse_receipt
+
+    header_h = meta.get("shape", [0])[0] * HEADER_FRACTION
+    header = [t for t in tokens if "box" not in t or t["box"][1] < header_h] if header_h else tokens
+    template = TEMPLATES.match(header) or TEMPLATES.get(meta.get("template"))
+    return template.parse(tokens) if template else parse_receipt(tokens)
+
+
+def _reparse_chunk(path: str, offsets: list[int]) -> list[tuple[dict | None, str | None]]:
+    """Worker: reads and parses a chunk of records. (result, None) or (None, error) each."""
+    archive = OcrArchive(path)
+    out = []
+    for offset in offsets:
+        try:
+            meta, tokens = archive.read(offset)
+            result = reparse_tokens(meta, tokens)
+            result["source"] = meta.get("path")
+            result["meta"] = {"resolution": meta.get("plan"), "archived": meta.get("time")}
+            out.append((result, None))
+        except Exception as e:
+            out.append((None, str(e)))
+    return out
+
+
+def reparse_archive(
+    archive: OcrArchive,
+    output: str,
+    workers: int = 1,
+    latest: bool = True,
+    chunk_size: int = 64,
+    writer_options: dict | None = None,
+) -> dict:
+    """
+    Re-parses archived OCR in parallel and appends the results to `output`
+    (.jsonl, .csv or .sqlite) through storage.open_writer with `writer_options`.
+    With `latest`, only the newest record of each receipt (by file digest)
+    is used. Returns counters for the run.
+    """
+    from .storage import open_writer
+
+    chosen: dict[str, int] = {}
+    offsets = []
+    for offset, meta, _ in archive.scan():
+        if latest:
+            chosen[meta.get("digest") or meta.get("path") or str(offset)] = offset
+        else:
+            offsets.append(offset)
+    if latest:
+        offsets = sorted(chosen.values())
+
+    stats = {"records": len(offsets), "ok": 0, "failed": 0}
+    if not offsets:
+        return stats
+
+    chunks = [offsets[i:i + chunk_size] for i in range(0, len(offsets), chunk_size)]
+    workers = max(1, min(workers, len(chunks)))
+    logging.info(f"Re-parsing {len(offsets)} archived receipt(s) with {workers} worker(s)...")
+
+    with open_writer(output, **(writer_options or {})) as writer, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_reparse_chunk, archive.path, chunk) for chunk in chunks]
+        for fut in as_completed(futures):
+            for result, error in fut.result():
+                if error is not None:
+                    logging.error(f"Re-parse failed: {error}")
+                    stats["failed"] += 1
+                    continue
+                writer.write(result)
+                stats["ok"] += 1
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the raw OCR archive.")
+    parser.add_argument("command", choices=["stats"])
+    args = parser.parse_args()
+
+    archive = get_archive()
+    if archive is None:
+        parser.error(f"The OCR archive is disabled ({ARCHIVE_ENV}=off)")
+    if args.command == "stats":
+        print(archive.stats())
+
+
+if __name__ == "__main__":
+    main()
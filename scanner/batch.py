@@ -0,0 +1,195 @@
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .config import ALLOWED_IMAGE_EXTENSIONS, OCR_BATCH_SIZE
+from .storage import open_writer
+
+
+def collect_images(specs: list[str]) -> list[str]:
+    """
+    Expands directories, globs and plain file paths into a sorted,
+    de-duplicated list of absolute image paths.
+    """
+    found: list[str] = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            candidates = []
+            for root, _, files in os.walk(spec):
+                candidates.extend(os.path.join(root, f) for f in files)
+        elif glob.has_magic(spec):
+            candidates = glob.glob(spec, recursive=True)
+        else:
+            candidates = [spec]
+
+        for path in sorted(candidates):
+            if not os.path.isfile(path):
+                logging.warning(f"Skipping missing path: {path}")
+                continue
+            if os.path.splitext(path)[1].lower() not in ALLOWED_IMAGE_EXTENSIONS:
+                continue
+            found.append(os.path.abspath(path))
+
+    # Keep the first occurrence so overlapping specs don't double-process
+    return list(dict.fromkeys(found))
+
+
+def file_key(path: str) -> str:
+    """Cheap change detector for an input file (size + mtime)."""
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+class Manifest:
+    """
+    Append-only JSONL checkpoint of processed images.
+    A receipt counts as done only if its last record is "ok" and the file
+    hasn't changed since, so failed or edited images are retried on resume.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: dict[str, str] = {}
+
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn last line from a crash
+                        continue
+                    if rec.get("status") == "ok":
+                        self.done[rec["path"]] = rec.get("key")
+                    else:
+                        self.done.pop(rec.get("path"), None)
+
+            # Terminate a torn line so the next record starts clean
+            with open(path, "rb+") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+
+    def is_done(self, path: str, key: str) -> bool:
+        return self.done.get(path) == key
+
+    def record(self, path: str, key: str, status: str, **extra):
+        rec = {"path": path, "key": key, "status": status, **extra}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(rec) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if status == "ok":
+            self.done[path] = key
+
+
+def _init_worker(lang=("en",), gpu=False, log_level=logging.INFO):
+    """Pool initializer: every worker warms up its own EasyOCR reader once."""
+    logging.basicConfig(level=log_level, format="%(levelname)s: [%(processName)s] %(message)s")
+    logging.getLogger("easyocr").setLevel(logging.WARNING)
+
+    from .ocr import warm_reader
+    warm_reader(lang, gpu)
+
+
+def _process_chunk(paths: list[str], receipt_options: dict) -> list[tuple[dict | None, str | None]]:
+    """
+    Runs a chunk of receipts through one batched OCR pass.
+    Returns (result, None) or (None, error message) per path, in order;
+    error strings because not every exception pickles back to the parent.
+    """
+    # Heavy imports live in the workers, the parent only coordinates
+    from .manager import ScannerManager
+    from .preprocess import ReceiptImage
+
+    results = ScannerManager.process_many([ReceiptImage(p, **receipt_options) for p in paths])
+    return [(None, str(r)) if isinstance(r, Exception) else (r, None) for r in results]
+
+
+def run_batch(
+    paths: list[str],
+    output: str,
+    workers: int = 1,
+    manifest_path: str | None = None,
+    receipt_options: dict | None = None,
+    batch_size: int = OCR_BATCH_SIZE,
+    writer_options: dict | None = None,
+) -> dict:
+    """
+    Processes `paths` over a pool of `workers` processes and appends each
+    result to `output` as soon as it is ready. Each worker takes chunks of
+    `batch_size` images and OCRs them with batched EasyOCR calls. Completed images are logged to
+    the manifest, so re-running the same command resumes a crashed batch.
+    `receipt_options` are passed to ReceiptImage (profile, crop, adaptive),
+    `writer_options` to the output writer (fsync, max_bytes).
+    Duplicates of receipts scanned before (scanner/dedup.py) reuse that
+    receipt's result and are written with a "duplicate_of" flag. Returns
+    counters for the run.
+    """
+    manifest = Manifest(manifest_path or f"{output}.manifest.jsonl")
+
+    pending = []
+    for path in paths:
+        key = file_key(path)
+        if not manifest.is_done(path, key):
+            pending.append((path, key))
+
+    stats = {"total": len(paths), "skipped": len(paths) - len(pending), "ok": 0, "failed": 0, "duplicates": 0}
+    if stats["skipped"]:
+        logging.info(f"Resuming: {stats['skipped']} image(s) already processed per {manifest.path}")
+    if not pending:
+        return stats
+
+    batch_size = max(1, batch_size)
+    chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    workers = max(1, min(workers, len(chunks)))
+    logging.info(f"Processing {len(pending)} image(s) in batches of {batch_size} with {workers} worker(s)...")
+
+    init_args = (("en",), False, logging.getLogger().getEffectiveLevel())
+    with open_writer(output, **(writer_options or {})) as writer, ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as pool:
+        futures = {
+            pool.submit(_process_chunk, [path for path, _ in chunk], receipt_options or {}): (chunk, time.perf_counter())
+            for chunk in chunks
+        }
+
+        for fut in as_completed(futures):
+            chunk, submitted = futures[fut]
+            try:
+                outcomes = fut.result()
+            except Exception as e:
+                # The worker itself died; the whole chunk is retried on resume
+                outcomes = [(None, str(e))] * len(chunk)
+            elapsed = round((time.perf_counter() - submitted) / len(chunk), 3)
+
+            saved = []
+            for (path, key), (result, error) in zip(chunk, outcomes):
+                if error is not None:
+                    logging.error(f"Failed to process {path}: {error}")
+                    manifest.record(path, key, "error", error=error)
+                    stats["failed"] += 1
+                    continue
+                result["source"] = path
+                writer.write(result)
+                saved.append((path, key, result.get("duplicate_of")))
+
+            # Save before checkpointing: a crash in between re-processes
+            # the chunk instead of losing it
+            writer.flush()
+            for path, key, duplicate_of in saved:
+                if duplicate_of:
+                    # Another copy of a receipt already scanned: written with
+                    # its "duplicate_of" flag, so totals can leave it out and
+                    # a wrong match can still be found and re-scanned
+                    logging.warning(f"{path} looks like a duplicate of {duplicate_of['source']}")
+                    manifest.record(path, key, "ok", elapsed=elapsed, duplicate_of=duplicate_of["source"])
+                    stats["duplicates"] += 1
+                else:
+                    manifest.record(path, key, "ok", elapsed=elapsed)
+                    stats["ok"] += 1
+
+    return stats
@@ -0,0 +1,212 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+
+import numpy as np
+
+from .config import CACHE_DIR, CACHE_MAX_BYTES
+from .settings import disabled
+
+# Set INVOICE_SCANNER_CACHE to a directory to relocate the cache, or to "off"
+CACHE_ENV = "INVOICE_SCANNER_CACHE"
+
+
+def digest(*parts) -> str:
+    """
+    Content hash used as cache key. Arrays contribute their shape, dtype and
+    raw bytes; anything else its repr (parameters, language tuples, ...).
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(f"{part.shape}{part.dtype}".encode())
+            h.update(np.ascontiguousarray(part).data)
+        elif isinstance(part, bytes):
+            h.update(part)
+        else:
+            h.update(repr(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class OcrCache:
+    """
+    Content-addressed store of NumPy arrays on disk (one .npz per key).
+
+    - Writes go to a temp file in the target directory and are renamed into
+      place, so concurrent processes never observe half-written entries.
+    - Reads touch the file's mtime, which makes mtime the LRU clock.
+    - Once the directory grows past `max_bytes` the least recently used
+      entries are dropped until it is back under 90% of the budget.
+    Hit/miss counters are per process.
+    """
+
+    def __init__(self, root: str, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None  # lazily measured, then tracked on put
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.npz")
+
+    def get(self, key: str) -> dict[str, np.ndarray] | None:
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+            os.utime(path)
+        except OSError:
+            # Missing, or evicted by another process meanwhile
+            with self._lock:
+                self.misses += 1
+            return None
+        except (ValueError, EOFError, zipfile.BadZipFile) as e:
+            # Truncated or corrupt: dropped, so the next put writes it afresh
+            logging.warning(f"OCR cache entry {path} is unreadable, removing it: {e}")
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                size = 0
+            with self._lock:
+                self.misses += 1
+                if self._size is not None:
+                    self._size -= size
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return arrays
+
+    def put(self, key: str, **arrays: np.ndarray):
+        path = self._path(key)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"OCR cache write failed: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._measure()
+            else:
+                self._size += size
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(".npz"):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _measure(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Drops least recently used entries until the cache fits in 90% of max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Another process got there first (or the file is in use on Windows)
+                continue
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self._size = total
+            self.evictions += removed
+        if removed:
+            logging.debug(f"OCR cache evicted {removed} entries ({total} bytes left)")
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._size = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+_CACHE: OcrCache | None = None
+_CACHE_READY = False
+
+
+def get_cache() -> OcrCache | None:
+    """
+    Process-wide cache, or None when disabled through INVOICE_SCANNER_CACHE=off
+    (for the whole process, or the current job: scanner/settings.py).
+    """
+    global _CACHE, _CACHE_READY
+    if disabled(CACHE_ENV):
+        return None
+    if not _CACHE_READY:
+        root = os.getenv(CACHE_ENV, CACHE_DIR)
+        if root and root.lower() not in ("off", "0", "false", "none"):
+            try:
+                _CACHE = OcrCache(root)
+            except OSError as e:
+                logging.warning(f"OCR cache disabled, cannot use {root}: {e}")
+        _CACHE_READY = True
+    return _CACHE
+
+
+def set_cache(cache: OcrCache | None):
+    """Overrides the process-wide cache (None disables caching)."""
+    global _CACHE, _CACHE_READY
+    _CACHE = cache
+    _CACHE_READY = True
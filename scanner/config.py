@@ -1,10 +1,107 @@
+import getpass
+import os
+import tempfile
+
 import regex as re
 
 STORAGE_FOLDER = "samples"
 
-SAVE_EXTENSIONS = {".jsonl", ".json", ".csv"}
+SAVE_EXTENSIONS = {".jsonl", ".json", ".csv", ".sqlite"}
 ALLOWED_IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg"}
 
+# Appending results (storage.ResultWriter): receipts buffered per write, the
+# longest a buffered receipt waits (checked on the next write), and when to
+# fsync: "always" (every flush), "close" or "never"
+WRITER_FLUSH_EVERY = 64
+WRITER_FLUSH_SECONDS = 1.0
+WRITER_FSYNC = "always"
+
+# Top share of the receipt used for store detection
+HEADER_FRACTION = 0.25
+# Detect text once on the full page and reuse the regions for the header
+# and body passes instead of OCR-ing the header crop twice
+SINGLE_PASS_OCR = True
+
+# Preprocessing profiles:
+#   quality - full-resolution NL-means denoise + median background (slowest)
+#   fast    - cheaper denoise before upscaling, background at 1/4 resolution
+#   none    - resize + grayscale only
+PREPROCESS_PROFILES = ("quality", "fast", "none")
+PREPROCESS_PROFILE = "quality"
+# Cut the receipt out of the photo (and fix perspective) before preprocessing
+AUTO_CROP = True
+# Pick upscale factor and OCR canvas from measured glyph height instead of
+# the fixed "at least 2000px tall, canvas 2560" rule
+ADAPTIVE_RESOLUTION = True
+
+# Strip-tiled OCR for long receipts: worker processes (0 = off), strip size
+# and overlap in pixels of the preprocessed image. The overlap must exceed a
+# couple of text lines so every line is whole in at least one strip.
+OCR_TILE_WORKERS = 0
+OCR_TILE_HEIGHT = 1600
+OCR_TILE_OVERLAP = 200
+
+# OCR backend: "easyocr" (PyTorch), "onnx" or "onnx-int8" (ONNX Runtime, CPU).
+# The ONNX engines need models exported with: python -m scanner.engines.onnx_engine export
+OCR_ENGINES = ("easyocr", "onnx", "onnx-int8")
+OCR_ENGINE = "easyocr"
+ONNX_MODEL_DIR = os.getenv(
+    "INVOICE_SCANNER_ONNX_DIR", os.path.join(os.path.expanduser("~"), ".cache", "InvoiceScanner", "onnx")
+)
+
+# OCR engines per process; each holds its own model copy (~100+ MB), so
+# raise this only for hosts running several scans at once (GUI, daemon)
+OCR_READER_POOL_SIZE = int(os.getenv("INVOICE_SCANNER_READERS", "1"))
+
+# Receipts per batched EasyOCR call in batch mode (1 = one call per receipt)
+OCR_BATCH_SIZE = 4
+
+# OpenAI Vision (scanner/openai_service.py): model, requests in flight per
+# process (per event loop for async callers), and retries of rate limits
+# (429), server errors (5xx) and dropped connections: jittered exponential
+# backoff from VISION_BACKOFF up to VISION_BACKOFF_MAX seconds, given up once
+# a call has taken VISION_DEADLINE seconds
+VISION_MODEL = "gpt-4o-mini"
+VISION_CONCURRENCY = int(os.getenv("INVOICE_SCANNER_VISION_CONCURRENCY", "4"))
+VISION_BACKOFF = 0.5
+VISION_BACKOFF_MAX = 8.0
+VISION_DEADLINE = 60.0
+
+# Batch pipeline (project.py --batch --pipeline): receipts waiting between two
+# stages before the earlier stage pauses, and Vision AI requests in flight
+PIPELINE_QUEUE_SIZE = 8
+PIPELINE_VISION_WORKERS = VISION_CONCURRENCY
+
+# Peak memory one receipt's preprocessing may use. Huge photos are decoded at
+# reduced size and the OCR resolution is lowered to stay under it
+MEMORY_BUDGET_MB = int(os.getenv("INVOICE_SCANNER_MEMORY_MB", "1024"))
+
+# Unix socket of the warm OCR daemon (python -m scanner.daemon)
+DAEMON_SOCKET = os.path.join(tempfile.gettempdir(), f"invoicescanner-{getpass.getuser()}.sock")
+
+# On-disk cache for preprocessed images and OCR output
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "InvoiceScanner")
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Header fingerprints of receipts matched to a template, so repeat stores are
+# routed without the header OCR pass. A match needs this many geometrically
+# consistent ORB features; weaker ones fall back to OCR
+HEADER_INDEX_PATH = os.path.join(CACHE_DIR, "headers.npz")
+HEADER_INDEX_MIN_INLIERS = 20
+HEADER_INDEX_MAX_ENTRIES = 256
+
+# Perceptual hashes of scanned receipts and their results: a new photo within
+# this many of 256 bits (and of similar proportions) of an earlier receipt is
+# flagged as a copy of it (batch runs reuse the earlier result instead of
+# OCR-ing it again)
+DEDUP_PATH = os.path.join(CACHE_DIR, "duplicates.jsonl")
+DEDUP_MAX_DISTANCE = 40
+DEDUP_MAX_ASPECT = 0.15
+
+# Raw OCR tokens of every locally scanned receipt, for re-parsing after
+# parser/template changes without OCR (python project.py --reparse)
+ARCHIVE_PATH = os.path.join(CACHE_DIR, "ocr_archive.bin")
+
 # price tags (-) 12.34/12,34
 PRICE_RX = re.compile(r"-?\d+[.,]\d{2}\b")
 STOP_WORDS = ("total", "subtotal", "grand total", "payment", "tax")
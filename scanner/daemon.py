@@ -0,0 +1,221 @@
+"""
+Long-lived OCR worker: keeps EasyOCR readers warm and serves scan jobs over
+a Unix socket, so CLI runs skip the torch import and model load.
+
+    python -m scanner.daemon [--socket PATH]
+
+Protocol: one JSON object per line in each direction.
+    -> {"op": "scan", "path": "/abs/receipt.jpg", "options": {...}, "tile_workers": 0, "settings": {...}}
+    <- {"ok": true, "result": {...}}  |  {"ok": false, "error": "..."}
+    -> {"op": "scan_many", "paths": [...], "options": {...}, "settings": {...}}
+    <- {"ok": true, "results": [{"ok": true, "result": {...}} | {"ok": false, "error": "..."}, ...]}
+    -> {"op": "ping"}                 <- {"ok": true}
+    -> {"op": "stats"}                <- {"ok": true, "readers": {...}, "cache": {...}, "headers": {...}}
+Connections are served on their own threads; concurrent scans share the
+process reader pool (INVOICE_SCANNER_READERS readers). "settings" are the
+client's per-job switches ({"INVOICE_SCANNER_CACHE": "off", ...}), applied
+to that job only (scanner/settings.py), as the daemon's own environment
+isn't the client's.
+Unix sockets only exist on POSIX; elsewhere the client reports no daemon.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+
+from .config import DAEMON_SOCKET
+
+# Scans can take a while; connecting must not
+CONNECT_TIMEOUT = 0.5
+SCAN_TIMEOUT = 600
+
+
+def socket_path() -> str:
+    return os.getenv("INVOICE_SCANNER_SOCKET", DAEMON_SOCKET)
+
+
+def _send(sock: socket.socket, msg: dict):
+    sock.sendall(json.dumps(msg).encode() + b"\n")
+
+
+def _recv(rfile) -> dict | None:
+    line = rfile.readline()
+    return json.loads(line) if line else None
+
+
+# ---------- client ----------
+
+def request(msg: dict, path: str | None = None, timeout: float = SCAN_TIMEOUT) -> dict | None:
+    """Sends one job to the daemon. Returns None when no daemon is listening."""
+    path = path or socket_path()
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(path)
+    except OSError:
+        # Stale socket file from a daemon that died
+        sock.close()
+        return None
+
+    with sock, sock.makefile("rb") as rfile:
+        sock.settimeout(timeout)
+        _send(sock, msg)
+        return _recv(rfile)
+
+
+def scan_via_daemon(
+    image_path: str, options: dict | None = None, tile_workers: int = 0, settings: dict | None = None
+) -> dict | None:
+    """
+    Runs the full pipeline for `image_path` inside the daemon, with the job
+    `settings` (environment variables) on top of the daemon's environment.
+    Returns the result dict, or None if no daemon is running (caller falls
+    back to in-process OCR). Errors raised by the pipeline are re-raised.
+    """
+    reply = request({
+        "op": "scan",
+        "path": os.path.abspath(image_path),
+        "options": options or {},
+        "tile_workers": tile_workers,
+        "settings": settings or {},
+    })
+    if reply is None:
+        return None
+    if not reply.get("ok"):
+        raise RuntimeError(reply.get("error", "OCR daemon failed"))
+    return reply["result"]
+
+
+def scan_many_via_daemon(
+    image_paths: list[str], options: dict | None = None, settings: dict | None = None
+) -> list[dict | Exception] | None:
+    """
+    Batched scan of several receipts inside the daemon (one batched OCR call
+    per pass), with the job `settings` as in scan_via_daemon. Returns per-path results or RuntimeErrors, in order, or None
+    if no daemon is running.
+    """
+    reply = request({
+        "op": "scan_many",
+        "paths": [os.path.abspath(p) for p in image_paths],
+        "options": options or {},
+        "settings": settings or {},
+    })
+    if reply is None:
+        return None
+    if not reply.get("ok"):
+        raise RuntimeError(reply.get("error", "OCR daemon failed"))
+    return [r["result"] if r.get("ok") else RuntimeError(r.get("error")) for r in reply["results"]]
+
+
+# ---------- server ----------
+
+class ScanHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                msg = _recv(self.rfile)
+            except (OSError, json.JSONDecodeError) as e:
+                logging.warning(f"Bad request: {e}")
+                return
+            if msg is None:
+                return
+
+            try:
+                reply = {"ok": True, **self.server.dispatch(msg)}
+            except Exception as e:
+                logging.error(f"Job failed: {e}")
+                reply = {"ok": False, "error": str(e)}
+
+            try:
+                _send(self.request, reply)
+            except OSError:
+                return
+
+
+class ScanServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """One thread per connection; readers are checked out of the shared pool per OCR call."""
+
+    daemon_threads = True
+
+    def dispatch(self, msg: dict) -> dict:
+        op = msg.get("op")
+        if op == "ping":
+            return {}
+        if op == "stats":
+            from .cache import get_cache
+            from .fingerprint import get_header_index
+            from .ocr import _READER_POOLS
+
+            cache = get_cache()
+            headers = get_header_index()
+            return {
+                "readers": {f"{engine}:{'+'.join(lang)}": pool.stats() for (engine, lang), pool in _READER_POOLS.items()},
+                "cache": cache.stats() if cache else None,
+                "headers": headers.stats() if headers else None,
+            }
+        if op in ("scan", "scan_many"):
+            from .settings import job_settings
+
+            # This thread only: other connections run their own jobs
+            with job_settings(msg.get("settings")):
+                return self.scan(msg)
+        raise ValueError(f"Unknown op: {op}")
+
+    def scan(self, msg: dict) -> dict:
+        from .manager import ScannerManager
+        from .preprocess import ReceiptImage
+
+        options = msg.get("options", {})
+        if msg["op"] == "scan":
+            logging.info(f"Scanning {msg['path']}")
+            receipt = ReceiptImage(msg["path"], **options)
+            result = ScannerManager.process(receipt, tile_workers=msg.get("tile_workers", 0))
+            return {"result": result}
+
+        logging.info(f"Scanning {len(msg['paths'])} receipt(s) batched")
+        results = ScannerManager.process_many([ReceiptImage(p, **options) for p in msg["paths"]])
+        return {"results": [
+            {"ok": False, "error": str(r)} if isinstance(r, Exception) else {"ok": True, "result": r}
+            for r in results
+        ]}
+
+
+def serve(path: str | None = None, lang=("en",), gpu=False):
+    path = path or socket_path()
+
+    if os.path.exists(path):
+        if request({"op": "ping"}, path, timeout=CONNECT_TIMEOUT) is not None:
+            raise RuntimeError(f"An OCR daemon is already listening on {path}")
+        os.remove(path)
+
+    from .ocr import warm_reader
+    warm_reader(lang, gpu)
+
+    with ScanServer(path, ScanHandler) as server:
+        os.chmod(path, 0o600)
+        logging.info(f"OCR daemon ready on {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logging.info("Shutting down OCR daemon")
+        finally:
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep OCR models warm for project.py.")
+    parser.add_argument("--socket", default=None, help=f"Unix socket path (default: {socket_path()})")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    logging.getLogger("easyocr").setLevel(logging.WARNING)
+    serve(args.socket)
+
+
+if __name__ == "__main__":
+    main()
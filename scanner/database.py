@@ -0,0 +1,327 @@
+"""
+SQLite receipt store: receipts and their items in two indexed tables, so
+spend by store, date or item is a query instead of a scan of the JSONL/CSV
+history.
+
+    receipts(id, source, store, date, total, scanned_at, data, duplicate_of)
+    items(receipt_id, position, name, price)
+
+`date` is the receipt's own "date" when the parser provides one, otherwise
+the day it was stored (YYYY-MM-DD). `data` keeps the full result as JSON.
+Receipts flagged "duplicate_of" (scanner/dedup.py) are stored, with the
+earlier receipt's source in their own indexed column, but left out of spend
+and item history.
+Store and item names are indexed case-insensitively.
+
+ReceiptStore is also a result writer (see storage.open_writer): writes are
+buffered and inserted in one transaction per flush, in WAL mode, so readers
+never block the batch and several processes can write one database.
+
+    python -m scanner.database import invoices.jsonl old.csv --db receipts.sqlite
+    python -m scanner.database spend --db receipts.sqlite [--since 2026-01-01]
+    python -m scanner.database items "MILK" --db receipts.sqlite
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .config import WRITER_FLUSH_EVERY, WRITER_FLUSH_SECONDS, WRITER_FSYNC
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    id INTEGER PRIMARY KEY,
+    source TEXT,
+    store TEXT COLLATE NOCASE,
+    date TEXT,
+    total REAL,
+    scanned_at REAL NOT NULL,
+    data TEXT NOT NULL,
+    duplicate_of TEXT
+);
+CREATE TABLE IF NOT EXISTS items (
+    receipt_id INTEGER NOT NULL REFERENCES receipts(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT COLLATE NOCASE,
+    price REAL,
+    PRIMARY KEY (receipt_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS receipts_store ON receipts(store, date);
+CREATE INDEX IF NOT EXISTS receipts_date ON receipts(date);
+CREATE INDEX IF NOT EXISTS items_name ON items(name);
+"""
+
+# After the migration, as older databases get the duplicate_of column there
+INDEXES = """
+CREATE INDEX IF NOT EXISTS receipts_duplicate ON receipts(duplicate_of);
+"""
+
+# Copies of receipts already stored, written with their "duplicate_of" flag
+NOT_DUPLICATE = "receipts.duplicate_of IS NULL"
+
+# storage.FSYNC_POLICIES mapped onto SQLite's durability settings
+SYNCHRONOUS = {"always": "FULL", "close": "NORMAL", "never": "OFF"}
+
+
+def _receipt_row(data: dict, now: float) -> tuple:
+    date = data.get("date") or time.strftime("%Y-%m-%d", time.localtime(now))
+    duplicate_of = data.get("duplicate_of")
+    # Never NULL for a copy, even one of a receipt without a source
+    original = (duplicate_of.get("source") or "") if duplicate_of else None
+    return (data.get("source"), data.get("store"), date, data.get("total"), now, json.dumps(data), original)
+
+
+class ReceiptStore:
+    """
+    The receipt database at `path`, created on first use. write() buffers
+    like storage.ResultWriter and takes the same flush options; `fsync` maps
+    to PRAGMA synchronous. There is no size rotation.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_every: int = WRITER_FLUSH_EVERY,
+        flush_seconds: float = WRITER_FLUSH_SECONDS,
+        fsync: str = WRITER_FSYNC,
+        max_bytes: int = 0,
+    ):
+        if fsync not in SYNCHRONOUS:
+            raise ValueError(f"Unknown fsync policy {fsync!r}, expected one of {', '.join(SYNCHRONOUS)}")
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self.flush_seconds = flush_seconds
+
+        self._lock = threading.Lock()
+        self._buffer: list[dict] = []
+        self._since = time.monotonic()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Transactions are explicit (BEGIN in _insert)
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={SYNCHRONOUS[fsync]}")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._conn.executescript(INDEXES)
+
+    def _migrate(self):
+        """Adds duplicate_of to databases created before it, filled in from `data`."""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Checked under the write lock, as another process may be migrating too
+            if "duplicate_of" not in {row[1] for row in conn.execute("PRAGMA table_info(receipts)")}:
+                conn.execute("ALTER TABLE receipts ADD COLUMN duplicate_of TEXT")
+                conn.execute(
+                    "UPDATE receipts SET duplicate_of = COALESCE(json_extract(data, '$.duplicate_of.source'), '')"
+                    " WHERE json_extract(data, '$.duplicate_of') IS NOT NULL"
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------- writing ----------
+
+    def write(self, data: dict):
+        with self._lock:
+            if not self._buffer:
+                self._since = time.monotonic()
+            self._buffer.append(data)
+            if len(self._buffer) >= self.flush_every or time.monotonic() - self._since >= self.flush_seconds:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._insert(self._buffer)
+            self._buffer = []
+
+    def insert_many(self, results: list[dict]) -> int:
+        """Inserts `results` in one transaction, bypassing the buffer. Returns the count."""
+        with self._lock:
+            self._insert(results)
+        return len(results)
+
+    def _insert(self, results: list[dict]):
+        now = time.time()
+        conn = self._conn
+        # IMMEDIATE takes the write lock up front, so concurrent writers
+        # wait (busy timeout) instead of failing halfway through
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            items = []
+            for data in results:
+                receipt_id = conn.execute(
+                    "INSERT INTO receipts (source, store, date, total, scanned_at, data, duplicate_of) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    _receipt_row(data, now),
+                ).lastrowid
+                items.extend(
+                    (receipt_id, pos, item.get("name"), item.get("price"))
+                    for pos, item in enumerate(data.get("items") or [])
+                )
+            conn.executemany("INSERT INTO items (receipt_id, position, name, price) VALUES (?, ?, ?, ?)", items)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            self._flush()
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- import ----------
+
+    def import_file(self, path: str, batch: int = 1000) -> int:
+        """
+        Imports a .jsonl or .csv results file, `batch` receipts per
+        transaction. CSV keeps one row per item, so consecutive rows with the
+        same store and total are taken as one receipt. Returns the count.
+        """
+        ext = os.path.splitext(path)[1].lower()
+        if ext == ".jsonl":
+            receipts = _read_jsonl(path)
+        elif ext == ".csv":
+            receipts = _read_csv(path)
+        else:
+            raise ValueError(f"Can only import .jsonl or .csv, not {ext or path}")
+
+        count, chunk = 0, []
+        for data in receipts:
+            chunk.append(data)
+            if len(chunk) >= batch:
+                count += self.insert_many(chunk)
+                chunk = []
+        if chunk:
+            count += self.insert_many(chunk)
+        return count
+
+    # ---------- queries ----------
+
+    def _query(self, sql: str, params=()) -> list[tuple]:
+        with self._lock:
+            self._flush()
+            return self._conn.execute(sql, params).fetchall()
+
+    def spend_by_store(self, since: str | None = None, until: str | None = None) -> list[tuple[str, int, float]]:
+        """(store, receipts, total spent) between two YYYY-MM-DD dates (inclusive), biggest first."""
+        return self._query(
+            "SELECT store, COUNT(*), ROUND(SUM(total), 2) FROM receipts"
+            f" WHERE date >= ? AND date <= ? AND {NOT_DUPLICATE} GROUP BY store ORDER BY 3 DESC",
+            (since or "", until or "9999"),
+        )
+
+    def receipts(self, store: str | None = None, since: str | None = None, until: str | None = None) -> list[dict]:
+        """Stored results, optionally for one store (any case) and a date range, oldest first."""
+        sql = "SELECT data FROM receipts WHERE date >= ? AND date <= ?"
+        params = [since or "", until or "9999"]
+        if store is not None:
+            sql += " AND store = ?"
+            params.append(store)
+        return [json.loads(data) for (data,) in self._query(sql + " ORDER BY date, id", params)]
+
+    def item_history(self, name: str, prefix: bool = False) -> list[tuple[str, str, str, float]]:
+        """(date, store, item name, price) of every purchase of an item (any case), oldest first."""
+        if prefix:
+            # A range rather than LIKE, so it is always an index range scan
+            where, params = "items.name >= ? AND items.name < ?", (name, name + "\U0010ffff")
+        else:
+            where, params = "items.name = ?", (name,)
+        return self._query(
+            "SELECT receipts.date, receipts.store, items.name, items.price FROM items"
+            f" JOIN receipts ON receipts.id = items.receipt_id WHERE {where} AND {NOT_DUPLICATE}"
+            " ORDER BY receipts.date, receipts.id",
+            params,
+        )
+
+    def stats(self) -> dict:
+        (receipts,), = self._query("SELECT COUNT(*) FROM receipts")
+        (items,), = self._query("SELECT COUNT(*) FROM items")
+        return {"path": self.path, "receipts": receipts, "items": items}
+
+
+def _read_jsonl(path: str):
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"{path}:{n}: not valid JSON, skipped")
+
+
+def _read_csv(path: str):
+    def number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    current, key = None, None
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            row_key = (row.get("store"), row.get("total"))
+            if current is None or row_key != key:
+                if current is not None:
+                    yield current
+                current = {"store": row.get("store"), "items": [], "total": number(row.get("total"))}
+                key = row_key
+            # A receipt without items is written as one "N/A" row
+            if row.get("item_name") != "N/A":
+                current["items"].append({"name": row.get("item_name"), "price": number(row.get("price"))})
+    if current is not None:
+        yield current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import into and query the SQLite receipt store.")
+    parser.add_argument("command", choices=["import", "spend", "items", "stats"])
+    parser.add_argument("args", nargs="*", help="Files to import (import) or item name (items)")
+    parser.add_argument("--db", default="invoices.sqlite", help="Database file (default: invoices.sqlite)")
+    parser.add_argument("--since", help="First date, YYYY-MM-DD (spend)")
+    parser.add_argument("--until", help="Last date, YYYY-MM-DD (spend)")
+    parser.add_argument("--prefix", action="store_true", help="Match item names starting with the given text (items)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    with ReceiptStore(args.db) as store:
+        if args.command == "import":
+            if not args.args:
+                parser.error("import needs at least one .jsonl or .csv file")
+            for path in args.args:
+                logging.info(f"{path}: imported {store.import_file(path)} receipt(s)")
+            print(store.stats())
+        elif args.command == "spend":
+            for name, count, total in store.spend_by_store(args.since, args.until):
+                print(f"{name or '?':<30} {count:>6} {total or 0:>12.2f}")
+        elif args.command == "items":
+            if len(args.args) != 1:
+                parser.error("items needs one item name")
+            for date, name, item, price in store.item_history(args.args[0], prefix=args.prefix):
+                print(f"{date}  {name or '?':<20} {item:<35} {price if price is not None else '':>8}")
+        else:
+            print(store.stats())
+
+
+if __name__ == "__main__":
+    main()
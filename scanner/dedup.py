@@ -0,0 +1,271 @@
+"""
+Duplicate receipts caught before OCR: a perceptual hash of the cropped
+receipt, looked up in a persistent index of receipts already scanned.
+
+The hash is a 256-bit DCT hash of the receipt's ink (background divided
+out, margins trimmed), so another photo of the same receipt (new lighting,
+scale, slightly different crop) lands a small Hamming distance away, while
+receipts from the same store differ in their item rows. Receipts whose
+length/width ratio differs by more than DEDUP_MAX_ASPECT never match.
+
+The index is multi-index hashing: the hash is cut into 16 bands of 16 bits
+with one bucket table per band. Two hashes within DEDUP_MAX_DISTANCE bits
+agree within DEDUP_MAX_DISTANCE // 16 bits on at least one band, so a lookup
+only probes the band values that close to the query's and checks the
+candidates found there.
+
+Entries are appended to a JSONL file with the result they produced; other
+processes' appends are picked up on the next lookup.
+
+    python -m scanner.dedup stats
+    python -m scanner.dedup clear
+"""
+import argparse
+import copy
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from .config import DEDUP_MAX_ASPECT, DEDUP_MAX_DISTANCE, DEDUP_PATH
+from .settings import disabled
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends rely on O_APPEND alone
+    fcntl = None
+
+# Set INVOICE_SCANNER_DEDUP to another .jsonl path, or to "off"
+DEDUP_ENV = "INVOICE_SCANNER_DEDUP"
+
+# Receipts are scaled to this width before the ink is measured
+HASH_WIDTH = 256
+# Ink darker than this (0-1 below the local background) counts as print; rows
+# and columns with less than INK_MARGIN of it are blank margin
+INK_THRESHOLD = 0.1
+INK_MARGIN = 0.01
+# Trimmed ink resized to HASH_SIZE (w, h); the lowest HASH_FREQS (w, h) DCT
+# coefficients give the 256 bits. Receipts are tall, so most of the
+# frequencies go along the length, where item rows differ
+HASH_SIZE = (16, 256)
+HASH_FREQS = (8, 32)
+BANDS = 16
+BAND_BITS = 16
+
+
+def receipt_hash(image: np.ndarray) -> tuple[int, float]:
+    """(256-bit perceptual hash, length/width ratio of the inked area) of a cropped receipt."""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = image.shape[:2]
+    img = cv2.resize(image, (HASH_WIDTH, max(1, round(h * HASH_WIDTH / w))), interpolation=cv2.INTER_AREA)
+    img = img.astype(np.float32)
+
+    # Ink darkness relative to the local background, so lighting drops out
+    k = max(3, (min(img.shape) // 8) | 1)
+    ink = np.clip(1 - img / np.maximum(cv2.blur(img, (k, k)), 1), 0, 1)
+
+    # Trim blank margins, so the crop's slack doesn't shift the hash. The
+    # threshold is absolute: one relative to the mean ink would move with
+    # the photo's contrast and crop the same receipt differently
+    inked = ink > INK_THRESHOLD
+    rows = np.flatnonzero(inked.mean(axis=1) > INK_MARGIN)
+    cols = np.flatnonzero(inked.mean(axis=0) > INK_MARGIN)
+    if len(rows) and len(cols):
+        ink = ink[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+    coeffs = cv2.dct(cv2.resize(ink, HASH_SIZE, interpolation=cv2.INTER_AREA))
+    low = coeffs[:HASH_FREQS[1], :HASH_FREQS[0]].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big"), ink.shape[0] / ink.shape[1]
+
+
+def _bands(value: int) -> list[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+
+
+class DuplicateIndex:
+    """Hashes of scanned receipts with their results; see the module docstring."""
+
+    def __init__(self, path: str, max_distance: int = DEDUP_MAX_DISTANCE, max_aspect: float = DEDUP_MAX_ASPECT):
+        self.path = path
+        self.max_distance = max_distance
+        self.max_aspect = max_aspect
+        self._lock = threading.Lock()
+        self._entries: list[dict] = []
+        self._buckets: list[dict[int, list[int]]] = [{} for _ in range(BANDS)]
+        self._offset = 0
+        # Band values within the probe radius of 0, XOR-ed onto the query's
+        radius = max_distance // BANDS
+        self._probes = [
+            sum(1 << b for b in flips)
+            for r in range(radius + 1)
+            for flips in itertools.combinations(range(BAND_BITS), r)
+        ]
+
+    def matches(self, a: tuple[int, float], b: tuple[int, float]) -> int | None:
+        """Hamming distance between two (hash, aspect) keys, or None if they aren't duplicates."""
+        if abs(a[1] / b[1] - 1) > self.max_aspect:
+            return None
+        distance = (a[0] ^ b[0]).bit_count()
+        return distance if distance <= self.max_distance else None
+
+    def lookup(self, key: tuple[int, float]) -> tuple[dict, int] | None:
+        """(entry, distance) of the closest earlier receipt, or None."""
+        with self._lock:
+            self._refresh()
+            candidates = set()
+            for band, value in enumerate(_bands(key[0])):
+                bucket = self._buckets[band]
+                for probe in self._probes:
+                    candidates.update(bucket.get(value ^ probe, ()))
+
+            best = None
+            for i in candidates:
+                entry = self._entries[i]
+                distance = self.matches(key, (entry["hash"], entry["aspect"]))
+                if distance is not None and (best is None or distance < best[1]):
+                    best = (entry, distance)
+            return best
+
+    def duplicate_result(self, key: tuple[int, float]) -> dict | None:
+        """
+        Copy of the result stored for the closest earlier receipt, marked
+        with "duplicate_of": {"source", "distance"}; None if there is none.
+        """
+        hit = self.lookup(key)
+        if hit is None:
+            return None
+        entry, distance = hit
+        logging.info(f"Duplicate of {entry.get('source')} (distance {distance}), reusing its result")
+        return mark_duplicate(entry["result"], entry.get("source"), distance)
+
+    def add(self, key: tuple[int, float], result: dict, source: str | None = None):
+        result = {k: v for k, v in result.items() if k not in ("meta", "source", "duplicate_of")}
+        line = json.dumps({
+            "hash": f"{key[0]:064x}",
+            "aspect": round(key[1], 4),
+            "source": source,
+            "time": round(time.time(), 3),
+            "result": result,
+        }).encode() + b"\n"
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "ab+") as f:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_EX)
+                    # Terminate a torn line from a crash so this entry starts clean
+                    if f.seek(0, os.SEEK_END):
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            line = b"\n" + line
+                    f.write(line)
+            except OSError as e:
+                logging.warning(f"Duplicate index write failed: {e}")
+                return
+            # Our own line is read back like other processes' lines
+            self._refresh()
+
+    def _refresh(self):
+        """Indexes the lines appended to the file since the last read."""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size < self._offset:
+            # Cleared by another process
+            self._entries = []
+            self._buckets = [{} for _ in range(BANDS)]
+            self._offset = 0
+        if size == self._offset:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+        except OSError:
+            return
+        # A line still being written (no newline yet) waits for the next read
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+                entry["hash"] = int(entry["hash"], 16)
+            except (ValueError, KeyError, TypeError):
+                continue
+            i = len(self._entries)
+            self._entries.append(entry)
+            for band, value in enumerate(_bands(entry["hash"])):
+                self._buckets[band].setdefault(value, []).append(i)
+        self._offset += len(complete)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            return {"path": self.path, "receipts": len(self._entries)}
+
+    def clear(self):
+        with self._lock:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+            self._entries = []
+            self._buckets = [{} for _ in range(BANDS)]
+            self._offset = 0
+
+
+def mark_duplicate(result: dict, source: str | None, distance: int) -> dict:
+    result = copy.deepcopy(result)
+    result.pop("meta", None)
+    result["duplicate_of"] = {"source": source, "distance": distance}
+    return result
+
+
+_INDEX: DuplicateIndex | None = None
+_INDEX_READY = False
+
+
+def get_duplicate_index() -> DuplicateIndex | None:
+    """
+    Process-wide duplicate index, or None when disabled through
+    INVOICE_SCANNER_DEDUP=off (for the process, or the current job).
+    """
+    global _INDEX, _INDEX_READY
+    if disabled(DEDUP_ENV):
+        return None
+    if not _INDEX_READY:
+        path = os.getenv(DEDUP_ENV, DEDUP_PATH)
+        if path and path.lower() not in ("off", "0", "false", "none"):
+            _INDEX = DuplicateIndex(path)
+        _INDEX_READY = True
+    return _INDEX
+
+
+def set_duplicate_index(index: DuplicateIndex | None):
+    """Overrides the process-wide duplicate index (None disables deduplication)."""
+    global _INDEX, _INDEX_READY
+    _INDEX = index
+    _INDEX_READY = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the duplicate receipt index.")
+    parser.add_argument("command", choices=["stats", "clear"])
+    args = parser.parse_args()
+
+    index = get_duplicate_index()
+    if index is None:
+        parser.error(f"Duplicate detection is disabled ({DEDUP_ENV}=off)")
+    if args.command == "clear":
+        index.clear()
+    print(index.stats())
+
+
+if __name__ == "__main__":
+    main()
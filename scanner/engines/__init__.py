@@ -0,0 +1,28 @@
+from ..config import OCR_ENGINE, OCR_ENGINES
+from ..settings import getenv
+
+# Set INVOICE_SCANNER_ENGINE to one of OCR_ENGINES to switch backends
+ENGINE_ENV = "INVOICE_SCANNER_ENGINE"
+
+
+def engine_name() -> str:
+    """The current job's engine (scanner/settings.py), else the process's."""
+    return getenv(ENGINE_ENV) or OCR_ENGINE
+
+
+def create_engine(name: str | None = None, lang=("en",), gpu=False):
+    """
+    Instantiates the OCR backend `name` (see OCR_ENGINES), an OcrEngine.
+    Backends are imported here, so only the selected one's dependencies
+    (torch for easyocr, onnxruntime for onnx) are ever loaded.
+    """
+    name = name or engine_name()
+    if name == "easyocr":
+        from .easyocr_engine import EasyOcrEngine
+
+        return EasyOcrEngine(lang, gpu)
+    if name in ("onnx", "onnx-int8"):
+        from .onnx_engine import OnnxEngine
+
+        return OnnxEngine(lang, int8=name == "onnx-int8")
+    raise ValueError(f"Unknown OCR engine: {name}. Use: {', '.join(OCR_ENGINES)}")
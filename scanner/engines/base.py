@@ -0,0 +1,60 @@
+from abc import ABC, abstractmethod
+
+import cv2
+import numpy as np
+
+# readtext keyword arguments that belong to the detection half
+DETECT_KEYS = {
+    "min_size", "text_threshold", "low_text", "link_threshold", "canvas_size", "mag_ratio",
+    "slope_ths", "ycenter_ths", "height_ths", "width_ths", "add_margin",
+}
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    """Grayscale view of a gray, BGR or BGRA image (what the recognizers read)."""
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 1:
+        return image[:, :, 0]
+    code = cv2.COLOR_BGRA2GRAY if image.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+    return cv2.cvtColor(image, code)
+
+
+def split_params(params: dict) -> tuple[dict, dict]:
+    """Splits readtext keyword arguments into (detect, recognize) ones."""
+    detect = {k: v for k, v in params.items() if k in DETECT_KEYS}
+    recognize = {k: v for k, v in params.items() if k not in DETECT_KEYS}
+    return detect, recognize
+
+
+class OcrEngine(ABC):
+    """
+    Text detector + recognizer behind the OCR helpers in scanner.ocr.
+    Signatures follow easyocr.Reader so either backend can be swapped in:
+    detect() returns per-image (horizontal_list, free_list) and recognize()
+    returns (box, text, confidence) triples.
+    """
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """Identifier of the backend and its settings, part of OCR cache keys."""
+        pass
+
+    @abstractmethod
+    def detect(self, img, **params) -> tuple[list, list]:
+        """Finds text regions; lists are nested per input image."""
+        pass
+
+    @abstractmethod
+    def recognize(self, img_cv_grey, horizontal_list=None, free_list=None, reformat=True, **params) -> list:
+        """Reads the text inside already detected regions of a grayscale image."""
+        pass
+
+    def readtext(self, image, **params) -> list:
+        detect_params, recognize_params = split_params(params)
+        horizontal_list, free_list = self.detect(image, **detect_params)
+        return self.recognize(to_gray(image), horizontal_list[0], free_list[0], reformat=False, **recognize_params)
+
+    def readtext_batched(self, images: list, batch_size: int = 1, **params) -> list[list]:
+        return [self.readtext(image, **params) for image in images]
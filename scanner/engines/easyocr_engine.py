@@ -0,0 +1,24 @@
+from .base import OcrEngine
+
+
+class EasyOcrEngine(OcrEngine):
+    """The stock easyocr.Reader (PyTorch). Importing it loads torch."""
+
+    name = "easyocr"
+
+    def __init__(self, lang=("en",), gpu=False):
+        import easyocr
+
+        self.reader = easyocr.Reader(list(lang), gpu=gpu)
+
+    def detect(self, img, **params):
+        return self.reader.detect(img, **params)
+
+    def recognize(self, img_cv_grey, horizontal_list=None, free_list=None, reformat=True, **params):
+        return self.reader.recognize(img_cv_grey, horizontal_list, free_list, reformat=reformat, **params)
+
+    def readtext(self, image, **params):
+        return self.reader.readtext(image, **params)
+
+    def readtext_batched(self, images, batch_size=1, **params):
+        return self.reader.readtext_batched(images, batch_size=batch_size, **params)
@@ -0,0 +1,540 @@
+"""
+EasyOCR's CRAFT detector and CRNN recognizer run under ONNX Runtime.
+
+The networks are exported once from an installed EasyOCR (needs torch and
+the downloaded weights); scanning afterwards only needs onnxruntime:
+
+    python -m scanner.engines.onnx_engine export [--dir DIR] [--lang en] [--calibration samples/] [--no-int8]
+
+Pre- and post-processing mirror easyocr 1.7 (greedy decoding, CPU path) so
+results match the PyTorch reader up to float rounding (vertical crops are
+resampled by OpenCV instead of PIL).
+
+The int8 variant quantizes convolutions statically (QDQ, per channel, with
+activation ranges calibrated on real receipts) and the recognizer's LSTM /
+linear layers dynamically. Dynamic int8 convolutions are avoided: ONNX
+Runtime's ConvInteger kernels are several times slower than float on CPU.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+
+import cv2
+import numpy as np
+
+from ..config import ALLOWED_IMAGE_EXTENSIONS, ONNX_MODEL_DIR, STORAGE_FOLDER
+from .base import OcrEngine, to_gray
+
+META_FILE = "meta.json"
+MODEL_FILES = {
+    False: ("detector.onnx", "recognizer.onnx"),
+    True: ("detector.int8.onnx", "recognizer.int8.onnx"),
+}
+
+
+def model_dir(lang=("en",), root: str = ONNX_MODEL_DIR) -> str:
+    return os.path.join(root, "-".join(sorted(lang)))
+
+
+# ---------- detection (CRAFT) ----------
+
+def resize_to_canvas(img: np.ndarray, canvas_size: int, mag_ratio: float = 1.0) -> tuple[np.ndarray, float]:
+    """Fits `img` into `canvas_size` and zero-pads both sides to a multiple of 32."""
+    h, w = img.shape[:2]
+    target = min(mag_ratio * max(h, w), canvas_size)
+    ratio = target / max(h, w)
+    th, tw = int(h * ratio), int(w * ratio)
+    proc = cv2.resize(img, (tw, th), interpolation=cv2.INTER_LINEAR)
+
+    out = np.zeros((th + (-th % 32), tw + (-tw % 32), 3), dtype=np.float32)
+    out[:th, :tw] = proc
+    return out, ratio
+
+
+def normalize(img: np.ndarray) -> np.ndarray:
+    mean = np.array((0.485, 0.456, 0.406), dtype=np.float32) * 255.0
+    std = np.array((0.229, 0.224, 0.225), dtype=np.float32) * 255.0
+    return (img - mean) / std
+
+
+def det_boxes(textmap: np.ndarray, linkmap: np.ndarray, text_threshold: float, link_threshold: float, low_text: float) -> list[np.ndarray]:
+    """
+    CRAFT score maps -> rotated word boxes (4 points, heatmap coordinates).
+    Same as easyocr's getDetBoxes_core, but every component is handled
+    inside its own bounding window instead of a full-size mask.
+    """
+    img_h, img_w = textmap.shape
+    _, text_score = cv2.threshold(textmap, low_text, 1, 0)
+    _, link_score = cv2.threshold(linkmap, link_threshold, 1, 0)
+    combined = np.clip(text_score + link_score, 0, 1).astype(np.uint8)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(combined, connectivity=4)
+    link_only = (link_score == 1) & (text_score == 0)
+
+    boxes = []
+    for k in range(1, n):
+        size = stats[k, cv2.CC_STAT_AREA]
+        if size < 10:
+            continue
+        x, y = stats[k, cv2.CC_STAT_LEFT], stats[k, cv2.CC_STAT_TOP]
+        w, h = stats[k, cv2.CC_STAT_WIDTH], stats[k, cv2.CC_STAT_HEIGHT]
+        own = labels[y:y + h, x:x + w] == k
+        if textmap[y:y + h, x:x + w][own].max() < text_threshold:
+            continue
+
+        niter = int(math.sqrt(size * min(w, h) / (w * h)) * 2)
+        sx, sy = max(x - niter, 0), max(y - niter, 0)
+        ex, ey = min(x + w + niter + 1, img_w), min(y + h + niter + 1, img_h)
+        segmap = np.zeros((ey - sy, ex - sx), dtype=np.uint8)
+        segmap[y - sy:y - sy + h, x - sx:x - sx + w][own] = 255
+        segmap[link_only[sy:ey, sx:ex]] = 0
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1 + niter, 1 + niter))
+        segmap = cv2.dilate(segmap, kernel)
+
+        ys, xs = np.nonzero(segmap)
+        pts = np.stack((xs + sx, ys + sy), axis=1)
+        box = cv2.boxPoints(cv2.minAreaRect(pts))
+
+        # Near-square boxes: use the axis-aligned extent ("diamond" fix)
+        bw, bh = np.linalg.norm(box[0] - box[1]), np.linalg.norm(box[1] - box[2])
+        if abs(1 - max(bw, bh) / (min(bw, bh) + 1e-5)) <= 0.1:
+            l, r, t, b = pts[:, 0].min(), pts[:, 0].max(), pts[:, 1].min(), pts[:, 1].max()
+            box = np.array([[l, t], [r, t], [r, b], [l, b]], dtype=np.float32)
+
+        # Clockwise from top-left
+        box = np.roll(box, 4 - box.sum(axis=1).argmin(), 0)
+        boxes.append(box)
+    return boxes
+
+
+def group_text_box(polys, slope_ths=0.1, ycenter_ths=0.5, height_ths=0.5, width_ths=1.0, add_margin=0.05):
+    """easyocr.utils.group_text_box: word boxes -> merged line boxes + rotated boxes."""
+    horizontal_list, free_list, combined_list, merged_list = [], [], [], []
+
+    for poly in polys:
+        slope_up = (poly[3] - poly[1]) / np.maximum(10, (poly[2] - poly[0]))
+        slope_down = (poly[5] - poly[7]) / np.maximum(10, (poly[4] - poly[6]))
+        if max(abs(slope_up), abs(slope_down)) < slope_ths:
+            x_max = max(poly[0], poly[2], poly[4], poly[6])
+            x_min = min(poly[0], poly[2], poly[4], poly[6])
+            y_max = max(poly[1], poly[3], poly[5], poly[7])
+            y_min = min(poly[1], poly[3], poly[5], poly[7])
+            horizontal_list.append([x_min, x_max, y_min, y_max, 0.5 * (y_min + y_max), y_max - y_min])
+        else:
+            height = np.linalg.norm([poly[6] - poly[0], poly[7] - poly[1]])
+            width = np.linalg.norm([poly[2] - poly[0], poly[3] - poly[1]])
+            margin = int(1.44 * add_margin * min(width, height))
+
+            theta13 = abs(np.arctan((poly[1] - poly[5]) / np.maximum(10, (poly[0] - poly[4]))))
+            theta24 = abs(np.arctan((poly[3] - poly[7]) / np.maximum(10, (poly[2] - poly[6]))))
+            free_list.append([
+                [poly[0] - np.cos(theta13) * margin, poly[1] - np.sin(theta13) * margin],
+                [poly[2] + np.cos(theta24) * margin, poly[3] - np.sin(theta24) * margin],
+                [poly[4] + np.cos(theta13) * margin, poly[5] + np.sin(theta13) * margin],
+                [poly[6] - np.cos(theta24) * margin, poly[7] + np.sin(theta24) * margin],
+            ])
+    horizontal_list = sorted(horizontal_list, key=lambda item: item[4])
+
+    # Boxes on the same text line
+    new_box = []
+    for poly in horizontal_list:
+        if new_box and abs(np.mean(b_ycenter) - poly[4]) < ycenter_ths * np.mean(b_height):
+            b_height.append(poly[5])
+            b_ycenter.append(poly[4])
+            new_box.append(poly)
+        else:
+            if new_box:
+                combined_list.append(new_box)
+            b_height, b_ycenter, new_box = [poly[5]], [poly[4]], [poly]
+    combined_list.append(new_box)
+
+    # Merge close boxes of similar height within each line
+    for boxes in combined_list:
+        if not boxes:
+            continue
+        if len(boxes) == 1:
+            box = boxes[0]
+            margin = int(add_margin * min(box[1] - box[0], box[5]))
+            merged_list.append([box[0] - margin, box[1] + margin, box[2] - margin, box[3] + margin])
+            continue
+
+        merged_box, new_box = [], []
+        for box in sorted(boxes, key=lambda item: item[0]):
+            if new_box and abs(np.mean(b_height) - box[5]) < height_ths * np.mean(b_height) \
+                    and (box[0] - x_max) < width_ths * (box[3] - box[2]):
+                b_height.append(box[5])
+                new_box.append(box)
+            else:
+                if new_box:
+                    merged_box.append(new_box)
+                b_height, new_box = [box[5]], [box]
+            x_max = box[1]
+        if new_box:
+            merged_box.append(new_box)
+
+        for mbox in merged_box:
+            x_min = min(b[0] for b in mbox)
+            x_max = max(b[1] for b in mbox)
+            y_min = min(b[2] for b in mbox)
+            y_max = max(b[3] for b in mbox)
+            margin = int(add_margin * min(x_max - x_min, y_max - y_min))
+            merged_list.append([x_min - margin, x_max + margin, y_min - margin, y_max + margin])
+
+    return merged_list, free_list
+
+
+# ---------- recognition (CRNN + CTC) ----------
+
+def four_point_transform(image: np.ndarray, rect: np.ndarray) -> np.ndarray:
+    tl, tr, br, bl = rect
+    width = max(int(np.linalg.norm(br - bl)), int(np.linalg.norm(tr - tl)))
+    height = max(int(np.linalg.norm(tr - br)), int(np.linalg.norm(tl - bl)))
+    dst = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    return cv2.warpPerspective(image, cv2.getPerspectiveTransform(rect, dst), (width, height))
+
+
+def crop_line(img: np.ndarray, box, model_height: int, horizontal: bool) -> tuple[list, np.ndarray, int] | None:
+    """
+    Cuts one region out of the gray page and scales it to the model height.
+    Returns (output box, crop, padded batch width) or None for empty regions.
+    """
+    if horizontal:
+        max_y, max_x = img.shape
+        x_min, x_max = max(0, box[0]), min(box[1], max_x)
+        y_min, y_max = max(0, box[2]), min(box[3], max_y)
+        crop = img[y_min:y_max, x_min:x_max]
+        out_box = [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]]
+    else:
+        crop = four_point_transform(img, np.array(box, dtype=np.float32))
+        out_box = box
+
+    h, w = crop.shape[:2]
+    if h == 0 or w == 0:
+        return None
+    ratio = w / h
+    if ratio < 1.0:
+        ratio = 1.0 / ratio
+        size = (model_height, int(model_height * ratio))
+    else:
+        size = (int(model_height * ratio), model_height)
+    if int(model_height * ratio) == 0:
+        return None
+    crop = cv2.resize(crop, size, interpolation=cv2.INTER_LINEAR)
+    return out_box, crop, math.ceil(max(ratio, 1.0)) * model_height
+
+
+def adjust_contrast_grey(img: np.ndarray, target: float = 0.4) -> np.ndarray:
+    high, low = np.percentile(img, 90), np.percentile(img, 10)
+    if (high - low) / np.maximum(10, high + low) < target:
+        ratio = 200.0 / np.maximum(10, high - low)
+        img = np.clip((img.astype(int) - low + 25) * ratio, 0, 255).astype(np.uint8)
+    return img
+
+
+def to_batch(crops: list[np.ndarray], model_height: int, width: int, adjust_contrast: float = 0.0) -> np.ndarray:
+    """Normalizes crops to [-1, 1] and right-pads them (edge column repeated) to `width`."""
+    batch = np.empty((len(crops), 1, model_height, width), dtype=np.float32)
+    for i, crop in enumerate(crops):
+        if adjust_contrast > 0:
+            crop = adjust_contrast_grey(crop, target=adjust_contrast)
+        h, w = crop.shape
+        new_w = min(width, math.ceil(model_height * w / h))
+        if (new_w, model_height) != (w, h):
+            crop = cv2.resize(crop, (new_w, model_height), interpolation=cv2.INTER_CUBIC)
+        x = crop.astype(np.float32) / 127.5 - 1.0
+        batch[i, 0, :, :new_w] = x
+        batch[i, 0, :, new_w:] = x[:, -1:]
+    return batch
+
+
+def ctc_decode(logits: np.ndarray, characters: str, ignore_idx: list[int]) -> list[tuple[str, float]]:
+    """Greedy CTC decode with EasyOCR's confidence (geometric-ish mean of max probs)."""
+    probs = np.exp(logits - logits.max(axis=2, keepdims=True))
+    probs /= probs.sum(axis=2, keepdims=True)
+    if ignore_idx:
+        probs[:, :, ignore_idx] = 0.0
+        probs /= probs.sum(axis=2, keepdims=True)
+
+    best = probs.argmax(axis=2)
+    best_p = probs.max(axis=2)
+    out = []
+    for idx, p in zip(best, best_p):
+        keep = np.insert(idx[1:] != idx[:-1], 0, True) & (idx != 0)
+        text = "".join(characters[i - 1] for i in idx[keep])
+        max_probs = p[idx != 0]
+        if not len(max_probs):
+            max_probs = np.array([0.0])
+        out.append((text, float(max_probs.prod() ** (2.0 / np.sqrt(len(max_probs))))))
+    return out
+
+
+class OnnxEngine(OcrEngine):
+    """
+    ONNX Runtime backend (CPU). `int8` picks the quantized models; `threads` caps intra-op threads per session (0 = runtime default).
+    """
+
+    def __init__(self, lang=("en",), int8: bool = False, root: str = ONNX_MODEL_DIR, threads: int = 0):
+        import onnxruntime as ort
+
+        folder = model_dir(lang, root)
+        meta_path = os.path.join(folder, META_FILE)
+        if not os.path.isfile(meta_path):
+            raise FileNotFoundError(
+                f"No ONNX models in {folder}. Export them with: python -m scanner.engines.onnx_engine export"
+            )
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.characters: str = meta["characters"]
+        self.ignore_idx: list[int] = meta["ignore_idx"]
+        self.model_height: int = meta["model_height"]
+        self.int8 = int8
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        detector, recognizer = MODEL_FILES[int8]
+        providers = ["CPUExecutionProvider"]
+        self.detector = ort.InferenceSession(os.path.join(folder, detector), options, providers=providers)
+        self.recognizer = ort.InferenceSession(os.path.join(folder, recognizer), options, providers=providers)
+
+    @property
+    def name(self) -> str:
+        return "onnx-int8" if self.int8 else "onnx"
+
+    def detect(self, img, min_size=20, text_threshold=0.7, low_text=0.4, link_threshold=0.4, canvas_size=2560,
+               mag_ratio=1.0, slope_ths=0.1, ycenter_ths=0.5, height_ths=0.5, width_ths=0.5, add_margin=0.1, **_):
+        """`img` is one image or a list of equally sized ones (run as one batch)."""
+        images = img if isinstance(img, list) else [img]
+        resized = []
+        for image in images:
+            if image.ndim == 2:
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            canvas, ratio = resize_to_canvas(image, canvas_size, mag_ratio)
+            resized.append(normalize(canvas).transpose(2, 0, 1))
+        scores = self.detector.run(None, {"image": np.stack(resized)})[0]
+
+        # Heatmaps are half the canvas resolution
+        scale = 2.0 / ratio
+        horizontal_agg, free_agg = [], []
+        for score in scores:
+            boxes = det_boxes(score[:, :, 0], score[:, :, 1], text_threshold, link_threshold, low_text)
+            polys = [(box * scale).astype(np.int32).reshape(-1) for box in boxes]
+            horizontal, free = group_text_box(polys, slope_ths, ycenter_ths, height_ths, width_ths, add_margin)
+            if min_size:
+                horizontal = [b for b in horizontal if max(b[1] - b[0], b[3] - b[2]) > min_size]
+                free = [
+                    b for b in free
+                    if max(np.ptp([c[0] for c in b]), np.ptp([c[1] for c in b])) > min_size
+                ]
+            horizontal_agg.append(horizontal)
+            free_agg.append(free)
+        return horizontal_agg, free_agg
+
+    def _read(self, crops: list[np.ndarray], widths: list[int], adjust_contrast: float = 0.0) -> list[tuple[str, float]]:
+        # Crops padded to the same width form one batch; the padding is the
+        # same as running them one by one
+        out: list = [None] * len(crops)
+        for width in sorted(set(widths)):
+            idx = [i for i, w in enumerate(widths) if w == width]
+            batch = to_batch([crops[i] for i in idx], self.model_height, width, adjust_contrast)
+            logits = self.recognizer.run(None, {"image": batch})[0]
+            for i, res in zip(idx, ctc_decode(logits, self.characters, self.ignore_idx)):
+                out[i] = res
+        return out
+
+    def recognize(self, img_cv_grey, horizontal_list=None, free_list=None, reformat=True,
+                  contrast_ths=0.1, adjust_contrast=0.5, **_):
+        if reformat:
+            img_cv_grey = to_gray(img_cv_grey)
+        if horizontal_list is None and free_list is None:
+            y_max, x_max = img_cv_grey.shape
+            horizontal_list, free_list = [[0, x_max, 0, y_max]], []
+
+        regions = [crop_line(img_cv_grey, b, self.model_height, True) for b in horizontal_list or []]
+        regions += [crop_line(img_cv_grey, b, self.model_height, False) for b in free_list or []]
+        regions = [r for r in regions if r is not None]
+        if not regions:
+            return []
+
+        boxes, crops, widths = zip(*regions)
+        results = self._read(list(crops), list(widths))
+
+        # Second pass with boosted contrast for low-confidence reads
+        low = [i for i, (_, conf) in enumerate(results) if conf < contrast_ths]
+        if low:
+            retry = self._read([crops[i] for i in low], [widths[i] for i in low], adjust_contrast)
+            for i, res in zip(low, retry):
+                if res[1] >= results[i][1]:
+                    results[i] = res
+
+        return [(box, text, conf) for box, (text, conf) in zip(boxes, results)]
+
+    def readtext_batched(self, images, batch_size=1, **params):
+        """Detection runs batched over equally sized images; recognition per image."""
+        from .base import split_params
+
+        detect_params, recognize_params = split_params(params)
+        out = []
+        for start in range(0, len(images), max(1, batch_size)):
+            chunk = images[start:start + max(1, batch_size)]
+            if len({im.shape for im in chunk}) > 1:
+                out.extend(self.readtext(im, **params) for im in chunk)
+                continue
+            horizontal, free = self.detect(list(chunk), **detect_params)
+            for image, h, f in zip(chunk, horizontal, free):
+                out.append(self.recognize(to_gray(image), h, f, reformat=False, **recognize_params))
+        return out
+
+
+# ---------- export ----------
+
+# Canvas used for calibration pages; activation ranges barely depend on it
+CALIBRATION_CANVAS = 960
+CALIBRATION_MAX_IMAGES = 8
+
+
+def export_models(reader, folder: str, int8: bool = True, calibration: list[str] | None = None, opset: int = 17):
+    """
+    Writes the detector and recognizer of an easyocr.Reader (created with
+    quantize=False) to `folder` as ONNX, plus the charset metadata. With
+    `int8`, quantized variants are calibrated on the `calibration` images.
+    """
+    import torch
+
+    os.makedirs(folder, exist_ok=True)
+    paths = [os.path.join(folder, name) for name in MODEL_FILES[False]]
+
+    class Detector(torch.nn.Module):
+        def __init__(self, net):
+            super().__init__()
+            self.net = net
+
+        def forward(self, image):
+            return self.net(image)[0]
+
+    class Recognizer(torch.nn.Module):
+        def __init__(self, net):
+            super().__init__()
+            self.net = net
+
+        def forward(self, image):
+            # Model.forward with AdaptiveAvgPool2d((None, 1)) written as a
+            # mean over feature height, which exports with a dynamic width
+            features = self.net.FeatureExtraction(image).permute(0, 3, 1, 2).mean(dim=3)
+            return self.net.Prediction(self.net.SequenceModeling(features).contiguous())
+
+    detector = getattr(reader.detector, "module", reader.detector).eval()
+    recognizer = getattr(reader.recognizer, "module", reader.recognizer).eval()
+    model_height = 64
+
+    with torch.no_grad():
+        torch.onnx.export(
+            Detector(detector), torch.zeros(1, 3, 640, 480), paths[0],
+            input_names=["image"], output_names=["scores"], opset_version=opset, dynamo=False,
+            dynamic_axes={"image": {0: "batch", 2: "height", 3: "width"}, "scores": {0: "batch", 1: "h2", 2: "w2"}},
+        )
+        torch.onnx.export(
+            Recognizer(recognizer), torch.zeros(1, 1, model_height, 256), paths[1],
+            input_names=["image"], output_names=["logits"], opset_version=opset, dynamo=False,
+            dynamic_axes={"image": {0: "batch", 3: "width"}, "logits": {0: "batch", 1: "steps"}},
+        )
+
+    characters = reader.character
+    ignore = set(characters) - set(reader.lang_char)
+    meta = {
+        "characters": characters,
+        "ignore_idx": sorted(characters.index(c) + 1 for c in ignore),
+        "model_height": model_height,
+    }
+    with open(os.path.join(folder, META_FILE), "w") as f:
+        json.dump(meta, f)
+
+    if int8:
+        quantize_models(folder, calibration or [])
+    logging.info(f"ONNX models written to {folder}")
+
+
+def calibration_inputs(folder: str, image_paths: list[str]) -> tuple[list[np.ndarray], list[np.ndarray]]:
+    """
+    Detector and recognizer inputs for calibration: receipt pages on the
+    calibration canvas and the text lines the float detector finds on them
+    (full-width bands when it finds none).
+    """
+    engine = OnnxEngine(root=os.path.dirname(folder), lang=(os.path.basename(folder),))
+    pages, lines = [], []
+    for path in image_paths[:CALIBRATION_MAX_IMAGES]:
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            continue
+        canvas, _ = resize_to_canvas(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), CALIBRATION_CANVAS)
+        pages.append(normalize(canvas).transpose(2, 0, 1)[None])
+
+        horizontal, _ = engine.detect(gray, canvas_size=CALIBRATION_CANVAS)
+        boxes = horizontal[0] or [[0, gray.shape[1], y, y + 40] for y in range(0, gray.shape[0] - 40, 120)]
+        regions = [crop_line(gray, b, engine.model_height, True) for b in boxes[:32]]
+        by_width: dict[int, list] = {}
+        for region in filter(None, regions):
+            by_width.setdefault(region[2], []).append(region[1])
+        lines.extend(to_batch(crops, engine.model_height, width) for width, crops in by_width.items())
+    return pages, lines
+
+
+def quantize_models(folder: str, image_paths: list[str]):
+    """Writes the int8 models next to the float ones in `folder` (see module docstring)."""
+    from onnxruntime.quantization import (
+        CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    if not image_paths:
+        raise ValueError("int8 export needs calibration images (e.g. --calibration samples/)")
+
+    class Feed(CalibrationDataReader):
+        def __init__(self, batches):
+            self.batches = iter(batches)
+
+        def get_next(self):
+            batch = next(self.batches, None)
+            return None if batch is None else {"image": batch}
+
+    pages, lines = calibration_inputs(folder, image_paths)
+    (det_fp32, rec_fp32), (det_int8, rec_int8) = (
+        [os.path.join(folder, name) for name in MODEL_FILES[q]] for q in (False, True)
+    )
+
+    for src, dst, batches in ((det_fp32, det_int8, pages), (rec_fp32, rec_int8, lines)):
+        prepared = dst + ".prep"
+        quant_pre_process(src, prepared)
+        quantize_static(
+            prepared, dst, Feed(batches), quant_format=QuantFormat.QDQ, per_channel=True,
+            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, op_types_to_quantize=["Conv"],
+        )
+        os.remove(prepared)
+
+    # The recognizer's BiLSTM and classifier: dynamic int8 is fast for those
+    quantize_dynamic(rec_int8, rec_int8, weight_type=QuantType.QInt8, op_types_to_quantize=["LSTM", "MatMul", "Gemm"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export EasyOCR models for the ONNX Runtime engine.")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--dir", default=ONNX_MODEL_DIR, help=f"Model root (default: {ONNX_MODEL_DIR})")
+    parser.add_argument("--lang", nargs="+", default=["en"])
+    parser.add_argument("--calibration", default=STORAGE_FOLDER, help="Receipt images for int8 calibration")
+    parser.add_argument("--no-int8", action="store_true", help="Skip the quantized models")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    import easyocr
+
+    images = sorted(
+        os.path.join(args.calibration, name) for name in os.listdir(args.calibration)
+        if os.path.splitext(name)[1].lower() in ALLOWED_IMAGE_EXTENSIONS
+    )
+    reader = easyocr.Reader(args.lang, gpu=False, quantize=False)
+    export_models(reader, model_dir(args.lang, args.dir), int8=not args.no_int8, calibration=images)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Store detection without OCR: an index of header fingerprints (ORB keypoints
+and descriptors of the header band) labelled with the template that parsed
+them.
+
+Every receipt whose header OCR matches a template adds its fingerprint, so
+later receipts from the same store (same logo and header layout) are routed
+in milliseconds. Matches are verified geometrically (RANSAC on a similarity
+transform); a low inlier count or an ambiguous runner-up means "unknown"
+and the caller falls back to OCR.
+
+    python -m scanner.fingerprint stats
+    python -m scanner.fingerprint add --store Publix receipt.jpg [...]
+    python -m scanner.fingerprint clear
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+from .config import (
+    HEADER_FRACTION,
+    HEADER_INDEX_MAX_ENTRIES,
+    HEADER_INDEX_MIN_INLIERS,
+    HEADER_INDEX_PATH,
+)
+
+# Set INVOICE_SCANNER_HEADERS to another .npz path, or to "off"
+HEADERS_ENV = "INVOICE_SCANNER_HEADERS"
+
+# Header bands are scaled to this width before feature extraction
+FINGERPRINT_WIDTH = 800
+FINGERPRINT_FEATURES = 500
+# Lowe's ratio test and RANSAC tolerance (pixels at FINGERPRINT_WIDTH)
+RATIO = 0.8
+RANSAC_PX = 8.0
+# A different store this close to the best match makes it ambiguous
+AMBIGUITY = 0.5
+
+
+class Fingerprint:
+    """Keypoint positions (n, 2) float32 and ORB descriptors (n, 32) uint8."""
+
+    __slots__ = ("points", "descriptors")
+
+    def __init__(self, points: np.ndarray, descriptors: np.ndarray):
+        self.points = points
+        self.descriptors = descriptors
+
+    def __len__(self) -> int:
+        return len(self.descriptors)
+
+
+_ORB = threading.local()
+
+
+def header_fingerprint(header: np.ndarray) -> Fingerprint | None:
+    """Fingerprint of a header band (gray or BGR), None when it has too little texture."""
+    if header.ndim == 3:
+        header = cv2.cvtColor(header, cv2.COLOR_BGR2GRAY)
+    h, w = header.shape[:2]
+    if not h or not w:
+        return None
+    height = max(1, round(h * FINGERPRINT_WIDTH / w))
+    band = cv2.resize(header, (FINGERPRINT_WIDTH, height), interpolation=cv2.INTER_AREA)
+
+    # ORB objects are not safe to share between threads (daemon)
+    orb = getattr(_ORB, "orb", None)
+    if orb is None:
+        orb = _ORB.orb = cv2.ORB_create(nfeatures=FINGERPRINT_FEATURES)
+    keypoints, descriptors = orb.detectAndCompute(band, None)
+    if descriptors is None or len(descriptors) < HEADER_INDEX_MIN_INLIERS:
+        return None
+    return Fingerprint(np.float32([k.pt for k in keypoints]), descriptors)
+
+
+def count_inliers(query: Fingerprint, entry: Fingerprint, matcher=None) -> int:
+    """Geometrically consistent feature matches between two fingerprints."""
+    matcher = matcher or cv2.BFMatcher(cv2.NORM_HAMMING)
+    pairs = matcher.knnMatch(query.descriptors, entry.descriptors, k=2)
+    good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < RATIO * p[1].distance]
+    if len(good) < 3:
+        return 0
+    src = query.points[[m.queryIdx for m in good]]
+    dst = entry.points[[m.trainIdx for m in good]]
+    _, mask = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=RANSAC_PX)
+    return int(mask.sum()) if mask is not None else 0
+
+
+class HeaderIndex:
+    """
+    Labelled header fingerprints, persisted as one .npz at `path` (None
+    keeps it in memory). Oldest entries are dropped past `max_entries`.
+    Writes are atomic, so concurrent batch workers never see a torn file;
+    the last writer wins.
+    """
+
+    def __init__(self, path: str | None = None, max_entries: int = HEADER_INDEX_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries: list[Fingerprint] = []
+        self.labels: list[str] = []
+        self._lock = threading.Lock()
+        if path and os.path.isfile(path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def lookup(self, fingerprint: Fingerprint | None, min_inliers: int = HEADER_INDEX_MIN_INLIERS) -> tuple[str | None, int]:
+        """
+        (label, inliers) of the best confident match, or (None, inliers)
+        when nothing reaches `min_inliers` or another store scores nearly
+        as well.
+        """
+        if fingerprint is None:
+            return None, 0
+        with self._lock:
+            entries, labels = list(self.entries), list(self.labels)
+
+        matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        best: dict[str, int] = {}
+        for entry, label in zip(entries, labels):
+            best[label] = max(best.get(label, 0), count_inliers(fingerprint, entry, matcher))
+        if not best:
+            return None, 0
+
+        ranked = sorted(best.items(), key=lambda kv: kv[1], reverse=True)
+        label, inliers = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0
+        if inliers < min_inliers or runner_up >= inliers * AMBIGUITY:
+            return None, inliers
+        return label, inliers
+
+    def add(self, fingerprint: Fingerprint | None, label: str, save: bool = True):
+        if fingerprint is None:
+            return
+        with self._lock:
+            self.entries.append(fingerprint)
+            self.labels.append(label)
+            del self.entries[:-self.max_entries], self.labels[:-self.max_entries]
+        if save:
+            self.save()
+
+    def clear(self):
+        with self._lock:
+            self.entries, self.labels = [], []
+        self.save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            labels = list(self.labels)
+        return {"path": self.path, "entries": len(labels), "stores": {l: labels.count(l) for l in sorted(set(labels))}}
+
+    def load(self):
+        try:
+            with np.load(self.path) as data:
+                offsets = data["offsets"]
+                entries = [
+                    Fingerprint(data["points"][a:b], data["descriptors"][a:b])
+                    for a, b in zip(offsets[:-1], offsets[1:])
+                ]
+                labels = [str(l) for l in data["labels"]]
+        except (OSError, KeyError, ValueError) as e:
+            logging.warning(f"Header index unreadable, starting empty: {e}")
+            return
+        with self._lock:
+            self.entries, self.labels = entries, labels
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries, labels = list(self.entries), list(self.labels)
+
+        folder = os.path.dirname(self.path) or "."
+        offsets = np.cumsum([0] + [len(e) for e in entries])
+        try:
+            os.makedirs(folder, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    points=np.concatenate([e.points for e in entries]) if entries else np.zeros((0, 2), np.float32),
+                    descriptors=np.concatenate([e.descriptors for e in entries]) if entries else np.zeros((0, 32), np.uint8),
+                    offsets=offsets,
+                    labels=np.array(labels, dtype=str),
+                )
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.warning(f"Header index write failed: {e}")
+
+
+_INDEX: HeaderIndex | None = None
+_INDEX_READY = False
+_INDEX_LOCK = threading.Lock()
+
+
+def get_header_index() -> HeaderIndex | None:
+    """Process-wide header index, or None when disabled through INVOICE_SCANNER_HEADERS=off."""
+    global _INDEX, _INDEX_READY
+    with _INDEX_LOCK:
+        if not _INDEX_READY:
+            path = os.getenv(HEADERS_ENV, HEADER_INDEX_PATH)
+            if path and path.lower() not in ("off", "0", "false", "none"):
+                _INDEX = HeaderIndex(path)
+            _INDEX_READY = True
+    return _INDEX
+
+
+def set_header_index(index: HeaderIndex | None):
+    """Overrides the process-wide header index (None disables fingerprinting)."""
+    global _INDEX, _INDEX_READY
+    _INDEX = index
+    _INDEX_READY = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the header fingerprint index.")
+    parser.add_argument("command", choices=["stats", "add", "clear"])
+    parser.add_argument("images", nargs="*", help="Receipts to add (add)")
+    parser.add_argument("--store", help="Template store name the receipts belong to (add)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    index = get_header_index()
+    if index is None:
+        parser.error(f"The header index is disabled ({HEADERS_ENV}=off)")
+
+    if args.command == "add":
+        if not args.store or not args.images:
+            parser.error("add needs --store and at least one image")
+        from .preprocess import ReceiptImage
+
+        for path in args.images:
+            page = ReceiptImage(path).ocr_image
+            fingerprint = header_fingerprint(page[0:int(page.shape[0] * HEADER_FRACTION)])
+            if fingerprint is None:
+                logging.warning(f"{path}: header has too few features, skipped")
+                continue
+            index.add(fingerprint, args.store, save=False)
+        index.save()
+    elif args.command == "clear":
+        index.clear()
+    print(index.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import numpy as np
+import regex as re
+
+from .utils import norm, price_from
+
+# Token that belongs in the price column: "3.49", "-0,50", "3,49 T", or a bare
+# "3" / "49" half of a price the detector split in two
+PRICE_TOKEN_RX = re.compile(r"-?\d+(?:\s*[.,]\s*\d{2})?(?:\s*[A-Z])?", re.I)
+SPLIT_CENTS_RX = re.compile(r"\d{2}")
+
+
+def token_boxes(raw_ocr: list[dict]) -> np.ndarray | None:
+    """
+    Stacks token geometry into an (N, 4) float32 array of [x0, y0, x1, y1].
+    Returns None when any token has no box (e.g. hand-built fixtures).
+    """
+    if not raw_ocr or any(t.get("box") is None for t in raw_ocr):
+        return None
+    return np.asarray([t["box"] for t in raw_ocr], dtype=np.float32).reshape(-1, 4)
+
+
+def pack_tokens(raw_ocr: list[dict]) -> dict[str, np.ndarray]:
+    """Columnar form of OCR tokens (text, confidence, box) for compact storage."""
+    boxes = token_boxes(raw_ocr)
+    return {
+        "text": np.array([t["text"] for t in raw_ocr], dtype=str),
+        "confidence": np.array([t.get("confidence") or 0 for t in raw_ocr], dtype=np.float32),
+        "box": (boxes if boxes is not None else np.zeros((0, 4))).astype(np.int32),
+    }
+
+
+def unpack_tokens(arrays: dict[str, np.ndarray]) -> list[dict]:
+    """Inverse of pack_tokens; boxes stay rows of the packed array."""
+    texts = arrays["text"].tolist()
+    confs = arrays["confidence"].tolist()
+    boxes = arrays["box"]
+    has_boxes = len(boxes) == len(texts)
+    out = []
+    for i, (text, conf) in enumerate(zip(texts, confs)):
+        tok = {"text": text, "confidence": round(conf, 3)}
+        if has_boxes:
+            tok["box"] = boxes[i]
+        out.append(tok)
+    return out
+
+
+def group_rows(boxes: np.ndarray, y_overlap: float = 0.5) -> np.ndarray:
+    """
+    Labels each box with the physical row it sits on.
+    Boxes are sorted by vertical center and a new row starts wherever the
+    jump to the next center exceeds `y_overlap` of the median glyph height.
+    Labels are numbered top to bottom.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int32)
+
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    tol = y_overlap * max(float(np.median(boxes[:, 3] - boxes[:, 1])), 1.0)
+
+    order = np.argsort(cy, kind="stable")
+    breaks = np.diff(cy[order]) > tol
+    sorted_labels = np.concatenate(([0], np.cumsum(breaks))).astype(np.int32)
+
+    labels = np.empty_like(sorted_labels)
+    labels[order] = sorted_labels
+    return labels
+
+
+def price_column_mask(raw_ocr: list[dict], boxes: np.ndarray) -> np.ndarray:
+    """
+    Marks tokens in the right-hand price column: price-shaped tokens that
+    start at or right of the column's left edge, estimated from the
+    tokens that actually parse as prices.
+    """
+    shaped = np.fromiter(
+        (PRICE_TOKEN_RX.fullmatch(norm(t["text"])) is not None for t in raw_ocr),
+        dtype=bool,
+        count=len(raw_ocr),
+    )
+    priced = shaped & np.fromiter(
+        (price_from(t["text"]) is not None for t in raw_ocr),
+        dtype=bool,
+        count=len(raw_ocr),
+    )
+    if not priced.any():
+        return np.zeros(len(raw_ocr), dtype=bool)
+
+    glyph_h = float(np.median(boxes[:, 3] - boxes[:, 1]))
+    column_x = float(np.median(boxes[priced, 0])) - 2 * glyph_h
+    return shaped & (boxes[:, 0] >= column_x)
+
+
+def _join(tokens: list[dict], boxes: np.ndarray, idx: np.ndarray, sep: str = " ") -> dict:
+    text = sep.join(norm(tokens[i]["text"]) for i in idx)
+    return {
+        "text": text,
+        "confidence": min(float(tokens[i].get("confidence") or 0) for i in idx),
+        "box": np.concatenate((boxes[idx, :2].min(axis=0), boxes[idx, 2:].max(axis=0))).astype(np.int32),
+    }
+
+
+def reconstruct_lines(raw_ocr: list[dict], y_overlap: float = 0.5) -> list[dict]:
+    """
+    Rebuilds physical receipt lines from positioned tokens.
+    Each row becomes a description line followed by its price-column line,
+    which is the order parse_receipt expects ("NAME" then "3.49").
+    Rows whose description already carries numbers (weights, "3 @ 1.29",
+    deals) stay as one line so the pattern regexes see the full row.
+    Tokens without boxes are returned unchanged.
+    """
+    boxes = token_boxes(raw_ocr)
+    if boxes is None:
+        return list(raw_ocr)
+
+    rows = group_rows(boxes, y_overlap)
+    in_price_col = price_column_mask(raw_ocr, boxes)
+    # Left to right inside each row, rows top to bottom
+    order = np.lexsort((boxes[:, 0], rows))
+
+    lines = []
+    for row_idx in np.split(order, np.flatnonzero(np.diff(rows[order])) + 1):
+        desc = row_idx[~in_price_col[row_idx]]
+        prices = row_idx[in_price_col[row_idx]]
+
+        # "3" "49" split by the detector -> "3.49"
+        price_line = None
+        if len(prices):
+            texts = [norm(raw_ocr[i]["text"]) for i in prices]
+            if len(texts) == 2 and texts[0].isdigit() and len(texts[0]) <= 2 and SPLIT_CENTS_RX.fullmatch(texts[1]):
+                price_line = _join(raw_ocr, boxes, prices, sep=".")
+            else:
+                price_line = _join(raw_ocr, boxes, prices)
+
+        if len(desc) and price_line is not None and price_from(_join(raw_ocr, boxes, desc)["text"]) is not None:
+            lines.append(_join(raw_ocr, boxes, row_idx))
+            continue
+        if len(desc):
+            lines.append(_join(raw_ocr, boxes, desc))
+        if price_line is not None:
+            lines.append(price_line)
+
+    return lines
+
+
+# ---------- strip tiling ----------
+
+def plan_strips(height: int, strip_height: int, overlap: int) -> list[tuple[int, int]]:
+    """Splits [0, height) into overlapping (top, bottom) bands of at most strip_height."""
+    if height <= strip_height:
+        return [(0, height)]
+    step = strip_height - overlap
+    tops = list(range(0, height - overlap, step))
+    return [(top, min(top + strip_height, height)) for top in tops]
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU between (N, 4) and (M, 4) [x0, y0, x1, y1] boxes, as an (N, M) array."""
+    a = a.astype(np.float32)[:, None, :]
+    b = b.astype(np.float32)[None, :, :]
+    iw = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    ih = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = iw * ih
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+def stitch_strips(strips: list[tuple[int, int, list[dict]]], iou_threshold: float = 0.5, edge: int = 3) -> list[dict]:
+    """
+    Merges per-strip OCR tokens (boxes already in page coordinates) in reading order.
+    - Tokens touching a cut edge are dropped: the overlapping neighbour holds
+      the whole line.
+    - Tokens read twice inside an overlap band are collapsed by box IoU,
+      keeping the more confident reading.
+    """
+    merged: list[dict] = []
+    for i, (top, bottom, tokens) in enumerate(strips):
+        first, last = i == 0, i == len(strips) - 1
+        fresh = []
+        for tok in tokens:
+            y0, y1 = int(tok["box"][1]), int(tok["box"][3])
+            if not first and y0 <= top + edge:
+                continue
+            if not last and y1 >= bottom - edge:
+                continue
+            fresh.append(tok)
+
+        # Only tokens from earlier strips that reach into this band can be duplicates
+        prev_idx = [j for j, t in enumerate(merged) if int(t["box"][3]) > top]
+        if fresh and prev_idx:
+            iou = box_iou(token_boxes(fresh), token_boxes([merged[j] for j in prev_idx]))
+            keep = []
+            for k, tok in enumerate(fresh):
+                best = int(np.argmax(iou[k]))
+                if iou[k, best] < iou_threshold:
+                    keep.append(tok)
+                    continue
+                j = prev_idx[best]
+                if tok["confidence"] > merged[j]["confidence"]:
+                    merged[j] = tok
+            fresh = keep
+
+        merged.extend(fresh)
+    return merged
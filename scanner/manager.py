@@ -4,44 +4,438 @@ import numpy as np
 from typing import Optional
 
 import os
-from .ocr import run_ocr
-from .openai_service import extract_data_with_openai_vision
-from .templates.publix import PublixTemplate
+import time
+from .archive import get_archive
+from .cache import file_digest
+from .dedup import get_duplicate_index, mark_duplicate, receipt_hash
+from .config import HEADER_FRACTION, OCR_TILE_HEIGHT, OCR_TILE_WORKERS, SINGLE_PASS_OCR
+from .fingerprint import get_header_index, header_fingerprint
+from .engines import engine_name
+from .ocr import RECOGNIZE_PARAMS, _detect_params, detect_regions, recognize_regions, run_ocr, run_ocr_batch, run_ocr_tiled, split_regions
+from .preprocess import ReceiptImage
+from .openai_service import extract_data_with_openai_vision, extract_data_with_openai_vision_async
+from .templates.registry import TemplateRegistry
 from .parser import parse_receipt # Fallback
 
-# List of registered templates
-AVAILABLE_TEMPLATES = [
-    PublixTemplate(),
-]
+# Store templates, discovered in scanner/templates and INVOICE_SCANNER_TEMPLATES
+TEMPLATES = TemplateRegistry()
 
 class ScannerManager:
     @staticmethod
-    def process(image: np.ndarray) -> dict:
+    def process(
+        image: np.ndarray | ReceiptImage,
+        single_pass: Optional[bool] = None,
+        tile_workers: Optional[int] = None,
+        reuse_duplicates: bool = False,
+    ) -> dict:
         """
         Orchestrates the scanning process:
-        1. Try fast local template matching.
+        1. Try fast local template matching (header fingerprint, then header OCR).
         2. Fallback to OpenAI Vision.
+
+        `image` is either an already preprocessed array or a ReceiptImage,
+        from which only the OCR-ready stage is pulled. For a ReceiptImage the
+        planned OCR canvas size is used and the resolution choice plus the
+        elapsed time are recorded under the result's "meta" key.
+
+        In single-pass mode text is detected once on the full page; the header
+        band is recognized first for template matching and the remaining
+        regions only when a local parse is needed.
+
+        With `tile_workers` > 0, receipts taller than one strip are OCR-ed as
+        overlapping strips in parallel, once the header pass has routed them to
+        a local parse (Vision AI receipts skip the full-page OCR).
+
+        The full-page OCR of a ReceiptImage parsed locally is appended to the
+        raw OCR archive (scanner/archive.py) for later re-parsing.
+
+        A ReceiptImage is first looked up in the duplicate index
+        (scanner/dedup.py) by a perceptual hash of the cropped receipt. Another
+        copy of an earlier receipt is still scanned (an explicit re-scan gets a
+        fresh result), with a "duplicate_of" key naming the earlier one. With
+        `reuse_duplicates`, that receipt's stored result is returned instead,
+        before preprocessing goes any further.
+
+        process_iter() runs the same pipeline and reports its progress.
         """
+        for event in ScannerManager.process_iter(image, single_pass, tile_workers, reuse_duplicates):
+            if event["event"] == "done":
+                return event["result"]
+
+    @staticmethod
+    def process_iter(
+        image: np.ndarray | ReceiptImage,
+        single_pass: Optional[bool] = None,
+        tile_workers: Optional[int] = None,
+        reuse_duplicates: bool = False,
+    ):
+        """
+        process() as a stream of events, each a dict with an "event" key,
+        yielded as soon as the pipeline gets there:
+
+            {"event": "duplicate", "of": {"source", "distance"}}   copy of an earlier receipt
+            {"event": "preprocessed", "plan": {...}}               OCR input ready (ReceiptImage)
+            {"event": "store", "store": name, "via": how}          fingerprint, header, vision, generic or duplicate
+            {"event": "item", "item": {"name", "price"}}           one per item, in receipt order
+            {"event": "total", "total": float | None}
+            {"event": "done", "result": {...}}                     the dict process() returns
+
+        A template store is reported before the body is OCR-ed; the other
+        routes know the store only once the receipt is parsed. Exceptions
+        propagate out of the iteration.
+        """
+        if not isinstance(image, ReceiptImage):
+            result = yield from ScannerManager._route(image, single_pass, tile_workers=tile_workers)
+            yield from ScannerManager._result_events(result)
+            return
+
+        start = time.perf_counter()
+        receipt = image
+        index = get_duplicate_index()
+        key = receipt_hash(receipt.cropped) if index is not None else None
+        hit = index.lookup(key) if key else None
+        duplicate_of = hit and {"source": hit[0].get("source"), "distance": hit[1]}
+        if duplicate_of:
+            yield {"event": "duplicate", "of": duplicate_of}
+        if duplicate_of and reuse_duplicates:
+            result = mark_duplicate(hit[0]["result"], duplicate_of["source"], duplicate_of["distance"])
+            yield {"event": "store", "store": result.get("store"), "via": "duplicate"}
+        else:
+            ocr_image = receipt.ocr_image
+            yield {"event": "preprocessed", "plan": receipt.plan}
+            capture = {}
+            result = yield from ScannerManager._route(ocr_image, single_pass, receipt.canvas_size, tile_workers, capture)
+            if capture:
+                ScannerManager._archive(receipt, **capture)
+            if duplicate_of:
+                result["duplicate_of"] = duplicate_of
+            elif key:
+                index.add(key, result, source=receipt.path)
+        result["meta"] = {
+            "resolution": receipt.plan,
+            "elapsed": round(time.perf_counter() - start, 3),
+        }
+        yield from ScannerManager._result_events(result)
+
+    @staticmethod
+    def _result_events(result: dict):
+        for item in result.get("items") or []:
+            yield {"event": "item", "item": item}
+        yield {"event": "total", "total": result.get("total")}
+        yield {"event": "done", "result": result}
+
+    @staticmethod
+    def _route(
+        image: np.ndarray,
+        single_pass: Optional[bool] = None,
+        canvas_size: Optional[int] = None,
+        tile_workers: Optional[int] = None,
+        capture: Optional[dict] = None,
+        defer_vision: bool = False,
+    ):
+        """
+        Generator: yields the "store" event and returns the result
+        (result = yield from _route(...)).
+        `capture`, when given, receives the full-page tokens, the template
+        name and the OCR mode of a local parse (left empty for Vision AI).
+        With `defer_vision`, a receipt no template claims returns None when
+        Vision AI is available, for the caller to send it elsewhere.
+        """
+        if single_pass is None:
+            single_pass = SINGLE_PASS_OCR
+        if tile_workers is None:
+            tile_workers = OCR_TILE_WORKERS
+
         h, w = image.shape[:2]
+        header_h = int(h * HEADER_FRACTION)
 
-        # 1. Header OCR Pass (First 25% of image)
+        # 1. Header pass: fingerprint lookup, OCR of the first 25% if unknown
         logging.info("Attempting local template matching (Header Pass)...")
-        header_crop = image[0:int(h*0.25), 0:w]
-        header_ocr = run_ocr(header_crop)
+        fingerprint, matched_template = ScannerManager._match_fingerprint(image[0:header_h, 0:w])
+        via = "fingerprint"
 
-        matched_template = None
-        for temp in AVAILABLE_TEMPLATES:
-            if temp.matches(header_ocr):
-                matched_template = temp
-                break
+        if tile_workers > 0 and h > OCR_TILE_HEIGHT:
+            mode = "tiled"
+            # Long receipt: the route is decided from the header crop alone,
+            # and the page is read as strips in parallel only for a local parse
+
+            def read_header():
+                return run_ocr(image[0:header_h, 0:w], canvas_size=canvas_size)
+
+            def read_full(header_ocr):
+                return run_ocr_tiled(image, workers=tile_workers)
+        elif single_pass:
+            mode = "single_pass"
+            header_regions, body_regions = split_regions(detect_regions(image, canvas_size=canvas_size), header_h)
+
+            def read_header():
+                return recognize_regions(image, *header_regions)
+
+            def read_full(header_ocr):
+                if header_ocr is None:
+                    header_ocr = read_header()
+                return header_ocr + recognize_regions(image, *body_regions)
+        else:
+            mode = "full"
+
+            def read_header():
+                return run_ocr(image[0:header_h, 0:w], canvas_size=canvas_size)
+
+            def read_full(header_ocr):
+                return run_ocr(image, canvas_size=canvas_size)
+
+        header_ocr = None
+        if matched_template is None:
+            header_ocr = read_header()
+            matched_template = ScannerManager._match_template(header_ocr, fingerprint)
+            via = "header"
 
         if matched_template:
             logging.info(f"Template matched: {matched_template.store_name}. Running local parser.")
+            yield {"event": "store", "store": matched_template.store_name, "via": via}
             # Run full OCR for local parsing
-            full_ocr = run_ocr(image)
+            full_ocr = read_full(header_ocr)
+            if capture is not None:
+                capture.update(tokens=full_ocr, template=matched_template.store_name, mode=mode, canvas_size=canvas_size)
             return matched_template.parse(full_ocr)
 
         # 2. Vision AI Fallback
+        if defer_vision and os.getenv("OPEN_AI_API"):
+            return None
+        result = ScannerManager._try_vision(image)
+        if result is not None:
+            yield {"event": "store", "store": result.get("store"), "via": "vision"}
+            return result
+
+        # 3. Generic Local Fallback (The "Old Way")
+        logging.info("Running generic local OCR (Fallback Mode)...")
+        full_ocr = read_full(header_ocr)
+        if capture is not None:
+            capture.update(tokens=full_ocr, template=None, mode=mode, canvas_size=canvas_size)
+        result = parse_receipt(full_ocr)
+        yield {"event": "store", "store": result.get("store"), "via": "generic"}
+        return result
+
+    @staticmethod
+    def process_many(images: list[np.ndarray | ReceiptImage]) -> list[dict | Exception]:
+        """
+        Batched variant of process() for several receipts at once.
+        Header crops of the receipts the fingerprint index doesn't recognize
+        go through one batched OCR call, then the full pages needing a local
+        parse are read in batched calls too. Vision AI runs per receipt as in process().
+
+        Returns one entry per input, in order: the result dict, or the
+        exception that receipt raised (one bad image doesn't sink the rest).
+        Duplicates of earlier receipts, or of one earlier in the same call,
+        get that receipt's result marked with "duplicate_of", without OCR.
+        """
+        results: list[dict | Exception | None] = [None] * len(images)
+        for i, result in ScannerManager.process_many_iter(images):
+            results[i] = result
+        return results
+
+    @staticmethod
+    def process_many_iter(images: list[np.ndarray | ReceiptImage]):
+        """
+        process_many() yielding (input index, result or exception) as each
+        receipt finishes: duplicates first, then template receipts after one
+        batched full-page OCR, then Vision AI results one by one, then the
+        generic local fallbacks. Callers can store results while the slower
+        routes are still running. A ReceiptImage result's meta "elapsed" is
+        the time from the start of the call until it was ready.
+        """
+        start = time.perf_counter()
+        index = get_duplicate_index()
+        keys, followers = {}, {}
+        done: dict[int, dict | Exception] = {}
+
+        def finish(i, result):
+            image = images[i]
+            if isinstance(image, ReceiptImage) and isinstance(result, dict):
+                if i in keys:
+                    index.add(keys[i], result, source=image.path)
+                result["meta"] = {"resolution": image.plan, "elapsed": round(time.perf_counter() - start, 3)}
+            done[i] = result
+            yield i, result
+            for f, (j, distance) in followers.items():
+                if j == i:
+                    yield from finish(f, mark_duplicate(result, image.path, distance) if isinstance(result, dict) else result)
+
+        # 0. Duplicates of receipts already seen, and within this batch
+        if index is not None:
+            for i, image in enumerate(images):
+                if not isinstance(image, ReceiptImage):
+                    continue
+                try:
+                    key = receipt_hash(image.cropped)
+                except Exception:
+                    continue  # Reported by the preprocessing below
+                duplicate = index.duplicate_result(key)
+                if duplicate is not None:
+                    yield from finish(i, duplicate)
+                    continue
+                for j, other in keys.items():
+                    distance = index.matches(key, other)
+                    if distance is not None:
+                        followers[i] = (j, distance)
+                        break
+                else:
+                    keys[i] = key
+
+        pages, canvases, live = [], [], []
+        for i, image in enumerate(images):
+            if i in done or i in followers:
+                continue
+            try:
+                if isinstance(image, ReceiptImage):
+                    pages.append(image.ocr_image)
+                    canvases.append(image.canvas_size)
+                else:
+                    pages.append(image)
+                    canvases.append(None)
+                live.append(i)
+            except Exception as e:
+                logging.error(f"Preprocessing failed: {e}")
+                yield from finish(i, e)
+        if not live:
+            return
+
+        # 1. Header pass: fingerprints first, OCR for the unknown ones in one go
+        headers = [page[0:int(page.shape[0] * HEADER_FRACTION)] for page in pages]
+        matches = [ScannerManager._match_fingerprint(header) for header in headers]
+        unknown = [k for k, (_, template) in enumerate(matches) if template is None]
+        logging.info(f"Attempting local template matching (Header Pass) for {len(unknown)} receipt(s)...")
+        try:
+            header_ocrs = run_ocr_batch([headers[k] for k in unknown], canvas_size=[canvases[k] for k in unknown])
+        except Exception as e:
+            for i in live:
+                yield from finish(i, e)
+            return
+        templates = [template for _, template in matches]
+        for k, header_ocr in zip(unknown, header_ocrs):
+            templates[k] = ScannerManager._match_template(header_ocr, matches[k][0])
+
+        def parse_batch(ks: list[int]):
+            """Full pages of live[k] for k in `ks` in one batched OCR call, then each parsed."""
+            try:
+                full_ocrs = run_ocr_batch([pages[k] for k in ks], canvas_size=[canvases[k] for k in ks])
+            except Exception as e:
+                full_ocrs = [e] * len(ks)
+            for k, full_ocr in zip(ks, full_ocrs):
+                template = templates[k]
+                try:
+                    if isinstance(full_ocr, Exception):
+                        raise full_ocr
+                    result = template.parse(full_ocr) if template else parse_receipt(full_ocr)
+                    if isinstance(images[live[k]], ReceiptImage):
+                        ScannerManager._archive(
+                            images[live[k]], full_ocr, template and template.store_name, "batch", canvases[k]
+                        )
+                except Exception as e:
+                    result = e
+                yield from finish(live[k], result)
+
+        # 2. Template receipts: full pages in one batched call
+        matched = [k for k, template in enumerate(templates) if template]
+        for k in matched:
+            logging.info(f"Template matched: {templates[k].store_name}. Running local parser.")
+        if matched:
+            yield from parse_batch(matched)
+
+        # 3. Vision AI for the receipts no template claims, 4. generic parse for the rest
+        generic = []
+        for k, template in enumerate(templates):
+            if template:
+                continue
+            vision = ScannerManager._try_vision(pages[k])
+            if vision is not None:
+                yield from finish(live[k], vision)
+            else:
+                generic.append(k)
+        if generic:
+            yield from parse_batch(generic)
+
+    @staticmethod
+    def _archive(
+        receipt: ReceiptImage | dict,
+        tokens: list[dict],
+        template: Optional[str],
+        mode: str,
+        canvas_size: Optional[int],
+    ):
+        """
+        Appends a receipt's full-page OCR and how it was produced to the raw
+        OCR archive. `receipt` may also be its _receipt_meta() dict, for
+        callers that no longer hold the ReceiptImage.
+        """
+        archive = get_archive()
+        if archive is None:
+            return
+        meta = receipt if isinstance(receipt, dict) else ScannerManager._receipt_meta(receipt)
+        source_digest = None
+        if meta["path"]:
+            try:
+                source_digest = file_digest(meta["path"])
+            except OSError:
+                pass
+        archive.append(
+            tokens,
+            path=meta["path"],
+            digest=source_digest,
+            engine=engine_name(),
+            detect=_detect_params(canvas_size),
+            recognize=RECOGNIZE_PARAMS,
+            profile=meta["profile"],
+            crop=meta["crop"],
+            adaptive=meta["adaptive"],
+            plan=meta["plan"],
+            shape=meta["shape"],
+            mode=mode,
+            template=template,
+        )
+
+    @staticmethod
+    def _receipt_meta(receipt: ReceiptImage) -> dict:
+        """The preprocessing settings of a receipt recorded with its archived OCR."""
+        return {
+            "path": receipt.path,
+            "profile": receipt.profile,
+            "crop": receipt.crop,
+            "adaptive": receipt.adaptive,
+            "plan": receipt.plan,
+            "shape": list(receipt.ocr_image.shape[:2]),
+        }
+
+    @staticmethod
+    def _match_fingerprint(header: np.ndarray):
+        """
+        (fingerprint, template) from the header fingerprint index. The
+        template is None when the header isn't recognized confidently; the
+        fingerprint (None without an index) is passed on to _match_template.
+        """
+        index = get_header_index()
+        if index is None:
+            return None, None
+        fingerprint = header_fingerprint(header)
+        label, inliers = index.lookup(fingerprint)
+        template = TEMPLATES.get(label)
+        if template:
+            logging.info(f"Header fingerprint matched {label} ({inliers} features), skipping header OCR.")
+        return fingerprint, template
+
+    @staticmethod
+    def _match_template(header_ocr: list[dict], fingerprint=None):
+        """Keyword match on the header OCR; a match teaches the fingerprint index."""
+        template = TEMPLATES.match(header_ocr)
+        if template:
+            index = get_header_index()
+            if index is not None:
+                index.add(fingerprint, template.store_name)
+        return template
+
+    @staticmethod
+    def _try_vision(image: np.ndarray) -> Optional[dict]:
+        """Vision AI extraction, or None when no key is set or the call failed."""
         api_key = os.getenv("OPEN_AI_API")
 
         if api_key:
@@ -55,8 +449,24 @@ class ScannerManager:
                 # Fall through to generic local parsing
         else:
             logging.warning("--> No API Key found and no template matched. Forcing generic local parsing.")
+        return None
 
-        # 3. Generic Local Fallback (The "Old Way")
-        logging.info("Running generic local OCR (Fallback Mode)...")
-        full_ocr = run_ocr(image)
-        return parse_receipt(full_ocr)
+    @staticmethod
+    async def _try_vision_async(image: np.ndarray | str, concurrency: Optional[int] = None) -> Optional[dict]:
+        """
+        _try_vision() on the shared async client, for the batch pipeline;
+        `image` may be already encoded and `concurrency` limits this event loop.
+        """
+        api_key = os.getenv("OPEN_AI_API")
+
+        if api_key:
+            logging.info("--> No template matches. Routing to Vision AI for full extraction.")
+            try:
+                result = await extract_data_with_openai_vision_async(image, concurrency)
+                logging.info(f"--> AI Extraction complete. Store detected: {result.get('store')}")
+                return result
+            except Exception as e:
+                logging.error(f"Vision AI failed: {e}. Falling back to generic local parsing.")
+        else:
+            logging.warning("--> No API Key found and no template matched. Forcing generic local parsing.")
+        return None
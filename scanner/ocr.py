@@ -1,81 +1,388 @@
+import atexit
 import logging
-import cv2
-import easyocr
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
 import numpy as np
 
-# Global reader cache to avoid re-initializing models recursively
-_READER_CACHE = {}
-
-
-def preprocess_receipt(image_path: str) -> np.ndarray:
-    logging.info(f"Preprocessing image....")
-
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError("Cannot read image")
-
-    # 1. Resize (if receipt is small)
-    h, w = img.shape[:2]
-    if h < 2000:
-        scale = 2000 / h
-        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
-
-    # 2. Grayscale
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-    # 3. Mild denoising (careful not to blur characters)
-    gray = cv2.fastNlMeansDenoising(
-        gray,
-        None,
-        h=5,  # Reduced from 10 to keep edges sharer
-        templateWindowSize=7,
-        searchWindowSize=21,
-    )
-
-    # 4. Shadow removal — division normalization
-    kernel = np.ones((21, 21), np.uint8)
-    dilated = cv2.dilate(gray, kernel)
-    bg = cv2.medianBlur(dilated, 51)
-    norm = cv2.divide(gray, bg, scale=255)
-
-    # 5. CLAHE (moderate)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    norm = clahe.apply(norm)
-
-    # Unused (kept as-is, just not returned)
-    result = cv2.adaptiveThreshold(
-        norm,
-        255,
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY,
-        15,  # Smaller window helps capture small fonts
-        25,  # Higher constant helps suppress gray noise
-    )
-
-    return norm
-
-
-
-def run_ocr(image, lang=("en",), gpu=False):
-    lang_tuple = tuple(sorted(lang))
-    if lang_tuple not in _READER_CACHE:
-        logging.info("Initializing EasyOCR reader for %s (gpu=%s)", lang_tuple, gpu)
-        _READER_CACHE[lang_tuple] = easyocr.Reader(list(lang_tuple), gpu=gpu)
-
-    reader = _READER_CACHE[lang_tuple]
-    results = reader.readtext(
-        image,
-        contrast_ths=0.2, # Lower threshold to capture lighter text
-        adjust_contrast=0.5,
-        low_text=0.3,
-        canvas_size=2560 # Larger canvas for long receipts
-    )
+from .cache import digest, get_cache
+from .engines import engine_name
+from .engines.base import to_gray
+from .config import OCR_READER_POOL_SIZE, OCR_TILE_HEIGHT, OCR_TILE_OVERLAP
+from .layout import pack_tokens, plan_strips, stitch_strips, unpack_tokens
+from .preprocess import ReceiptImage, preprocess_receipt  # re-exported for callers
+from .settings import current, job_settings
+
+# OCR engines (and torch / onnxruntime behind them) are loaded on first use:
+# it takes seconds, and callers that end up using the OCR daemon or a cache
+# hit never need them.
+
+# readtext knobs shared by every OCR pass (also part of the cache key)
+DETECT_PARAMS = {
+    "low_text": 0.3,
+    "canvas_size": 2560,  # Larger canvas for long receipts
+}
+RECOGNIZE_PARAMS = {
+    "contrast_ths": 0.2,  # Lower threshold to capture lighter text
+    "adjust_contrast": 0.5,
+}
+
+
+class ReaderPool:
+    """
+    Bounded pool of OCR engines (readers) for one backend and language set.
+
+    An easyocr.Reader is not safe to share between threads, so every OCR
+    call checks a reader out for its exclusive use and checks it back in.
+    Readers are created lazily up to `size`; past that, callers wait for
+    one to come back. The most recently returned reader is handed out
+    first, so a mostly idle pool keeps reusing one warm model.
+    Time spent waiting for a free reader is tracked in stats().
+    """
+
+    def __init__(self, lang=("en",), gpu=False, size: int = OCR_READER_POOL_SIZE, factory=None, engine: str | None = None):
+        self.engine = engine or engine_name()
+        self.lang = tuple(sorted(lang))
+        self.gpu = gpu
+        self.size = max(1, size)
+        self._factory = factory or self._new_reader
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _new_reader(self):
+        from .engines import create_engine
+
+        logging.info("Initializing %s OCR engine for %s (gpu=%s)", self.engine, self.lang, self.gpu)
+        return create_engine(self.engine, self.lang, self.gpu)
+
+    def checkout(self, timeout: float | None = None):
+        """Takes a reader for exclusive use; raises TimeoutError if none frees up in time."""
+        try:
+            reader = self._idle.get_nowait()
+        except queue.Empty:
+            reader = None
+
+        waited = 0.0
+        if reader is None:
+            with self._lock:
+                grow = self.created < self.size
+                if grow:
+                    self.created += 1
+            if grow:
+                try:
+                    reader = self._factory()
+                except Exception:
+                    with self._lock:
+                        self.created -= 1
+                    raise
+            else:
+                start = time.perf_counter()
+                try:
+                    reader = self._idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No OCR reader free after {timeout}s") from None
+                waited = time.perf_counter() - start
+
+        with self._lock:
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+        return reader
+
+    def checkin(self, reader):
+        self._idle.put(reader)
+
+    @contextmanager
+    def reader(self, timeout: float | None = None):
+        reader = self.checkout(timeout)
+        try:
+            yield reader
+        finally:
+            self.checkin(reader)
+
+    def warm(self, count: int = 1):
+        """Creates up to `count` readers ahead of the first scan."""
+        readers = [self.checkout() for _ in range(min(count, self.size))]
+        for reader in readers:
+            self.checkin(reader)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self.created,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_total": round(self.wait_total, 3),
+                "wait_max": round(self.wait_max, 3),
+            }
+
+
+# One pool per (engine, language set), shared by every thread of the process
+_READER_POOLS: dict[tuple, ReaderPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def reader_pool(lang=("en",), gpu=False) -> ReaderPool:
+    """Return the process-wide reader pool for `lang` on the current engine, creating it on first use."""
+    key = (engine_name(), tuple(sorted(lang)))
+    with _POOLS_LOCK:
+        if key not in _READER_POOLS:
+            _READER_POOLS[key] = ReaderPool(key[1], gpu, engine=key[0])
+        return _READER_POOLS[key]
+
+
+def warm_reader(lang=("en",), gpu=False):
+    """Loads one reader up front (process pool initializers, the daemon)."""
+    reader_pool(lang, gpu).warm()
+
+
+def _detect_params(canvas_size: int | None) -> dict:
+    return {**DETECT_PARAMS, "canvas_size": canvas_size} if canvas_size else DETECT_PARAMS
+
+
+def run_ocr(image, lang=("en",), gpu=False, canvas_size: int | None = None):
+    detect_params = _detect_params(canvas_size)
+    cache = get_cache()
+    key = digest("readtext", engine_name(), image, tuple(sorted(lang)), detect_params, RECOGNIZE_PARAMS) if cache else None
+    if key:
+        hit = cache.get(key)
+        if hit is not None:
+            return unpack_tokens(hit)
+
+    with reader_pool(lang, gpu).reader() as reader:
+        results = reader.readtext(image, **detect_params, **RECOGNIZE_PARAMS)
+    data = _to_tokens(results)
+
+    if key:
+        cache.put(key, **pack_tokens(data))
+    return data
+
+
+# ---------- batched OCR ----------
+
+# Images are padded up to a multiple of this per side so similar sizes share a batch
+BATCH_BUCKET = 256
+
+
+def size_bucket(shape: tuple[int, ...], step: int = BATCH_BUCKET) -> tuple[int, int]:
+    h, w = shape[:2]
+    return (-(-h // step) * step, -(-w // step) * step)
 
+
+def run_ocr_batch(
+    images: list[np.ndarray],
+    lang=("en",),
+    gpu=False,
+    canvas_size: int | list[int | None] | None = None,
+) -> list[list[dict]]:
+    """
+    OCRs several images with EasyOCR's batched readtext: images are grouped
+    by size bucket (and canvas size), padded with white at the bottom/right
+    so box coordinates stay valid, and each group goes through the detector
+    and recognizer as one batch.
+    `canvas_size` is either shared or given per image.
+    Returns one token list per input image, in input order. Cache entries
+    are shared with run_ocr.
+    """
+    canvases = canvas_size if isinstance(canvas_size, list) else [canvas_size] * len(images)
+    cache = get_cache()
+    out: list[list[dict] | None] = [None] * len(images)
+    keys: list[str | None] = [None] * len(images)
+
+    buckets: dict[tuple, list[int]] = {}
+    for i, img in enumerate(images):
+        detect_params = _detect_params(canvases[i])
+        if cache:
+            keys[i] = digest("readtext", engine_name(), img, tuple(sorted(lang)), detect_params, RECOGNIZE_PARAMS)
+            hit = cache.get(keys[i])
+            if hit is not None:
+                out[i] = unpack_tokens(hit)
+                continue
+        bucket = size_bucket(img.shape) + (img.ndim, detect_params["canvas_size"])
+        buckets.setdefault(bucket, []).append(i)
+
+    for (bh, bw, _, canvas), idx in buckets.items():
+        batch = []
+        for i in idx:
+            img = images[i]
+            h, w = img.shape[:2]
+            pad = ((0, bh - h), (0, bw - w)) + ((0, 0),) * (img.ndim - 2)
+            batch.append(np.pad(img, pad, constant_values=255))
+
+        logging.info(f"Batched OCR: {len(idx)} image(s) at {bw}x{bh}")
+        with reader_pool(lang, gpu).reader() as reader:
+            results = reader.readtext_batched(
+                batch, batch_size=len(batch), **_detect_params(canvas), **RECOGNIZE_PARAMS
+            )
+        for i, res in zip(idx, results):
+            out[i] = _to_tokens(res)
+            if keys[i]:
+                cache.put(keys[i], **pack_tokens(out[i]))
+
+    return out
+
+
+# ---------- strip-tiled OCR ----------
+
+# ((workers, lang, gpu), pool); swapped under _TILE_LOCK, which callers also
+# hold while submitting so a concurrent swap can't shut the pool down first
+_TILE_POOL: tuple[tuple, ProcessPoolExecutor] | None = None
+_TILE_LOCK = threading.Lock()
+
+
+def _tile_pool(workers: int, lang, gpu) -> ProcessPoolExecutor:
+    """
+    Long-lived pool whose workers each keep a warm reader between receipts,
+    replaced when another worker count, language set or device is asked for.
+    Call with _TILE_LOCK held.
+    """
+    global _TILE_POOL
+    key = (workers, tuple(sorted(lang)), gpu)
+    if _TILE_POOL is None or _TILE_POOL[0] != key:
+        if _TILE_POOL is not None:
+            # Strips already queued on the old pool still run
+            _TILE_POOL[1].shutdown(wait=False)
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_reader, initargs=(lang, gpu))
+        _TILE_POOL = (key, pool)
+    return _TILE_POOL[1]
+
+
+def _shutdown_tile_pool():
+    with _TILE_LOCK:
+        if _TILE_POOL is not None:
+            _TILE_POOL[1].shutdown()
+
+
+atexit.register(_shutdown_tile_pool)
+
+
+def _ocr_strip(strip: np.ndarray, top: int, lang, gpu, settings: dict) -> dict[str, np.ndarray]:
+    # The pool outlives the job, so its settings come with every strip
+    with job_settings(settings):
+        tokens = run_ocr(strip, lang, gpu, canvas_size=max(strip.shape[:2]))
+    packed = pack_tokens(tokens)
+    packed["box"][:, [1, 3]] += top
+    return packed
+
+
+def run_ocr_tiled(
+    image,
+    lang=("en",),
+    gpu=False,
+    workers: int = 2,
+    strip_height: int = OCR_TILE_HEIGHT,
+    overlap: int = OCR_TILE_OVERLAP,
+) -> list[dict]:
+    """
+    OCRs a tall receipt as overlapping horizontal strips in parallel
+    processes, then stitches tokens back in reading order (see stitch_strips).
+    Images no taller than one strip go straight to run_ocr.
+    """
+    bands = plan_strips(image.shape[0], strip_height, overlap)
+    if len(bands) == 1:
+        return run_ocr(image, lang, gpu)
+
+    logging.info(f"Tiled OCR: {len(bands)} strips over {workers} worker(s)")
+    settings = current()
+    with _TILE_LOCK:
+        pool = _tile_pool(workers, lang, gpu)
+        futures = [pool.submit(_ocr_strip, image[top:bottom], top, lang, gpu, settings) for top, bottom in bands]
+    strips = [(top, bottom, unpack_tokens(f.result())) for (top, bottom), f in zip(bands, futures)]
+    return stitch_strips(strips)
+
+
+def _to_tokens(results) -> list[dict]:
+    """
+    Converts EasyOCR (bbox, text, conf) triples into parser tokens.
+    Boxes are axis-aligned [x0, y0, x1, y1] rows of one shared int32 array,
+    so geometry costs 16 bytes per token instead of nested point lists.
+    """
+    kept = [(bbox, (text or "").strip(), conf) for bbox, text, conf in results]
+    kept = [k for k in kept if k[1]]
+
+    boxes = np.empty((len(kept), 4), dtype=np.int32)
     data = []
-    for bbox, text, conf in results:
-        text = (text or "").strip()
-        if text:
-            data.append({"text": text, "confidence": round(float(conf), 3)})
+    for i, (bbox, text, conf) in enumerate(kept):
+        pts = np.asarray(bbox, dtype=np.float32)
+        boxes[i] = (pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max())
+        data.append({"text": text, "confidence": round(float(conf), 3), "box": boxes[i]})
+
+    return data
+
+
+# ---------- split detection / recognition ----------
+# Same knobs as run_ocr, so results match a plain readtext call
+
+def detect_regions(image, lang=("en",), gpu=False, canvas_size: int | None = None) -> tuple[list, list]:
+    """
+    Runs only the text detector on `image`.
+    Returns EasyOCR's (horizontal_list, free_list) for reuse in recognize_regions.
+    """
+    detect_params = _detect_params(canvas_size)
+    cache = get_cache()
+    key = digest("detect", engine_name(), image, tuple(sorted(lang)), detect_params) if cache else None
+    hit = cache.get(key) if key else None
+
+    if hit is not None:
+        horizontal, free = hit["horizontal"], hit["free"]
+    else:
+        with reader_pool(lang, gpu).reader() as reader:
+            horizontal_list, free_list = reader.detect(image, **detect_params)
+        horizontal = np.asarray(horizontal_list[0], dtype=np.int32).reshape(-1, 4)
+        free = np.asarray(free_list[0], dtype=np.float32).reshape(-1, 4, 2)
+        if key:
+            cache.put(key, horizontal=horizontal, free=free)
+
+    # Plain lists either way, so cold and warm runs hash identically downstream
+    return horizontal.tolist(), free.tolist()
+
+
+def split_regions(regions: tuple[list, list], y_limit: int) -> tuple[tuple[list, list], tuple[list, list]]:
+    """Splits detected regions into those starting above `y_limit` (header band) and the rest."""
+    horizontal_list, free_list = regions
+    # horizontal boxes are [x_min, x_max, y_min, y_max], free boxes are 4 points
+    top_h = [b for b in horizontal_list if b[2] < y_limit]
+    rest_h = [b for b in horizontal_list if b[2] >= y_limit]
+    top_f = [b for b in free_list if min(p[1] for p in b) < y_limit]
+    rest_f = [b for b in free_list if min(p[1] for p in b) >= y_limit]
+    return (top_h, top_f), (rest_h, rest_f)
+
+
+def recognize_regions(image, horizontal_list: list, free_list: list, lang=("en",), gpu=False) -> list[dict]:
+    """Recognizes text inside already detected regions (same token format as run_ocr)."""
+    if not horizontal_list and not free_list:
+        return []
+
+    cache = get_cache()
+    key = None
+    if cache:
+        key = digest("recognize", engine_name(), image, horizontal_list, free_list, tuple(sorted(lang)), RECOGNIZE_PARAMS)
+        hit = cache.get(key)
+        if hit is not None:
+            return unpack_tokens(hit)
 
+    img_cv_grey = to_gray(image)
+    with reader_pool(lang, gpu).reader() as reader:
+        results = reader.recognize(
+            img_cv_grey,
+            horizontal_list=horizontal_list,
+            free_list=free_list,
+            reformat=False,
+            **RECOGNIZE_PARAMS,
+        )
+    data = _to_tokens(results)
 
+    if key:
+        cache.put(key, **pack_tokens(data))
     return data
@@ -1,26 +1,34 @@
+"""
+OpenAI Vision extraction through one shared client per process.
+
+The client (and its keep-alive connection pool) is created on first use and
+reused by every call, sync or async; a new API key (set from the GUI)
+replaces it. At most VISION_CONCURRENCY requests are in flight at a time,
+and rate limits, server errors and dropped connections are retried with
+jittered exponential backoff until VISION_DEADLINE.
+"""
+import asyncio
 import json
 import logging
 import os
 import base64
+import random
+import threading
+import time
+import weakref
 import cv2
 import numpy as np
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, OpenAI
 
-load_dotenv()
+from .config import VISION_BACKOFF, VISION_BACKOFF_MAX, VISION_CONCURRENCY, VISION_DEADLINE, VISION_MODEL
 
-def extract_data_with_openai_vision(image_array: np.ndarray) -> dict:
-    """
-    Sends the preprocessed image directly to OpenAI Vision (GPT-4o)
-    for high-accuracy data extraction.
-    """
-    api_key = os.getenv("OPEN_AI_API")
-    prompt = os.getenv("EXTRACT_DATA_PROMPT")
+load_dotenv()
 
-    if not api_key:
-        raise ValueError("OPEN_AI_API environment variable not set.")
 
+def _prompt() -> str:
+    prompt = os.getenv("EXTRACT_DATA_PROMPT")
     if prompt is None:
         # Fallback prompt if .env is missing it
         prompt = (
@@ -29,22 +37,124 @@ def extract_data_with_openai_vision(image_array: np.ndarray) -> dict:
             "Calculate 'total' as the final grand total paid (including taxes). "
             "Do not list Tax or Shipping as items. Return ONLY JSON."
         )
+    return prompt
 
-    # 1. Convert OpenCV image (NumPy array) to Base64
+
+def encode_image(image_array: np.ndarray) -> str:
+    """OpenCV image (NumPy array) as the base64 JPEG sent to Vision AI."""
     _, buffer = cv2.imencode(".jpg", image_array, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
-    base64_image = base64.b64encode(buffer).decode("utf-8")
+    return base64.b64encode(buffer).decode("utf-8")
 
-    client = OpenAI(api_key=api_key)
 
-    try:
-        logging.info("Sending image to OpenAI Vision model...")
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini", # or gpt-4o for maximum power
-            messages=[
+def _standardize(content: str) -> dict:
+    data = json.loads(content)
+
+    if "store_name" in data and "store" not in data:
+        data["store"] = data.pop("store_name")
+
+    for item in data.get("items", []):
+        if "item_name" in item and "name" not in item:
+            item["name"] = item.pop("item_name")
+
+    data.setdefault("store", "Unknown Store")
+    data.setdefault("items", [])
+    data.setdefault("total", 0.0)
+
+    return data
+
+
+def _retryable(error: Exception) -> bool:
+    """Rate limits, server errors and connection failures (timeouts included)."""
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+
+class VisionClient:
+    """
+    Shared OpenAI clients with a concurrency limit and retries; see the
+    module docstring. `api_key` defaults to $OPEN_AI_API, read on every
+    call; `base_url` to the SDK's own default ($OPENAI_BASE_URL or OpenAI).
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        base_url: str | None = None,
+        model: str = VISION_MODEL,
+        concurrency: int = VISION_CONCURRENCY,
+        backoff: float = VISION_BACKOFF,
+        backoff_max: float = VISION_BACKOFF_MAX,
+        deadline: float = VISION_DEADLINE,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.concurrency = max(1, concurrency)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.concurrency)
+        self._sync: tuple[str, OpenAI] | None = None
+        # Async clients and semaphores belong to the event loop they run on:
+        # {loop: {"semaphore", "client": (key, AsyncOpenAI) | None}}
+        self._async: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def _key(self) -> str:
+        key = self.api_key or os.getenv("OPEN_AI_API")
+        if not key:
+            raise ValueError("OPEN_AI_API environment variable not set.")
+        return key
+
+    def _options(self, key: str) -> dict:
+        # Retries are ours (below), so they share the deadline and the limit
+        options = {"api_key": key, "max_retries": 0}
+        if self.base_url:
+            options["base_url"] = self.base_url
+        return options
+
+    def client(self) -> OpenAI:
+        key = self._key()
+        with self._lock:
+            if self._sync is None or self._sync[0] != key:
+                # A replaced client may still have requests in flight; it is
+                # closed when garbage collected
+                self._sync = (key, OpenAI(**self._options(key)))
+            return self._sync[1]
+
+    def async_client(self, concurrency: int | None = None) -> tuple[AsyncOpenAI, asyncio.Semaphore]:
+        """
+        This event loop's client and concurrency semaphore. `concurrency`
+        overrides the limit for the loop when it first calls in.
+        """
+        key = self._key()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._async.get(loop)
+            if entry is None:
+                entry = {"semaphore": asyncio.Semaphore(max(1, concurrency or self.concurrency)), "client": None}
+                self._async[loop] = entry
+            if entry["client"] is None or entry["client"][0] != key:
+                entry["client"] = (key, AsyncOpenAI(**self._options(key)))
+            return entry["client"][1], entry["semaphore"]
+
+    async def aclose(self):
+        """Closes this event loop's client; call before the loop ends (asyncio.run)."""
+        with self._lock:
+            entry = self._async.pop(asyncio.get_running_loop(), None)
+        if entry and entry["client"] is not None:
+            await entry["client"][1].close()
+
+    def _request(self, base64_image: str, timeout: float) -> dict:
+        return {
+            "model": self.model,
+            "messages": [
                 {
                     "role": "user",
                     "content": [
-                        {"type": "text", "text": prompt},
+                        {"type": "text", "text": _prompt()},
                         {
                             "type": "image_url",
                             "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
@@ -52,27 +162,101 @@ def extract_data_with_openai_vision(image_array: np.ndarray) -> dict:
                     ],
                 }
             ],
-            max_tokens=1000,
-            response_format={"type": "json_object"},
-        )
+            "max_tokens": 1000,
+            "response_format": {"type": "json_object"},
+            "timeout": timeout,
+        }
 
-        content = resp.choices[0].message.content
-        data = json.loads(content)
+    def _delay(self, error: Exception, attempt: int, start: float) -> float | None:
+        """Seconds to wait before retrying after `error`, or None to give up."""
+        if not _retryable(error):
+            return None
+        # Full jitter: concurrent callers hitting the same limit spread out
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+        if isinstance(error, APIStatusError):
+            try:
+                delay = max(delay, float(error.response.headers.get("retry-after", 0)))
+            except ValueError:
+                pass
+        if time.monotonic() + delay - start >= self.deadline:
+            return None
+        logging.warning(f"OpenAI Vision: {error}; retrying in {delay:.1f}s")
+        return delay
 
-        # Standardize structure
-        if "store_name" in data and "store" not in data:
-            data["store"] = data.pop("store_name")
+    def extract(self, image: np.ndarray | str) -> dict:
+        """
+        Structured receipt data from the image (an array, or encode_image()
+        output); raises once retries are exhausted.
+        """
+        client = self.client()
+        base64_image = image if isinstance(image, str) else encode_image(image)
+        start = time.monotonic()
+        attempt = 0
+        logging.info("Sending image to OpenAI Vision model...")
+        while True:
+            remaining = self.deadline - (time.monotonic() - start)
+            try:
+                with self._semaphore:
+                    resp = client.chat.completions.create(**self._request(base64_image, remaining))
+                return _standardize(resp.choices[0].message.content)
+            except Exception as e:
+                delay = self._delay(e, attempt, start)
+                if delay is None:
+                    logging.error(f"OpenAI Vision error: {e}")
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def extract_async(self, image: np.ndarray | str, concurrency: int | None = None) -> dict:
+        """extract() as a coroutine, limited per event loop (see async_client)."""
+        client, semaphore = self.async_client(concurrency)
+        base64_image = image if isinstance(image, str) else await asyncio.to_thread(encode_image, image)
+        start = time.monotonic()
+        attempt = 0
+        logging.info("Sending image to OpenAI Vision model...")
+        while True:
+            remaining = self.deadline - (time.monotonic() - start)
+            try:
+                async with semaphore:
+                    resp = await client.chat.completions.create(**self._request(base64_image, remaining))
+                return _standardize(resp.choices[0].message.content)
+            except Exception as e:
+                delay = self._delay(e, attempt, start)
+                if delay is None:
+                    logging.error(f"OpenAI Vision error: {e}")
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
 
-        for item in data.get("items", []):
-            if "item_name" in item and "name" not in item:
-                item["name"] = item.pop("item_name")
 
-        data.setdefault("store", "Unknown Store")
-        data.setdefault("items", [])
-        data.setdefault("total", 0.0)
+_CLIENT: VisionClient | None = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_vision_client() -> VisionClient:
+    """Process-wide Vision client, created on first use."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = VisionClient()
+        return _CLIENT
+
+
+def set_vision_client(client: VisionClient | None):
+    """Overrides the process-wide Vision client (None: a default one on next use)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        _CLIENT = client
+
+
+def extract_data_with_openai_vision(image_array: np.ndarray | str) -> dict:
+    """
+    Sends the preprocessed image directly to OpenAI Vision (GPT-4o)
+    for high-accuracy data extraction.
+    """
+    return get_vision_client().extract(image_array)
 
-        return data
 
-    except Exception as e:
-        logging.error(f"OpenAI Vision error: {e}")
-        raise e
+async def extract_data_with_openai_vision_async(image_array: np.ndarray | str, concurrency: int | None = None) -> dict:
+    """extract_data_with_openai_vision() for asyncio callers."""
+    return await get_vision_client().extract_async(image_array, concurrency)
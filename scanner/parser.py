@@ -8,11 +8,52 @@ from scanner.config import (
     WEIGHT_RX,
 )
 
-from .utils import is_noise_token, looks_like_item_name, norm, price_from, prices_in
+from .layout import reconstruct_lines
+from .utils import has_item_name_shape, is_noise_token, looks_like_item_name, norm, price_from, prices_in
+
+TOTAL_HINTS = ("grand total", "amount due", "balance due", "order total", "total")
+BARE_PRICE_RX = re.compile(r"-?\d+\.\d{2}")
+YOU_SAVED_RX = re.compile(r"\byou\s*sav")
+
+
+class Line:
+    """
+    One receipt line scanned once: normalized text, first price, all prices
+    and the flags the item loop branches on. The pattern matches (deal,
+    quantity, weight) are only looked for on priced lines, the only ones
+    that can close an item.
+    """
+
+    __slots__ = (
+        "text", "price", "prices", "name", "noise", "you_saved", "promotion", "voided",
+        "stop", "total", "bare_price", "deal", "qty_at", "weight",
+    )
+
+    def __init__(self, text: str):
+        self.text = text = norm(text)
+        low = text.lower()
+        self.price = price_from(text)
+        self.name = self.price is None and has_item_name_shape(text)
+        self.noise = is_noise_token(text)
+        # One copy of each rule: the is_* helpers below
+        self.you_saved = is_you_saved(text)
+        self.promotion = is_promotion(text)
+        self.voided = is_voided(text)
+        self.stop = is_stop_line(text)
+        self.total = any(k in low for k in TOTAL_HINTS)
+
+        self.prices, self.bare_price = [], False
+        self.deal = self.qty_at = self.weight = None
+        if self.price is not None:
+            self.prices = prices_in(text)
+            self.bare_price = len(self.prices) == 1 and BARE_PRICE_RX.fullmatch(text) is not None
+            self.deal = DEAL_RX.search(text)
+            self.qty_at = QTY_AT_RX.search(text)
+            self.weight = WEIGHT_RX.search(text) or WEIGHT_FALLBACK_RX.search(text)
 
 
 def parse_receipt(raw_ocr: list[dict], min_conf: float = 0.30) -> dict:
-    lines: list[str] = []
+    kept: list[dict] = []
     for x in raw_ocr:
         text = norm(x.get("text") or "")
         if not text:
@@ -29,8 +70,10 @@ def parse_receipt(raw_ocr: list[dict], min_conf: float = 0.30) -> dict:
 
         # Keep prices always, names by threshold/shape
         if price_from(text) is not None or conf >= min_conf or (conf >= 0.12 and looks_like_item_name(text)):
-            lines.append(text)
+            kept.append({**x, "text": text})
 
+    # With geometry, rebuild physical rows first; otherwise trust token order
+    lines = [x["text"] for x in reconstruct_lines(kept)]
     lines = merge_split_prices(lines)
 
     # ---------- detect store ----------
@@ -55,45 +98,48 @@ def parse_receipt(raw_ocr: list[dict], min_conf: float = 0.30) -> dict:
     def reset_name():
         name_parts.clear()
 
+    # One scan per line; the loops below only read these records
+    recs = [Line(l) for l in lines]
+
     # pointer for
     i = 0
-    while i < len(lines):
-        line = lines[i]
+    while i < len(recs):
+        line = recs[i]
 
         # Pattern 6: Voided item -> next line is name, then -(price) (same or next line)
-        if is_voided(line):
+        if line.voided:
             i += 1
 
             # Collect voided item name (1..3 lines)
             void_name_parts = []
-            while i < len(lines) and len(void_name_parts) < 3:
-                s = lines[i].strip()
+            while i < len(recs) and len(void_name_parts) < 3:
+                s = recs[i]
 
                 # Stop/totals
-                if is_stop_line(s):
+                if s.stop:
                     break
 
                 # Price -> name ended
-                if price_from(s) is not None:
+                if s.price is not None:
                     break
 
                 # Skip trash tokens
-                if is_noise_token(s) or is_you_saved(s) or is_promotion(s):
+                if s.noise or s.you_saved or s.promotion:
                     i += 1
                     continue
 
                 # Take only what looks like an item
-                if looks_like_item_name(s):
-                    void_name_parts.append(s)
+                if s.name:
+                    void_name_parts.append(s.text)
 
                 i += 1
 
             # Price for voided (this line or next)
             void_price = None
-            if i < len(lines):
-                void_price = price_from(lines[i])
-                if void_price is None and i + 1 < len(lines):
-                    void_price = price_from(lines[i + 1])
+            if i < len(recs):
+                void_price = recs[i].price
+                if void_price is None and i + 1 < len(recs):
+                    void_price = recs[i + 1].price
                     if void_price is not None:
                         i += 1
 
@@ -110,19 +156,14 @@ def parse_receipt(raw_ocr: list[dict], min_conf: float = 0.30) -> dict:
             continue
 
         # Stop near totals (but allow to continue if it's a stray "TOTAL" without a price)
-        if is_stop_line(line):
+        if line.stop:
             # If next line has a price, assume we're in totals section
-            if i + 1 < len(lines) and price_from(lines[i + 1]) is not None:
+            if i + 1 < len(recs) and recs[i + 1].price is not None:
                 break
 
-        # Collect item name parts
-        if price_from(line) is None and looks_like_item_name(line) and not name_parts:
-            name_parts.append(line)
-            i += 1
-            continue
-        if price_from(line) is None and looks_like_item_name(line) and name_parts:
-            # Sometimes name spans multiple lines
-            name_parts.append(line)
+        # Collect item name parts (sometimes a name spans multiple lines)
+        if line.name:
+            name_parts.append(line.text)
             i += 1
             continue
 
@@ -131,20 +172,19 @@ def parse_receipt(raw_ocr: list[dict], min_conf: float = 0.30) -> dict:
 
         # Base pattern: Name + (price) on some line (could be current line)
         # If current line is just a price and we have a name -> close item
-        if nm and price_from(line) is not None and len(prices_in(line)) == 1 and re.fullmatch(r"-?\d+\.\d{2}", norm(line)):
-            base_price = price_from(line)
-            items.append({"name": nm, "price": base_price})
+        if nm and line.bare_price:
+            items.append({"name": nm, "price": line.price})
             reset_name()
             i += 1
             continue
 
         # If line contains price and we have a name and line isn't a deal/qty/weight -> treat as base item price
-        if nm and price_from(line) is not None:
+        if nm and line.price is not None:
             # Pattern 1: deal "1 @ 2 FOR (unit) (final)"
-            mdeal = DEAL_RX.search(line)
+            mdeal = line.deal
             if mdeal:
                 deal_qty = int(mdeal.group("buy"))
-                ps = prices_in(line)
+                ps = line.prices
                 unit = None
                 final = None
                 # Typical: "... 2 FOR 1.99 3.98" -> unit=1.99, final=3.98
@@ -160,11 +200,11 @@ def parse_receipt(raw_ocr: list[dict], min_conf: float = 0.30) -> dict:
                     continue
 
             # Pattern 2: quantity "3 @ (unit) (final)"
-            mqty = QTY_AT_RX.search(line)
+            mqty = line.qty_at
             if mqty:
                 qty = int(mqty.group("qty"))
                 unit = float(mqty.group("unit").replace(",", "."))
-                ps = prices_in(line)
+                ps = line.prices
                 final = ps[-1] if ps else None
                 if final is not None:
                     items.append({"name": nm, "price": final, "qty": qty, "unit_price": unit})
@@ -174,7 +214,7 @@ def parse_receipt(raw_ocr: list[dict], min_conf: float = 0.30) -> dict:
 
             # Pattern 3: by weight
             w = None
-            mw = WEIGHT_RX.search(line) or WEIGHT_FALLBACK_RX.search(line)
+            mw = line.weight
             if mw:
                 qty = float(mw.group("qty").replace(",", "."))
                 unit = float(mw.group("unit").replace(",", "."))
@@ -188,19 +228,18 @@ def parse_receipt(raw_ocr: list[dict], min_conf: float = 0.30) -> dict:
                 continue
 
             # Otherwise treat as normal: Name + price on same line
-            base_price = price_from(line)
-            items.append({"name": nm, "price": base_price})
+            items.append({"name": nm, "price": line.price})
             reset_name()
             i += 1
             continue
 
         # Pattern 4: after base item, Promotion line then negative discount next
         # (Handled by scanning when we see "Promotion" while no name_parts)
-        if is_promotion(line):
+        if line.promotion:
             # Discount amount might be on same or next line
-            disc = price_from(line)
-            if disc is None and i + 1 < len(lines):
-                disc = price_from(lines[i + 1])
+            disc = line.price
+            if disc is None and i + 1 < len(recs):
+                disc = recs[i + 1].price
                 if disc is not None:
                     i += 1
             if disc is not None and disc > 0:
@@ -216,24 +255,18 @@ def parse_receipt(raw_ocr: list[dict], min_conf: float = 0.30) -> dict:
 
     # ---------- extract total ----------
     total = None
-    for idx, line in enumerate(lines):
-        low = norm(line).lower()
-
-        if any(k in low for k in ("grand total", "amount due", "balance due", "order total", "total")):
+    for idx, line in enumerate(recs):
+        if line.total:
             # Same line first
-            total = price_from(line)
-            if total is None and idx + 1 < len(lines):
-                total = price_from(lines[idx + 1])
+            total = line.price
+            if total is None and idx + 1 < len(recs):
+                total = recs[idx + 1].price
             if total is not None:
                 break
 
     if total is None:
         # Fallback: max positive price in tail of receipt
-        all_prices = []
-        for l in lines:
-            p = price_from(l)
-            if p is not None:
-                all_prices.append(p)
+        all_prices = [l.price for l in recs if l.price is not None]
         positives = [p for p in all_prices if p >= 0]
         total = max(positives) if positives else (max(all_prices) if all_prices else None)
 
@@ -261,12 +294,12 @@ def merge_split_prices(lines: list[str]) -> list[str]:
     return out
 
 
-    # ---------- clean lines ----------
+# ---------- clean lines ----------
 
 # helpers for unnecessary parts of the check
 def is_you_saved(s: str) -> bool:
     s = norm(s).lower()
-    return "you saved" in s or bool(re.search(r"\byou\s*sav", s))
+    return "you saved" in s or bool(YOU_SAVED_RX.search(s))
 
 
 def is_promotion(s: str) -> bool:
@@ -0,0 +1,311 @@
+"""
+Batch scanning as an asyncio pipeline, so CPU-bound OCR and Vision AI
+network waits overlap instead of taking turns:
+
+    scan -> vision -> generic -> store
+
+Each stage runs a number of worker coroutines pulling receipts from a
+bounded queue. The scan stage does a receipt's preprocessing, header match
+and local parse in one pool task, so the page never leaves that process;
+only receipts no template claims come back, as the JPEG Vision AI is sent.
+Vision AI requests are coroutines on the shared async client
+(scanner/openai_service.py), receipts Vision AI fails on get the generic
+parse on the pool, and the store stage writes whatever is ready in one
+flush before checkpointing it. When a stage falls behind, the queue in
+front of it fills up and the stages before it wait.
+
+run_stages() is the generic runner; run_pipeline() wires the scanner's own
+functions into it the way batch.run_batch() uses them.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Iterable
+
+from .batch import Manifest, _init_worker, file_key
+from .config import PIPELINE_QUEUE_SIZE, PIPELINE_VISION_WORKERS, WRITER_FLUSH_EVERY
+from .dedup import get_duplicate_index
+from .storage import open_writer
+
+# End of input, passed down the stages once every job has gone through
+_DONE = object()
+
+
+class Stage:
+    """
+    One pipeline step. `fn` is a coroutine function updating a job dict in
+    place, or a list of up to `batch` jobs when `batch` > 0 (whatever is
+    queued, at least one). `workers` coroutines run it concurrently.
+    """
+
+    def __init__(self, name: str, fn: Callable[..., Awaitable[None]], workers: int = 1, batch: int = 0):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.batch = batch
+
+
+async def run_stages(jobs: Iterable[dict], stages: list[Stage], queue_size: int = PIPELINE_QUEUE_SIZE) -> dict:
+    """
+    Runs every job through `stages` in order, with at most `queue_size` jobs
+    waiting in front of each stage. Jobs leave a stage in the order they
+    finish, not the order they came in.
+
+    An exception in a stage is stored as the job's "error" and the job skips
+    the remaining stages except the last one, which sees every job (it is
+    the sink recording successes and failures). An exception in the last
+    stage stops the run and propagates.
+
+    Returns per-stage counters: {name: {"jobs": n, "busy": seconds}}.
+    """
+    queues = [asyncio.Queue(maxsize=max(1, queue_size)) for _ in stages]
+    counters = {stage.name: {"jobs": 0, "busy": 0.0} for stage in stages}
+    running = [stage.workers for stage in stages]
+
+    async def feed():
+        for job in jobs:
+            await queues[0].put(job)
+        await queues[0].put(_DONE)
+
+    async def take(n: int, stage: Stage) -> list:
+        batch = [await queues[n].get()]
+        while stage.batch and len(batch) < stage.batch and batch[-1] is not _DONE and not queues[n].empty():
+            batch.append(queues[n].get_nowait())
+        return batch
+
+    async def work(n: int, stage: Stage):
+        last = n == len(stages) - 1
+        while True:
+            batch = await take(n, stage)
+            done = batch[-1] is _DONE
+            if done:
+                batch.pop()
+            todo = batch if last else [job for job in batch if "error" not in job]
+
+            if todo:
+                started = time.perf_counter()
+                try:
+                    if stage.batch:
+                        await stage.fn(todo)
+                    else:
+                        await stage.fn(todo[0])
+                except Exception as e:
+                    if last:
+                        raise
+                    logging.debug(f"{stage.name} failed for {', '.join(str(j.get('path')) for j in todo)}: {e}")
+                    for job in todo:
+                        job["error"] = str(e)
+                counters[stage.name]["jobs"] += len(todo)
+                counters[stage.name]["busy"] += time.perf_counter() - started
+
+            if not last:
+                for job in batch:
+                    await queues[n + 1].put(job)
+
+            if done:
+                running[n] -= 1
+                if running[n]:
+                    # Let this stage's other workers see the end too
+                    queues[n].put_nowait(_DONE)
+                elif not last:
+                    await queues[n + 1].put(_DONE)
+                return
+
+    tasks = [asyncio.ensure_future(feed())]
+    for n, stage in enumerate(stages):
+        tasks.extend(asyncio.ensure_future(work(n, stage)) for _ in range(stage.workers))
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    for counter in counters.values():
+        counter["busy"] = round(counter["busy"], 3)
+    return counters
+
+
+# ---------- CPU stages (pool processes) ----------
+
+def _drain(route) -> dict | None:
+    """Runs a ScannerManager._route generator to its result, dropping the events."""
+    while True:
+        try:
+            next(route)
+        except StopIteration as stop:
+            return stop.value
+
+
+def _scan(path: str, receipt_options: dict) -> dict:
+    """
+    Preprocesses one receipt and routes it like ScannerManager.process (single
+    pass OCR, template or generic parse, archived), keeping the page in this
+    process. Returns {"result"} when done here, plus the dedup "key" and the
+    receipt's settings; for a receipt no template claims with Vision AI
+    available, the base64 JPEG for it under "vision" instead of a result.
+    """
+    from .dedup import receipt_hash
+    from .manager import ScannerManager
+    from .openai_service import encode_image
+    from .preprocess import ReceiptImage
+
+    receipt = ReceiptImage(path, **receipt_options)
+    out = {}
+    index = get_duplicate_index()
+    if index is not None:
+        key = receipt_hash(receipt.cropped)
+        duplicate = index.duplicate_result(key)
+        if duplicate is not None:
+            return {"result": duplicate}
+        out["key"] = key
+
+    page = receipt.ocr_image
+    out["receipt"] = ScannerManager._receipt_meta(receipt)
+    capture = {}
+    result = _drain(ScannerManager._route(page, None, receipt.canvas_size, 0, capture, defer_vision=True))
+    if capture:
+        ScannerManager._archive(out["receipt"], **capture)
+    if result is None:
+        out["vision"] = encode_image(page)
+    else:
+        out["result"] = result
+    return out
+
+
+def _parse_generic(path: str, receipt_options: dict) -> dict:
+    """Generic local parse of a receipt Vision AI failed on (preprocessing comes from the cache)."""
+    from .manager import ScannerManager
+    from .ocr import run_ocr
+    from .parser import parse_receipt
+    from .preprocess import ReceiptImage
+
+    receipt = ReceiptImage(path, **receipt_options)
+    tokens = run_ocr(receipt.ocr_image, canvas_size=receipt.canvas_size)
+    ScannerManager._archive(receipt, tokens, None, "full", receipt.canvas_size)
+    return parse_receipt(tokens)
+
+
+def run_pipeline(
+    paths: list[str],
+    output: str,
+    workers: int = 1,
+    manifest_path: str | None = None,
+    receipt_options: dict | None = None,
+    writer_options: dict | None = None,
+    vision_workers: int = PIPELINE_VISION_WORKERS,
+    queue_size: int = PIPELINE_QUEUE_SIZE,
+    stage_workers: dict | None = None,
+) -> dict:
+    """
+    run_batch() as a pipeline: same manifest, output and counters, but every
+    receipt moves through the stages on its own, so Vision AI requests (up
+    to `vision_workers` at once) wait while the `workers` pool processes
+    keep preprocessing and OCR-ing other receipts. `stage_workers` overrides
+    the worker count of individual stages by name (scan, vision, generic,
+    store).
+
+    Duplicates are caught against receipts already stored, so two copies in
+    flight at the same time are both scanned.
+    """
+    manifest = Manifest(manifest_path or f"{output}.manifest.jsonl")
+
+    pending = []
+    for path in paths:
+        key = file_key(path)
+        if not manifest.is_done(path, key):
+            pending.append((path, key))
+
+    stats = {"total": len(paths), "skipped": len(paths) - len(pending), "ok": 0, "failed": 0, "duplicates": 0}
+    if stats["skipped"]:
+        logging.info(f"Resuming: {stats['skipped']} image(s) already processed per {manifest.path}")
+    if not pending:
+        return stats
+
+    workers = max(1, min(workers, len(pending)))
+    counts = {"scan": workers, "vision": vision_workers, "generic": workers, "store": 1}
+    counts.update(stage_workers or {})
+    logging.info(f"Pipelining {len(pending)} image(s) over {workers} worker(s), {counts['vision']} Vision AI request(s) at a time...")
+
+    # Vision AI is called from this process
+    from .manager import ScannerManager
+    from .openai_service import get_vision_client
+
+    receipt_options = receipt_options or {}
+    index = get_duplicate_index()
+    init_args = (("en",), False, logging.getLogger().getEffectiveLevel())
+
+    with open_writer(output, **(writer_options or {})) as writer, ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as pool:
+
+        async def cpu(fn, *args):
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+        async def scan(job):
+            job.update(await cpu(_scan, job["path"], receipt_options))
+
+        async def vision(job):
+            image = job.pop("vision", None)
+            if image is not None:
+                # The stage's worker count is this run's request limit
+                result = await ScannerManager._try_vision_async(image, counts["vision"])
+                if result is not None:
+                    job["result"] = result
+
+        async def generic(job):
+            if "result" not in job:
+                job["result"] = await cpu(_parse_generic, job["path"], receipt_options)
+
+        def save(jobs):
+            saved = []
+            for job in jobs:
+                path, key = job["path"], job["key_file"]
+                elapsed = round(time.perf_counter() - job["start"], 3)
+                if "error" in job:
+                    logging.error(f"Failed to process {path}: {job['error']}")
+                    manifest.record(path, key, "error", error=job["error"])
+                    stats["failed"] += 1
+                    continue
+                result = job["result"]
+                if "key" in job:
+                    index.add(job["key"], result, source=path)
+                if "receipt" in job:
+                    result["meta"] = {"resolution": job["receipt"]["plan"], "elapsed": elapsed}
+                result["source"] = path
+                writer.write(result)
+                saved.append((path, key, elapsed, result.get("duplicate_of")))
+
+            # Save before checkpointing, as in run_batch
+            writer.flush()
+            for path, key, elapsed, duplicate_of in saved:
+                if duplicate_of:
+                    logging.warning(f"{path} looks like a duplicate of {duplicate_of['source']}")
+                    manifest.record(path, key, "ok", elapsed=elapsed, duplicate_of=duplicate_of["source"])
+                    stats["duplicates"] += 1
+                else:
+                    manifest.record(path, key, "ok", elapsed=elapsed)
+                    stats["ok"] += 1
+
+        async def store(jobs):
+            await asyncio.to_thread(save, jobs)
+
+        stages = [
+            Stage("scan", scan, counts["scan"]),
+            Stage("vision", vision, counts["vision"]),
+            Stage("generic", generic, counts["generic"]),
+            Stage("store", store, counts["store"], batch=WRITER_FLUSH_EVERY),
+        ]
+        jobs = ({"path": path, "key_file": key, "start": time.perf_counter()} for path, key in pending)
+
+        async def run():
+            try:
+                return await run_stages(jobs, stages, queue_size)
+            finally:
+                # The loop's async client can't outlive asyncio.run
+                await get_vision_client().aclose()
+
+        counters = asyncio.run(run())
+
+    logging.debug(f"Pipeline stages: {counters}")
+    return stats
@@ -0,0 +1,492 @@
+import functools
+import json
+import logging
+import math
+import time
+
+import cv2
+import numpy as np
+
+from .cache import digest, file_digest, get_cache
+from .config import ADAPTIVE_RESOLUTION, AUTO_CROP, MEMORY_BUDGET_MB, PREPROCESS_PROFILE, PREPROCESS_PROFILES
+
+# Bump whenever the preprocessing chain changes so cached outputs are ignored
+PREPROCESS_VERSION = 4
+
+# Fixed policy: receipts shorter than this get upscaled before OCR
+MIN_HEIGHT = 2000
+FIXED_CANVAS_SIZE = 2560
+
+# Adaptive policy: scale so the median glyph is about this tall, within limits
+TARGET_CHAR_HEIGHT = 30
+SCALE_LIMITS = (0.4, 4.0)
+CANVAS_LIMITS = (960, 3840)
+# Glyph statistics are gathered on a copy whose longest side is at most this
+ESTIMATE_MAX_SIDE = 1200
+
+# Document detection runs on a copy whose longest side is this many pixels
+DETECT_MAX_SIDE = 500
+# Ignore candidates smaller than this share of the frame (noise) and skip
+# cropping when the receipt already fills nearly all of it
+MIN_DOC_AREA = 0.15
+MAX_DOC_AREA = 0.92
+
+# Grayscale decode flags by size reduction (JPEG scales in the DCT, so a
+# reduced decode never materializes the full frame)
+DECODE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+# Same reductions in color, for GUI thumbnails
+PREVIEW_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+# Full-size uint8 buffers the stage chain holds at OCR resolution
+# (resized, gray, denoised, dilated background, normalized, clahe)
+WORKING_COPIES = 6
+# Never degrade below this scale, even when the budget says so
+MIN_BUDGET_SCALE = 0.25
+
+
+def order_corners(pts: np.ndarray) -> np.ndarray:
+    """Orders 4 points as top-left, top-right, bottom-right, bottom-left."""
+    pts = pts.reshape(4, 2).astype(np.float32)
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.array([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]], dtype=np.float32)
+
+
+def find_document(image: np.ndarray) -> np.ndarray | None:
+    """
+    Locates the receipt in a photo and returns its 4 corners in full-resolution
+    coordinates, or None when no plausible paper region stands out.
+    Works on a small copy: receipts are the largest bright blob in the frame.
+    """
+    h, w = image.shape[:2]
+    ratio = DETECT_MAX_SIDE / max(h, w)
+    small = cv2.resize(image, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_AREA) if ratio < 1 else image
+    ratio = min(ratio, 1.0)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    small = cv2.GaussianBlur(small, (5, 5), 0)
+    _, mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Close the gaps printed text leaves in the paper blob
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((9, 9), np.uint8))
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    doc = max(contours, key=cv2.contourArea)
+
+    frame_area = small.shape[0] * small.shape[1]
+    area = cv2.contourArea(doc)
+    if not (MIN_DOC_AREA * frame_area <= area <= MAX_DOC_AREA * frame_area):
+        return None
+
+    # Paper running off two or more sides means the receipt fills the frame
+    # and darker areas are shadows on it, not background: cropping would cut text
+    x, y, bw, bh = cv2.boundingRect(doc)
+    sh, sw = small.shape[:2]
+    touching = (x <= 2) + (y <= 2) + (x + bw >= sw - 2) + (y + bh >= sh - 2)
+    if touching >= 2:
+        return None
+
+    approx = cv2.approxPolyDP(doc, 0.02 * cv2.arcLength(doc, True), True)
+    if len(approx) == 4 and cv2.isContourConvex(approx):
+        quad = approx.reshape(4, 2)
+    else:
+        # Curled or torn edges: fall back to the tightest rotated rectangle
+        quad = cv2.boxPoints(cv2.minAreaRect(doc))
+
+    # Nothing worth removing
+    if cv2.contourArea(quad.astype(np.float32)) > MAX_DOC_AREA * frame_area:
+        return None
+
+    return order_corners(quad / ratio)
+
+
+def warp_document(image: np.ndarray, corners: np.ndarray) -> np.ndarray:
+    """Perspective-corrects the quadrilateral `corners` into an upright rectangle."""
+    tl, tr, br, bl = corners
+    width = int(round(max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl))))
+    height = int(round(max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr))))
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(image, matrix, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def estimate_char_height(image: np.ndarray) -> float | None:
+    """
+    Median glyph height in pixels of `image`, or None if too few glyph-like
+    blobs are found. Cheap: connected components of an adaptive threshold on
+    a copy downscaled to ESTIMATE_MAX_SIDE.
+    """
+    h, w = image.shape[:2]
+    f = min(1.0, ESTIMATE_MAX_SIDE / max(h, w))
+    small = cv2.resize(image, None, fx=f, fy=f, interpolation=cv2.INTER_AREA) if f < 1 else image
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    ink = cv2.adaptiveThreshold(small, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 25, 15)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    hs = stats[1:, cv2.CC_STAT_HEIGHT]
+    ws = stats[1:, cv2.CC_STAT_WIDTH]
+    area = stats[1:, cv2.CC_STAT_AREA]
+
+    # Character-shaped: not specks, not rules/borders, reasonably filled
+    glyph = (hs >= 4) & (hs <= 0.1 * small.shape[0]) & (ws >= 0.15 * hs) & (ws <= 2 * hs) & (area >= 0.15 * hs * ws)
+    if glyph.sum() < 20:
+        return None
+    return float(np.median(hs[glyph])) / f
+
+
+def plan_resolution(image: np.ndarray, adaptive: bool = True) -> dict:
+    """
+    Picks the upscale factor and EasyOCR canvas size for a (cropped) receipt.
+    Adaptive: smallest scale that brings glyphs to TARGET_CHAR_HEIGHT and a
+    canvas that fits the scaled page, so nothing is inflated or squashed.
+    Falls back to the fixed policy when glyphs can't be measured.
+    """
+    h, w = image.shape[:2]
+    char_h = estimate_char_height(image) if adaptive else None
+
+    if char_h is None:
+        scale = MIN_HEIGHT / h if h < MIN_HEIGHT else 1.0
+        return {"policy": "fixed", "char_height": None, "scale": round(scale, 4), "canvas_size": FIXED_CANVAS_SIZE}
+
+    scale = float(np.clip(TARGET_CHAR_HEIGHT / char_h, *SCALE_LIMITS))
+    long_side = max(h, w) * scale
+    canvas = int(np.clip(np.ceil(long_side / 32) * 32, *CANVAS_LIMITS))
+    return {"policy": "adaptive", "char_height": round(char_h, 1), "scale": round(scale, 4), "canvas_size": canvas}
+
+
+def image_size(path: str) -> tuple[int, int] | None:
+    """(width, height) from the file header without decoding pixels, or None if unknown."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(path) as im:
+            return im.size
+    except OSError:
+        return None
+
+
+def peak_bytes(shape: tuple[int, ...], scale: float) -> int:
+    """Rough peak memory of preprocessing a decoded gray image of `shape` at `scale`."""
+    h, w = shape[:2]
+    # Decoded frame and its cropped copy, plus the working set at OCR size
+    return int(2 * h * w + WORKING_COPIES * h * w * scale * scale)
+
+
+def plan_decode(path: str, adaptive: bool = True, memory_budget: int = MEMORY_BUDGET_MB << 20) -> tuple[int, np.ndarray | None]:
+    """
+    Picks how much to shrink `path` while decoding (1, 2, 4 or 8).
+    - Adaptive: glyphs are measured on a cheap reduced probe and the image is
+      decoded as small as possible while glyphs stay at TARGET_CHAR_HEIGHT,
+      i.e. never smaller than what plan_resolution would scale to anyway.
+    - Always: the decoded frame (plus its cropped copy) takes at most half
+      of `memory_budget`.
+    Returns the factor and the probe when it was decoded at that factor.
+    """
+    size = image_size(path)
+    if size is None:
+        return 1, None
+    w, h = size
+
+    factor = next((r for r in DECODE_FLAGS if 2 * w * h / (r * r) <= memory_budget / 2), 8)
+    probe = None
+    if adaptive:
+        # Largest reduction that still leaves enough pixels for estimate_char_height
+        probe_r = max((r for r in DECODE_FLAGS if max(w, h) / r >= ESTIMATE_MAX_SIDE), default=1)
+        if probe_r > 1:
+            probe = cv2.imread(path, DECODE_FLAGS[probe_r])
+            char_h = estimate_char_height(probe) if probe is not None else None
+            if char_h is not None:
+                fit = max((r for r in DECODE_FLAGS if char_h * probe_r / r >= TARGET_CHAR_HEIGHT), default=1)
+                factor = max(factor, fit)
+            if factor != probe_r:
+                probe = None
+    return factor, probe
+
+
+def fit_memory_budget(plan: dict, shape: tuple[int, ...], memory_budget: int) -> dict:
+    """
+    Lowers the plan's scale (and canvas) until peak_bytes fits `memory_budget`.
+    Degraded plans are flagged with "budget_limited".
+    """
+    if peak_bytes(shape, plan["scale"]) <= memory_budget:
+        return plan
+
+    h, w = shape[:2]
+    room = max(memory_budget - 2 * h * w, 0)
+    scale = max(math.sqrt(room / (WORKING_COPIES * h * w)), MIN_BUDGET_SCALE)
+    canvas = int(np.clip(np.ceil(max(h, w) * scale / 32) * 32, *CANVAS_LIMITS))
+    logging.warning(
+        f"Memory budget {memory_budget >> 20} MB: OCR scale lowered from {plan['scale']} to {scale:.3f}"
+    )
+    return {**plan, "scale": round(scale, 4), "canvas_size": min(canvas, plan["canvas_size"]), "budget_limited": True}
+
+
+def stage(fn):
+    """
+    Turns a ReceiptImage method into a lazily computed, memoized stage.
+    Its own run time (excluding upstream stages it pulled) lands in `timings`.
+    """
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def compute(self):
+        outer = self._nested
+        self._nested = 0.0
+        start = time.perf_counter()
+        value = fn(self)
+        elapsed = time.perf_counter() - start
+        self.timings[name] = elapsed - self._nested
+        self._nested = outer + elapsed
+        return value
+
+    return functools.cached_property(compute)
+
+
+class ReceiptImage:
+    """
+    Preprocessing modeled as a small stage graph:
+
+        decoded -> cropped -> resized -> gray -> denoised -> normalized -> clahe -> binarized
+
+    Every stage is computed on first access and memoized, so consumers pull
+    only the representation they need and nothing downstream of it runs.
+    The "fast" and "none" profiles convert (and denoise) at source resolution
+    and upscale afterwards, so for them `gray`/`denoised` come before `resized`
+    unless the plan shrinks the image.
+    With `crop` on, the receipt is cut out of the photo (and perspective
+    corrected) before any of the expensive stages see it. `plan` holds the
+    resolution choice (scale + OCR canvas size) for the cropped receipt.
+
+    Files are decoded once, in grayscale and at reduced size when the glyphs
+    or `memory_budget` (bytes) allow; `preview()` decodes its own small color
+    thumbnail.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        image: np.ndarray | None = None,
+        profile: str = PREPROCESS_PROFILE,
+        crop: bool = AUTO_CROP,
+        adaptive: bool = ADAPTIVE_RESOLUTION,
+        memory_budget: int = MEMORY_BUDGET_MB << 20,
+    ):
+        if profile not in PREPROCESS_PROFILES:
+            raise ValueError(f"Unknown preprocessing profile: {profile}. Use: {', '.join(PREPROCESS_PROFILES)}")
+        if path is None and image is None:
+            raise ValueError("ReceiptImage needs a path or an image")
+
+        self.path = path
+        self.profile = profile
+        self.crop = crop
+        self.adaptive = adaptive
+        self.memory_budget = memory_budget
+        self.decode_reduction = 1
+        self.timings: dict[str, float] = {}
+        self._nested = 0.0
+        if image is not None:
+            self.__dict__["decoded"] = image
+
+    @property
+    def ocr_image(self) -> np.ndarray:
+        """Representation fed to EasyOCR, the Vision upload and the header crop."""
+        return self.clahe
+
+    @property
+    def scale(self) -> float:
+        return self.plan["scale"]
+
+    @property
+    def canvas_size(self) -> int:
+        return self.plan["canvas_size"]
+
+    def preview(self, width: int) -> np.ndarray:
+        """
+        RGB thumbnail, at most `width` pixels wide. Files are decoded again
+        in color, at the largest reduction still at least `width` wide, so
+        the thumbnail is never upscaled from the (possibly 1/8) OCR decode.
+        """
+        img = None
+        if self.path is not None:
+            size = image_size(self.path)
+            r = max((r for r in PREVIEW_FLAGS if size and size[0] / r >= width), default=1)
+            img = cv2.imread(self.path, PREVIEW_FLAGS[r])
+        if img is None:
+            img = self.decoded
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB if img.ndim == 2 else cv2.COLOR_BGR2RGB)
+        h, w = img.shape[:2]
+        if w <= width:
+            return img
+        return cv2.resize(img, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+
+    # ---------- stages ----------
+
+    @stage
+    def decoded(self) -> np.ndarray:
+        # Everything downstream is grayscale, so color is never decoded
+        self.decode_reduction, img = plan_decode(self.path, self.adaptive, self.memory_budget)
+        if img is None:
+            img = cv2.imread(self.path, DECODE_FLAGS[self.decode_reduction])
+        if img is None:
+            raise ValueError("Cannot read image")
+        if self.decode_reduction > 1:
+            logging.debug(f"Decoded at 1/{self.decode_reduction}: {img.shape[1]}x{img.shape[0]}")
+        return img
+
+    @stage
+    def cropped(self) -> np.ndarray:
+        img = self.decoded
+        if not self.crop:
+            return img
+        corners = find_document(img)
+        if corners is None:
+            return img
+        out = warp_document(img, corners)
+        logging.debug(f"Cropped receipt: {img.shape[1]}x{img.shape[0]} -> {out.shape[1]}x{out.shape[0]}")
+        return out
+
+    @stage
+    def plan(self) -> dict:
+        img = self.cropped
+        plan = fit_memory_budget(plan_resolution(img, self.adaptive), img.shape, self.memory_budget)
+        return {**plan, "decode_reduction": self.decode_reduction}
+
+    @stage
+    def resized(self) -> np.ndarray:
+        if self.profile == "quality":
+            # 1. Resize (if receipt is small)
+            # Cubic upscales crisply but aliases thin glyphs when shrinking
+            src, interp = self.cropped, cv2.INTER_CUBIC if self.scale > 1.0 else cv2.INTER_AREA
+        elif self.scale < 1.0:
+            # Shrinking: do it before the per-pixel work
+            src, interp = self.cropped, cv2.INTER_AREA
+        else:
+            src, interp = self.denoised, cv2.INTER_LINEAR
+        if self.scale == 1.0:
+            return src
+        return cv2.resize(src, None, fx=self.scale, fy=self.scale, interpolation=interp)
+
+    @property
+    def _resize_first(self) -> bool:
+        return self.profile == "quality" or self.scale < 1.0
+
+    @property
+    def _denoised_at_scale(self) -> np.ndarray:
+        """Gray, denoised image at OCR resolution, whichever order produced it."""
+        return self.denoised if self._resize_first else self.resized
+
+    @stage
+    def gray(self) -> np.ndarray:
+        # 2. Grayscale
+        src = self.resized if self._resize_first else self.cropped
+        if src.ndim == 2:
+            return src
+        return cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
+
+    @stage
+    def denoised(self) -> np.ndarray:
+        # 3. Mild denoising (careful not to blur characters)
+        if self.profile == "none":
+            return self.gray
+        return cv2.fastNlMeansDenoising(
+            self.gray,
+            None,
+            h=5,  # Reduced from 10 to keep edges sharer
+            templateWindowSize=7,
+            # "fast" runs before upscaling with a ~9x cheaper search window
+            searchWindowSize=21 if self.profile == "quality" else 7,
+        )
+
+    @stage
+    def normalized(self) -> np.ndarray:
+        # 4. Shadow removal — division normalization
+        if self.profile == "none":
+            return self._denoised_at_scale
+        if self.profile == "fast":
+            # Background estimated at 1/4 resolution, then upsampled
+            full = self._denoised_at_scale
+            small = cv2.resize(full, None, fx=0.25, fy=0.25, interpolation=cv2.INTER_AREA)
+            small = cv2.dilate(small, np.ones((5, 5), np.uint8))
+            small = cv2.medianBlur(small, 13)
+            bg = cv2.resize(small, (full.shape[1], full.shape[0]), interpolation=cv2.INTER_LINEAR)
+            return cv2.divide(full, bg, scale=255)
+
+        gray = self.denoised
+        kernel = np.ones((21, 21), np.uint8)
+        dilated = cv2.dilate(gray, kernel)
+        bg = cv2.medianBlur(dilated, 51)
+        return cv2.divide(gray, bg, scale=255)
+
+    @stage
+    def clahe(self) -> np.ndarray:
+        # 5. CLAHE (moderate)
+        cache = get_cache() if self.path else None
+        key = None
+        if cache is not None:
+            try:
+                key = digest(
+                    "preprocess", PREPROCESS_VERSION, self.profile, self.crop, self.adaptive,
+                    self.memory_budget, file_digest(self.path),
+                )
+            except OSError:
+                key = None  # unreadable file, let cv2 raise the usual error
+            hit = cache.get(key) if key else None
+            if hit is not None:
+                logging.info("Preprocessing image.... (cached)")
+                self.__dict__.setdefault("plan", json.loads(hit["plan"].item()))
+                return hit["image"]
+
+        logging.info(f"Preprocessing image.... (profile={self.profile})")
+        if self.profile == "none":
+            out = self.normalized
+        else:
+            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            out = clahe.apply(self.normalized)
+
+        if key:
+            cache.put(key, image=out, plan=np.array(json.dumps(self.plan)))
+        return out
+
+    @stage
+    def binarized(self) -> np.ndarray:
+        return cv2.adaptiveThreshold(
+            self.clahe,
+            255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY,
+            15,  # Smaller window helps capture small fonts
+            25,  # Higher constant helps suppress gray noise
+        )
+
+
+def preprocess_receipt(
+    image_path: str,
+    profile: str = PREPROCESS_PROFILE,
+    timings: dict | None = None,
+    crop: bool = AUTO_CROP,
+    adaptive: bool = ADAPTIVE_RESOLUTION,
+) -> np.ndarray:
+    """
+    Loads a receipt and returns the OCR-ready image.
+    `profile` trades quality for speed (see PREPROCESS_PROFILES); when
+    `timings` is given it receives the seconds spent per stage.
+    """
+    receipt = ReceiptImage(image_path, profile=profile, crop=crop, adaptive=adaptive)
+    out = receipt.ocr_image
+    if timings is not None:
+        timings.update(receipt.timings)
+    return out
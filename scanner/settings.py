@@ -0,0 +1,47 @@
+"""
+Per-job settings.
+
+Switches like --no-cache reach the scanner as environment variables, which
+batch worker processes inherit. The OCR daemon serves jobs with different
+switches on concurrent threads of one process, so a job's own values are
+applied with job_settings() and take precedence over the environment for
+the code running inside it only:
+
+    with job_settings({CACHE_ENV: "off"}):
+        ScannerManager.process(receipt)
+"""
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Values turning a feature (cache, dedup, archive, ...) off
+OFF_VALUES = ("off", "0", "false", "none")
+
+_JOB: ContextVar[dict] = ContextVar("job_settings", default={})
+
+
+def getenv(name: str, default: str | None = None) -> str | None:
+    """os.getenv, with the current job's setting first."""
+    job = _JOB.get()
+    return job[name] if name in job else os.getenv(name, default)
+
+
+def disabled(name: str) -> bool:
+    """True when the current job turns the feature behind `name` off."""
+    value = _JOB.get().get(name)
+    return value is not None and value.lower() in OFF_VALUES
+
+
+def current() -> dict:
+    """The current job's settings, to carry them over to worker processes."""
+    return dict(_JOB.get())
+
+
+@contextmanager
+def job_settings(settings: dict | None):
+    """Applies `settings` ({env var: value}) on top of the current ones."""
+    token = _JOB.set({**_JOB.get(), **(settings or {})})
+    try:
+        yield
+    finally:
+        _JOB.reset(token)
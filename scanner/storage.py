@@ -1,37 +1,216 @@
 import csv
+import io
 import json
 import logging
 import os
+import tempfile
+import threading
+import time
+
+from .config import WRITER_FLUSH_EVERY, WRITER_FLUSH_SECONDS, WRITER_FSYNC
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends rely on O_APPEND alone
+    fcntl = None
+
+CSV_FIELDS = ["store", "item_name", "price", "total"]
+# always: fsync after every flush; close: only when the writer closes; never
+FSYNC_POLICIES = ("always", "close", "never")
+
+
+def format_rows(data: dict, ext: str) -> bytes:
+    """One receipt as the lines appended to a .jsonl or .csv output."""
+    if ext == ".jsonl":
+        return (json.dumps(data) + "\n").encode()
+
+    buf = io.StringIO(newline="")
+    writer = csv.DictWriter(buf, fieldnames=CSV_FIELDS)
+    # If no items, write at least the total
+    if not data["items"]:
+        writer.writerow({"store": data["store"], "item_name": "N/A", "price": 0.0, "total": data["total"]})
+    else:
+        for item in data["items"]:
+            writer.writerow({
+                "store": data["store"],
+                "item_name": item.get("name"),
+                "price": item.get("price"),
+                "total": data["total"]
+            })
+    return buf.getvalue().encode()
+
+
+def _csv_header() -> bytes:
+    buf = io.StringIO(newline="")
+    csv.DictWriter(buf, fieldnames=CSV_FIELDS).writeheader()
+    return buf.getvalue().encode()
+
+
+class ResultWriter:
+    """
+    Long-lived appender of receipts to a .jsonl or .csv file.
+
+    - write() only serializes into a buffer; the buffer goes out in a single
+      os.write once `flush_every` receipts or `flush_seconds` have piled up
+      (checked on write), on flush() and on close().
+    - Every flush holds an exclusive lock on the file (POSIX), so writers
+      in several processes can share one output: records never interleave
+      and a CSV header is written once, by whoever finds the file empty.
+    - `fsync` is one of FSYNC_POLICIES.
+    - With `max_bytes`, a flush that would grow the file past it first moves
+      the file to the next free `<name>.<n><ext>` and starts a new one.
+      Records are never split across files.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_every: int = WRITER_FLUSH_EVERY,
+        flush_seconds: float = WRITER_FLUSH_SECONDS,
+        fsync: str = WRITER_FSYNC,
+        max_bytes: int = 0,
+    ):
+        self.ext = os.path.splitext(path)[1].lower()
+        if self.ext not in (".jsonl", ".csv"):
+            raise ValueError(f"ResultWriter appends .jsonl or .csv, not {self.ext or path}")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync!r}, expected one of {', '.join(FSYNC_POLICIES)}")
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.rotated: list[str] = []
+
+        self._lock = threading.Lock()
+        self._buffer: list[bytes] = []
+        self._since = time.monotonic()
+        self._fd: int | None = None
+
+    def write(self, data: dict):
+        record = format_rows(data, self.ext)
+        with self._lock:
+            if not self._buffer:
+                self._since = time.monotonic()
+            self._buffer.append(record)
+            if len(self._buffer) >= self.flush_every or time.monotonic() - self._since >= self.flush_seconds:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._fd is not None:
+                if self.fsync != "never":
+                    os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _acquire(self):
+        """
+        Locks the output, reopening it first if another writer rotated it
+        away from our descriptor (the lock would guard the old file).
+        """
+        if self._fd is None:
+            self._open()
+        while True:
+            if fcntl is None:
+                return
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self._fd).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._open()
+
+    def _rotate(self):
+        root, ext = os.path.splitext(self.path)
+        n = 1
+        while os.path.exists(f"{root}.{n}{ext}"):
+            n += 1
+        target = f"{root}.{n}{ext}"
+        os.replace(self.path, target)
+        self.rotated.append(target)
+        logging.info(f"Rotated {self.path} to {target}")
+        # Still holding the old file's lock, so waiting writers see the rename
+        # only after we have the new file locked
+        old = self._fd
+        self._open()
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        if self.fsync != "never":
+            os.fsync(old)
+        os.close(old)
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        payload = b"".join(self._buffer)
+        self._acquire()
+        try:
+            size = os.fstat(self._fd).st_size
+            if self.max_bytes and size and size + len(payload) > self.max_bytes:
+                self._rotate()
+                # Another writer may have started the new file before we locked it
+                size = os.fstat(self._fd).st_size
+            if self.ext == ".csv" and size == 0:
+                payload = _csv_header() + payload
+            view = memoryview(payload)
+            while view:
+                view = view[os.write(self._fd, view):]
+            if self.fsync == "always":
+                os.fsync(self._fd)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._buffer.clear()
+        self._since = time.monotonic()
+
+
+def open_writer(path: str, **options):
+    """
+    Result writer for `path` by extension: a ResultWriter for .jsonl/.csv,
+    the SQLite ReceiptStore for .sqlite. Both take ResultWriter's options.
+    """
+    if os.path.splitext(path)[1].lower() == ".sqlite":
+        from .database import ReceiptStore
+        return ReceiptStore(path, **options)
+    return ResultWriter(path, **options)
 
 
 def save_to_file(data: dict, path: str):
-    """Save receipt data to JSON, JSONL, or CSV."""
+    """Save receipt data to JSON, JSONL, CSV or SQLite. Use open_writer() for many receipts."""
     ext = os.path.splitext(path)[1].lower()
 
     if ext == ".json":
-        with open(path, "w") as f:
-            json.dump(data, f, indent=4)
-    elif ext == ".jsonl":
-        with open(path, "a") as f:
-            f.write(json.dumps(data) + "\n")
-    elif ext == ".csv":
-        file_exists = os.path.isfile(path)
-        with open(path, "a", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=["store", "item_name", "price", "total"])
-            if not file_exists:
-                writer.writeheader()
-
-            # If no items, write at least the total
-            if not data["items"]:
-                 writer.writerow({"store": data["store"], "item_name": "N/A", "price": 0.0, "total": data["total"]})
-            else:
-                for item in data["items"]:
-                    writer.writerow({
-                        "store": data["store"],
-                        "item_name": item.get("name"),
-                        "price": item.get("price"),
-                        "total": data["total"]
-                    })
+        # Replaced atomically: a crash leaves the old file or the new one
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=4)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    elif ext in (".jsonl", ".csv", ".sqlite"):
+        with open_writer(path, flush_every=1) as writer:
+            writer.write(data)
     logging.info(f"Result saved to {path}")
 
 
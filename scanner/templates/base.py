@@ -1,6 +1,12 @@
 from abc import ABC, abstractmethod
 
 class BaseTemplate(ABC):
+    """
+    A store's receipt parser. Subclasses live in scanner/templates (or a
+    INVOICE_SCANNER_TEMPLATES folder) and set `store_name` and `keywords` as
+    literal class attributes, so the registry can index them unimported.
+    """
+
     @property
     @abstractmethod
     def store_name(self) -> str:
@@ -0,0 +1,218 @@
+"""
+Template registry: finds store templates in plugin folders without
+importing them, and matches a header against every template's keywords in
+one pass of an Aho-Corasick automaton.
+
+A plugin is any .py file in the folder defining a BaseTemplate subclass
+whose `store_name` and `keywords` are literal class attributes:
+
+    class PublixTemplate(BaseTemplate):
+        store_name = "Publix"
+        keywords = ["publix", "where shopping is a pleasure"]
+
+Those two attributes are read from the source (ast), so a store's module is
+only imported the first time one of its receipts is matched. Plugins in
+extra folders (INVOICE_SCANNER_TEMPLATES) must import BaseTemplate
+absolutely: from scanner.templates.base import BaseTemplate.
+"""
+import ast
+import importlib
+import importlib.util
+import logging
+import os
+import threading
+from collections import deque
+
+from .base import BaseTemplate
+
+# os.pathsep-separated folders with extra template plugins
+TEMPLATES_ENV = "INVOICE_SCANNER_TEMPLATES"
+
+BUILTIN_DIR = os.path.dirname(os.path.abspath(__file__))
+NOT_PLUGINS = {"__init__.py", "base.py", "registry.py"}
+
+# Spellings OCR mixes up, folded onto one symbol in keywords and headers
+# alike. Multi-letter ones first: "rn" is read for "m", "vv" for "w"
+OCR_CONFUSIONS = (("rn", "m"), ("vv", "w"))
+OCR_FOLD = str.maketrans({
+    "0": "o",
+    "1": "l", "i": "l", "|": "l", "!": "l",
+    "5": "s", "$": "s",
+    "8": "b", "6": "b",
+    "2": "z",
+    "9": "g", "q": "g",
+})
+
+
+def fold(text: str) -> str:
+    """Lowercases, drops spaces/punctuation and folds OCR look-alikes ("Pub1ix" -> "publlx")."""
+    text = text.lower()
+    for seen, meant in OCR_CONFUSIONS:
+        text = text.replace(seen, meant)
+    text = text.translate(OCR_FOLD)
+    return "".join(c for c in text if c.isalnum())
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over folded keywords. find() reports every
+    (position, payload) whose keyword occurs in a folded text, in a single
+    scan whatever the number of keywords.
+    """
+
+    def __init__(self, keywords: dict[str, object] | None = None):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[tuple[int, object]]] = [[]]
+        for keyword, payload in (keywords or {}).items():
+            self.add(keyword, payload)
+        self._build()
+
+    def add(self, keyword: str, payload):
+        keyword = fold(keyword)
+        if not keyword:
+            return
+        node = 0
+        for ch in keyword:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(keyword), payload))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> list[tuple[int, object]]:
+        """(start offset in the folded text, payload) of every keyword hit."""
+        text = fold(text)
+        hits, node = [], 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, payload in self._out[node]:
+                hits.append((i - length + 1, payload))
+        return hits
+
+
+def read_plugin(path: str) -> list[tuple[str, str, list[str]]]:
+    """(class name, store_name, keywords) of the templates declared in a plugin file."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    found = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        bases = {b.id if isinstance(b, ast.Name) else getattr(b, "attr", None) for b in node.bases}
+        if "BaseTemplate" not in bases:
+            continue
+        attrs = {}
+        for stmt in node.body:
+            if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+                try:
+                    attrs[stmt.targets[0].id] = ast.literal_eval(stmt.value)
+                except ValueError:
+                    pass
+        if isinstance(attrs.get("store_name"), str) and attrs.get("keywords"):
+            found.append((node.name, attrs["store_name"], list(attrs["keywords"])))
+        else:
+            logging.warning(f"{path}: {node.name} needs literal store_name and keywords, skipped")
+    return found
+
+
+class TemplateRegistry:
+    """
+    Store templates from the built-in folder plus `extra_dirs`, matched by
+    keyword and imported on first use. Later folders override a store name
+    defined in earlier ones.
+    """
+
+    def __init__(self, extra_dirs: list[str] | None = None):
+        if extra_dirs is None:
+            extra_dirs = [d for d in os.getenv(TEMPLATES_ENV, "").split(os.pathsep) if d]
+        self.dirs = [BUILTIN_DIR, *extra_dirs]
+        self._lock = threading.Lock()
+        self._plugins: dict[str, tuple[str, str]] | None = None
+        self._automaton: KeywordAutomaton | None = None
+        self._loaded: dict[str, BaseTemplate] = {}
+
+    def _scan(self):
+        plugins, keywords = {}, {}
+        for folder in self.dirs:
+            if not os.path.isdir(folder):
+                logging.warning(f"Template folder not found: {folder}")
+                continue
+            for name in sorted(os.listdir(folder)):
+                if not name.endswith(".py") or name in NOT_PLUGINS:
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    declared = read_plugin(path)
+                except (OSError, SyntaxError) as e:
+                    logging.warning(f"Skipping template plugin {path}: {e}")
+                    continue
+                for class_name, store, words in declared:
+                    plugins[store] = (path, class_name)
+                    for word in words:
+                        keywords[word] = store
+        self._plugins = plugins
+        self._automaton = KeywordAutomaton(keywords)
+
+    def _ready(self):
+        with self._lock:
+            if self._plugins is None:
+                self._scan()
+
+    def store_names(self) -> list[str]:
+        self._ready()
+        return list(self._plugins)
+
+    def get(self, store_name: str | None) -> BaseTemplate | None:
+        """The template for `store_name`, importing its module if needed."""
+        self._ready()
+        if store_name not in self._plugins:
+            return None
+        with self._lock:
+            template = self._loaded.get(store_name)
+            if template is None:
+                path, class_name = self._plugins[store_name]
+                template = self._loaded[store_name] = getattr(_import(path), class_name)()
+        return template
+
+    def match(self, header_ocr: list[dict]) -> BaseTemplate | None:
+        """
+        Template whose keyword appears earliest in the header text (OCR
+        look-alikes tolerated), or None.
+        """
+        self._ready()
+        text = " ".join(x.get("text") or "" for x in header_ocr)
+        hits = self._automaton.find(text)
+        if not hits:
+            return None
+        _, store = min(hits, key=lambda hit: hit[0])
+        return self.get(store)
+
+
+def _import(path: str):
+    if os.path.dirname(path) == BUILTIN_DIR:
+        return importlib.import_module(f"{__package__}.{os.path.basename(path)[:-3]}")
+    name = f"invoicescanner_template_{abs(hash(path))}"
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -2,10 +2,21 @@
 import regex as re
 from scanner.config import NON_ITEM_WORDS
 
+# Compiled once: these helpers run several times per OCR line, and the
+# module-level re.sub/re.search cache lookup costs more than the match
+SPACES_RX = re.compile(r"\s+")
+OCR_O_RX = re.compile(r"(?<=\d\.)[oO]")
+OCR_G_RX = re.compile(r"(?<=[\d\.])[gq]", re.I)
+OCR_S_RX = re.compile(r"(?<=\d)[sS](?=\b|\d)")
+SPLIT_PRICE_RX = re.compile(r"(\d)\s*\.\s*(\d{2})\b")
+PRICE_VALUE_RX = re.compile(r"-?\d+\.\d{2}\b")
+NOISE_RX = re.compile(r"\d\)")
+DIGITS_RX = re.compile(r"\d+")
+
 
 def norm(s: str) -> str:
     s = (s or "").strip().replace(",", ".")
-    s = re.sub(r"\s+", " ", s) # replace multiple spaces with one
+    s = SPACES_RX.sub(" ", s) # replace multiple spaces with one
     return s
 
 # normalize numeric data
@@ -14,36 +25,41 @@ def price_from(s: str):
 
     # Basic normalization
     s = s.replace(",", ".")
-    s = re.sub(r"\s+", " ", s)
+    s = SPACES_RX.sub(" ", s)
 
     # OCR fixes: g/q -> 9, O/o -> 0 (only in numeric context)
     # Order matters!!
-    s = re.sub(r"(?<=\d\.)[oO]", "0", s)                   # 12.Og -> 12.0g
-    s = re.sub(r"(?<=[\d\.])[gq]", "9", s, flags=re.I)     # 12.0g -> 12.09
-    s = re.sub(r"(?<=\d)[sS](?=\b|\d)", "5", s)            # 12.0S -> 12.05
+    s = OCR_O_RX.sub("0", s)          # 12.Og -> 12.0g
+    s = OCR_G_RX.sub("9", s)          # 12.0g -> 12.09
+    s = OCR_S_RX.sub("5", s)          # 12.0S -> 12.05
 
     # Merge "16 . 76" -> "16.76"
-    s = re.sub(r"(\d)\s*\.\s*(\d{2})\b", r"\1.\2", s)
+    s = SPLIT_PRICE_RX.sub(r"\1.\2", s)
 
-    m = re.search(r"-?\d+\.\d{2}\b", s)
+    m = PRICE_VALUE_RX.search(s)
     return float(m.group()) if m else None
 
 
 # find all valid prices and return them in float
 def prices_in(s: str) -> list[float]:
     s = norm(s)
-    s = re.sub(r"(\d)\s*\.\s*(\d{2})\b", r"\1.\2", s)
+    s = SPLIT_PRICE_RX.sub(r"\1.\2", s)
     out = []
-    for m in re.finditer(r"-?\d+\.\d{2}\b", s):
+    for m in PRICE_VALUE_RX.finditer(s):
         out.append(float(m.group()))
     return out
 
 def is_noise_token(s: str) -> bool:
     low = (s or "").strip().lower()
-    return (low in {"t", "f", "t f", "tf", "{f", "iix"}) or (re.fullmatch(r"\d\)", low) is not None)
+    return (low in {"t", "f", "t f", "tf", "{f", "iix"}) or (NOISE_RX.fullmatch(low) is not None)
 
 # Item names are mostly CAPS, but OCR may leak lowercase.
 def looks_like_item_name(s: str) -> bool:
+    return has_item_name_shape(s) and price_from(s) is None
+
+
+# looks_like_item_name minus the price check, for callers that already parsed the price
+def has_item_name_shape(s: str) -> bool:
     s = (s or "").strip()
     if not s or len(s) <= 2:
         return False
@@ -51,9 +67,7 @@ def looks_like_item_name(s: str) -> bool:
         return False
     if s.upper() in NON_ITEM_WORDS:
         return False
-    if re.fullmatch(r"\d+", s):
-        return False
-    if price_from(s) is not None:
+    if DIGITS_RX.fullmatch(s):
         return False
 
     letters = [c for c in s if c.isalpha()]
@@ -167,3 +167,957 @@ def test_voided_item():
     result = parse_receipt(raw_ocr)
     assert result["items"][0]["price"] == -3.00
     assert result["items"][0]["voided"] is True
+
+
+def test_batch_collect_images(tmp_path):
+    from scanner.batch import collect_images
+
+    (tmp_path / "a.jpg").write_bytes(b"x")
+    (tmp_path / "notes.txt").write_text("x")
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    (sub / "b.PNG").write_bytes(b"x")
+
+    found = collect_images([str(tmp_path), str(tmp_path / "*.jpg")])
+    assert [p.rsplit("/", 1)[-1] for p in found] == ["a.jpg", "b.PNG"]
+
+
+def test_batch_manifest_resume(tmp_path):
+    from scanner.batch import Manifest
+
+    path = str(tmp_path / "run.manifest.jsonl")
+    m = Manifest(path)
+    m.record("/r/1.jpg", "10:1", "ok")
+    m.record("/r/2.jpg", "10:2", "error", error="boom")
+    with open(path, "a") as f:
+        f.write('{"path": "/r/3.jpg", "ke')  # torn line from a crash
+
+    resumed = Manifest(path)
+    assert resumed.is_done("/r/1.jpg", "10:1")
+    assert not resumed.is_done("/r/1.jpg", "11:1")  # file changed since
+    assert not resumed.is_done("/r/2.jpg", "10:2")
+
+    resumed.record("/r/3.jpg", "10:3", "ok")
+    assert Manifest(path).is_done("/r/3.jpg", "10:3")
+
+
+def test_layout_reconstruct_lines():
+    from scanner.layout import group_rows, reconstruct_lines, token_boxes
+
+    # Shuffled tokens, as the detector may emit them
+    raw = [
+        {"text": "3.49", "confidence": 0.9, "box": [400, 102, 460, 120]},
+        {"text": "APPLE", "confidence": 0.9, "box": [10, 60, 80, 80]},
+        {"text": "MILK", "confidence": 0.8, "box": [10, 100, 70, 121]},
+        {"text": "JUICE", "confidence": 0.7, "box": [90, 61, 160, 79]},
+        {"text": "4", "confidence": 0.9, "box": [400, 60, 415, 80]},
+        {"text": "50", "confidence": 0.9, "box": [420, 61, 445, 79]},
+        {"text": "1,25 lb @ 0,79", "confidence": 0.9, "box": [10, 140, 200, 160]},
+        {"text": "0,99", "confidence": 0.9, "box": [400, 141, 460, 159]},
+    ]
+    assert token_boxes(raw).shape == (8, 4)
+    assert list(group_rows(token_boxes(raw))) == [1, 0, 1, 0, 0, 0, 2, 2]
+
+    lines = [x["text"] for x in reconstruct_lines(raw)]
+    assert lines == ["APPLE JUICE", "4.50", "MILK", "3.49", "1.25 lb @ 0.79 0.99"]
+
+    # No geometry -> token order is kept
+    assert reconstruct_lines([{"text": "MILK"}]) == [{"text": "MILK"}]
+
+
+def test_parse_receipt_with_boxes():
+    raw = [
+        {"text": "Publix", "confidence": 0.9, "box": [150, 5, 300, 40]},
+        {"text": "4.50", "confidence": 0.99, "box": [400, 101, 460, 119]},
+        {"text": "APPLE JUICE", "confidence": 0.9, "box": [10, 100, 160, 120]},
+        {"text": "TOTAL", "confidence": 0.9, "box": [10, 200, 90, 220]},
+        {"text": "4.50", "confidence": 0.99, "box": [400, 200, 460, 220]},
+    ]
+    result = parse_receipt(raw)
+    assert result["items"] == [{"name": "APPLE JUICE", "price": 4.50}]
+    assert result["total"] == 4.50
+
+
+def test_ocr_cache_roundtrip_and_lru(tmp_path):
+    import os
+    import numpy as np
+    from scanner.cache import OcrCache, digest
+    from scanner.layout import pack_tokens, unpack_tokens
+
+    cache = OcrCache(str(tmp_path), max_bytes=4_000)
+    img = np.zeros((20, 30), dtype=np.uint8)
+    key = digest("readtext", img, ("en",), {"canvas_size": 2560})
+    assert key != digest("readtext", img, ("en",), {"canvas_size": 1280})
+
+    assert cache.get(key) is None
+    tokens = [{"text": "MILK", "confidence": 0.9, "box": [1, 2, 3, 4]}]
+    cache.put(key, **pack_tokens(tokens))
+    out = unpack_tokens(cache.get(key))
+    assert out[0]["text"] == "MILK" and list(out[0]["box"]) == [1, 2, 3, 4]
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    # Fill past the budget: the oldest entries go first, the fresh one stays
+    for i in range(10):
+        k = digest("blob", i)
+        cache.put(k, data=np.zeros(500, dtype=np.uint8))
+        path = cache._path(k)
+        os.utime(path, (i, i))
+    last = digest("blob", 99)
+    cache.put(last, data=np.zeros(500, dtype=np.uint8))
+    assert cache.evictions > 0
+    assert cache.get(last) is not None
+    assert cache.get(digest("blob", 0)) is None
+
+    # Truncated or garbled entries are misses, and removed
+    for k, cut in ((last, 100), (key, 0)):
+        with open(cache._path(k), "r+b") as f:
+            f.truncate(cut)
+    with open(cache._path(digest("blob", 9)), "wb") as f:
+        f.write(b"PK\x03\x04 not a zip")
+    misses = cache.misses
+    for k in (last, key, digest("blob", 9)):
+        assert cache.get(k) is None and not os.path.exists(cache._path(k))
+    assert cache.misses == misses + 3
+
+
+def test_receipt_image_stages_are_lazy():
+    import numpy as np
+    from scanner.preprocess import ReceiptImage
+
+    img = np.full((500, 200, 3), 230, dtype=np.uint8)
+    img[100:110, 20:180] = 20  # a "text" bar
+
+    receipt = ReceiptImage(image=img, profile="fast")
+    out = receipt.ocr_image
+    assert out.shape == (2000, 800)  # upscaled to the minimum height
+    assert "binarized" not in receipt.timings  # never pulled -> never computed
+    assert {"gray", "denoised", "resized", "normalized", "clahe"} <= set(receipt.timings)
+    assert receipt.ocr_image is out  # memoized
+
+    assert ReceiptImage(image=img, profile="none").ocr_image.ndim == 2
+
+
+def test_find_document_crops_countertop():
+    import cv2
+    import numpy as np
+    from scanner.preprocess import ReceiptImage, find_document
+
+    photo = np.full((1200, 900, 3), 60, dtype=np.uint8)
+    paper = np.array([[300, 150], [620, 180], [580, 1050], [260, 1020]], dtype=np.int32)
+    cv2.fillPoly(photo, [paper], (235, 235, 235))
+
+    corners = find_document(photo)
+    assert corners is not None
+    assert np.abs(corners - paper).max() < 10
+
+    receipt = ReceiptImage(image=photo, profile="none")
+    h, w = receipt.cropped.shape[:2]
+    assert h * w < 0.35 * 1200 * 900
+
+    # Receipt filling the frame: leave it alone
+    assert find_document(np.full((800, 400, 3), 235, dtype=np.uint8)) is None
+
+
+def test_plan_resolution_from_glyph_height():
+    import cv2
+    import numpy as np
+    from scanner.preprocess import TARGET_CHAR_HEIGHT, estimate_char_height, plan_resolution
+
+    # Synthetic receipt: rows of 20px tall "characters"
+    page = np.full((1200, 600), 240, dtype=np.uint8)
+    for y in range(40, 1160, 50):
+        for x in range(30, 560, 18):
+            cv2.rectangle(page, (x, y), (x + 10, y + 19), 20, -1)
+
+    assert abs(estimate_char_height(page) - 20) <= 1
+    plan = plan_resolution(page)
+    assert plan["policy"] == "adaptive"
+    assert abs(plan["scale"] - TARGET_CHAR_HEIGHT / 20) < 0.1
+    assert plan["canvas_size"] % 32 == 0 and plan["canvas_size"] >= 1200 * plan["scale"]
+
+    # Nothing measurable -> legacy rule
+    blank = np.full((1000, 500), 255, dtype=np.uint8)
+    assert plan_resolution(blank) == {"policy": "fixed", "char_height": None, "scale": 2.0, "canvas_size": 2560}
+
+
+def test_stitch_strips_dedupes_overlap():
+    from scanner.layout import plan_strips, stitch_strips
+
+    assert plan_strips(1000, 1600, 200) == [(0, 1000)]
+    assert plan_strips(3000, 1600, 200) == [(0, 1600), (1400, 3000)]
+
+    top = [
+        {"text": "MILK", "confidence": 0.9, "box": [10, 100, 80, 120]},
+        {"text": "EGGS", "confidence": 0.6, "box": [10, 1450, 80, 1470]},  # in overlap band
+        {"text": "BRE", "confidence": 0.5, "box": [10, 1585, 60, 1600]},  # cut by the strip edge
+    ]
+    bottom = [
+        {"text": "EGGS", "confidence": 0.8, "box": [11, 1451, 81, 1471]},
+        {"text": "BREAD", "confidence": 0.9, "box": [10, 1585, 90, 1605]},
+        {"text": "TOTAL", "confidence": 0.9, "box": [10, 2500, 90, 2520]},
+    ]
+    out = stitch_strips([(0, 1600, top), (1400, 3000, bottom)])
+    assert [(t["text"], t["confidence"]) for t in out] == [
+        ("MILK", 0.9), ("EGGS", 0.8), ("BREAD", 0.9), ("TOTAL", 0.9)
+    ]
+
+
+def test_daemon_roundtrip(tmp_path):
+    import threading
+    from scanner import daemon
+
+    path = str(tmp_path / "ocr.sock")
+    # Nobody listening -> caller falls back to in-process OCR
+    assert daemon.request({"op": "ping"}, path) is None
+
+    server = daemon.ScanServer(path, daemon.ScanHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        assert daemon.request({"op": "ping"}, path) == {"ok": True}
+        reply = daemon.request({"op": "scan", "path": str(tmp_path / "missing.jpg")}, path)
+        assert reply["ok"] is False and "Cannot read image" in reply["error"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_daemon_applies_job_settings_per_request(tmp_path, monkeypatch):
+    import threading
+    from scanner import archive, cache, daemon, dedup, engines, manager, ocr, preprocess
+
+    monkeypatch.setattr(cache, "_CACHE", cache.OcrCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(cache, "_CACHE_READY", True)
+    monkeypatch.setattr(dedup, "_INDEX", dedup.DuplicateIndex(str(tmp_path / "dups.jsonl")))
+    monkeypatch.setattr(dedup, "_INDEX_READY", True)
+    monkeypatch.setattr(archive, "_ARCHIVE", archive.OcrArchive(str(tmp_path / "ocr.bin")))
+    monkeypatch.setattr(archive, "_ARCHIVE_READY", True)
+
+    # Both jobs are in flight at once, on the daemon's connection threads
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fake_process(receipt, **kwargs):
+        barrier.wait()
+        return {
+            "cache": cache.get_cache() is not None,
+            "dedup": dedup.get_duplicate_index() is not None,
+            "archive": archive.get_archive() is not None,
+            "engine": ocr.reader_pool().engine,
+        }
+
+    monkeypatch.setattr(preprocess, "ReceiptImage", lambda path, **options: path)
+    monkeypatch.setattr(manager.ScannerManager, "process", staticmethod(fake_process))
+
+    path = str(tmp_path / "ocr.sock")
+    server = daemon.ScanServer(path, daemon.ScanHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("INVOICE_SCANNER_SOCKET", path)
+    try:
+        results = {}
+
+        def scan(name, settings):
+            results[name] = daemon.scan_via_daemon(name, settings=settings)
+
+        jobs = [
+            threading.Thread(target=scan, args=("/plain.jpg", None)),
+            threading.Thread(target=scan, args=("/no-cache.jpg", {cache.CACHE_ENV: "off", dedup.DEDUP_ENV: "off", archive.ARCHIVE_ENV: "off", engines.ENGINE_ENV: "onnx"})),
+        ]
+        for job in jobs:
+            job.start()
+        for job in jobs:
+            job.join()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert results["/plain.jpg"] == {"cache": True, "dedup": True, "archive": True, "engine": "easyocr"}
+    assert results["/no-cache.jpg"] == {"cache": False, "dedup": False, "archive": False, "engine": "onnx"}
+    # The daemon's own settings are untouched
+    assert cache.get_cache() is not None and dedup.get_duplicate_index() is not None
+    assert archive.get_archive() is not None
+    assert engines.engine_name() == "easyocr"
+
+
+def test_run_ocr_batch_buckets_and_pads(monkeypatch):
+    import numpy as np
+    from scanner import ocr
+
+    calls = []
+
+    class FakeReader:
+        def readtext_batched(self, images, **kwargs):
+            calls.append([im.shape for im in images])
+            return [[([[0, 0], [10, 0], [10, 5], [0, 5]], f"H{im.shape[0]}", 0.9)] for im in images]
+
+    monkeypatch.setattr(ocr, "get_cache", lambda: None)
+    monkeypatch.setitem(ocr._READER_POOLS, (ocr.engine_name(), ("en",)), ocr.ReaderPool(factory=FakeReader))
+
+    images = [np.zeros((300, 200), np.uint8), np.zeros((1000, 200), np.uint8), np.zeros((500, 250), np.uint8)]
+    out = ocr.run_ocr_batch(images)
+
+    # 300x200 and 500x250 share the 512x256 bucket, the tall one runs alone
+    assert sorted(calls) == [[(512, 256), (512, 256)], [(1024, 256)]]
+    assert [toks[0]["text"] for toks in out] == ["H512", "H1024", "H512"]
+    assert list(out[0][0]["box"]) == [0, 0, 10, 5]
+
+
+def test_reader_pool_is_bounded_and_exclusive():
+    import threading
+    import time
+    from scanner.ocr import ReaderPool
+
+    class FakeReader:
+        busy = False
+
+    pool = ReaderPool(size=2, factory=FakeReader)
+    clashes = []
+
+    def scan():
+        with pool.reader() as reader:
+            clashes.append(reader.busy)
+            reader.busy = True
+            time.sleep(0.02)
+            reader.busy = False
+
+    threads = [threading.Thread(target=scan) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = pool.stats()
+    assert not any(clashes)
+    assert stats["created"] == 2 and stats["checkouts"] == 6
+    assert stats["waits"] >= 1 and stats["wait_max"] > 0
+
+    held = [pool.checkout(), pool.checkout()]
+    with pytest.raises(TimeoutError):
+        pool.checkout(timeout=0.01)
+    for reader in held:
+        pool.checkin(reader)
+
+
+def test_decode_reduction_and_memory_budget(tmp_path):
+    import cv2
+    import numpy as np
+    from scanner.preprocess import ReceiptImage, fit_memory_budget, peak_bytes, plan_decode
+
+    # Photo with 80px glyphs: a 1/2 decode keeps them above the 30px target, 1/4 wouldn't
+    page = np.full((4000, 2000), 240, dtype=np.uint8)
+    for y in range(100, 3900, 160):
+        for x in range(60, 1900, 70):
+            cv2.rectangle(page, (x, y), (x + 40, y + 79), 20, -1)
+    path = str(tmp_path / "big.jpg")
+    cv2.imwrite(path, page)
+
+    assert plan_decode(path)[0] == 2
+    assert plan_decode(path, adaptive=False)[0] == 1
+    # Decoded frame may only take half the budget
+    assert plan_decode(path, adaptive=False, memory_budget=8 << 20)[0] == 2
+
+    receipt = ReceiptImage(path, profile="none", crop=False)
+    assert receipt.decoded.shape == (2000, 1000)
+    assert receipt.plan["decode_reduction"] == 2
+    # The thumbnail is a color decode of its own, not the reduced OCR buffer
+    assert receipt.preview(250).shape == (500, 250, 3)
+    assert receipt.preview(1500).shape == (3000, 1500, 3)
+
+    plan = {"policy": "adaptive", "char_height": 10.0, "scale": 3.0, "canvas_size": 3840}
+    budget = 20 << 20
+    fitted = fit_memory_budget(plan, (2000, 1000), budget)
+    assert fitted["budget_limited"] and fitted["scale"] < 3.0
+    assert peak_bytes((2000, 1000), fitted["scale"]) <= budget
+    assert fit_memory_budget(plan, (200, 100), budget) is plan
+
+
+def test_onnx_engine_decoding_helpers():
+    import numpy as np
+    from scanner.engines import create_engine
+    from scanner.engines.onnx_engine import ctc_decode, group_text_box
+
+    with pytest.raises(ValueError):
+        create_engine("bogus")
+
+    # Steps: a a blank a b € -> "aab" once '€' (index 3) is ignored
+    characters = "ab€"
+    steps = [1, 1, 0, 1, 2, 3]
+    logits = np.full((1, len(steps), 4), -10.0, dtype=np.float32)
+    logits[0, np.arange(len(steps)), steps] = 10.0
+    [(text, conf)] = ctc_decode(logits, characters, ignore_idx=[3])
+    assert text == "aab"
+    assert conf > 0.99
+
+    # Two words on one line merge; a word further down stays separate
+    def word(x0, x1, y0, y1):
+        return [x0, y0, x1, y0, x1, y1, x0, y1]
+
+    horizontal, free = group_text_box([word(10, 60, 10, 30), word(70, 120, 11, 31), word(10, 60, 80, 100)])
+    assert free == []
+    assert len(horizontal) == 2
+    line = min(horizontal, key=lambda b: b[2])
+    assert line[0] < 10 and line[1] > 120
+
+
+def test_header_fingerprint_skips_header_ocr(tmp_path, monkeypatch):
+    import cv2
+    import numpy as np
+    from scanner import fingerprint, manager
+
+    def page(store, place="Sea Ranch Lakes", street="4703 N Ocean Drive", shift=0, scale=1.0):
+        img = np.full((1600, 900), 255, np.uint8)
+        cv2.putText(img, store, (120 + shift, 120), cv2.FONT_HERSHEY_DUPLEX, 3, 0, 8)
+        cv2.putText(img, place, (220 + shift, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 2)
+        cv2.putText(img, street, (200 + shift, 260), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 2)
+        return cv2.resize(img, None, fx=scale, fy=scale)
+
+    calls = []
+
+    def fake_ocr(image, canvas_size=None):
+        calls.append(image.shape)
+        return [
+            {"text": "Publix", "confidence": 0.9},
+            {"text": "APPLE JUICE", "confidence": 0.9},
+            {"text": "4.50", "confidence": 0.99},
+            {"text": "TOTAL", "confidence": 0.9},
+            {"text": "4.50", "confidence": 0.99},
+        ]
+
+    index = fingerprint.HeaderIndex(str(tmp_path / "headers.npz"))
+    monkeypatch.setattr(fingerprint, "_INDEX", index)
+    monkeypatch.setattr(fingerprint, "_INDEX_READY", True)
+    monkeypatch.setattr(manager, "run_ocr", fake_ocr)
+
+    # Unknown header: OCR header pass + full page, and the index learns it
+    result = manager.ScannerManager.process(page("Publix"), single_pass=False, tile_workers=0)
+    assert result["total"] == 4.50
+    assert len(calls) == 2 and len(index) == 1
+
+    # Same store photographed differently: full page only
+    calls.clear()
+    manager.ScannerManager.process(page("Publix", shift=30, scale=0.8), single_pass=False, tile_workers=0)
+    assert len(calls) == 1
+
+    # Persisted, and another store's header is not taken for it
+    reloaded = fingerprint.HeaderIndex(index.path)
+    assert reloaded.stats()["stores"] == {"Publix": 1}
+    header = page("Walmart", "Cypress Creek", "1297 S State Road 7")[:400]
+    assert reloaded.lookup(fingerprint.header_fingerprint(header))[0] is None
+
+
+def test_template_registry_automaton(tmp_path):
+    import sys
+    from scanner.templates.registry import KeywordAutomaton, TemplateRegistry
+
+    automaton = KeywordAutomaton({"he": 1, "she": 2, "hers": 3, "publix": 4})
+    assert sorted(automaton.find("ushers")) == [(1, 2), (2, 1), (2, 3)]
+    # OCR look-alikes and split words still hit
+    assert automaton.find("PUB1IX Sea Ranch") == [(0, 4)]
+    assert automaton.find("Pub lix") == [(0, 4)]
+
+    (tmp_path / "kroger.py").write_text(
+        "from scanner.templates.base import BaseTemplate\n\n"
+        "class KrogerTemplate(BaseTemplate):\n"
+        "    store_name = 'Kroger'\n"
+        "    keywords = ['kroger']\n\n"
+        "    def parse(self, raw_ocr):\n"
+        "        return {'store': self.store_name}\n"
+    )
+    registry = TemplateRegistry([str(tmp_path)])
+    assert set(registry.store_names()) >= {"Publix", "Kroger"}
+    # Discovering plugins doesn't import them
+    assert not any("kroger" in name for name in sys.modules)
+
+    template = registry.match([{"text": "Welcome to"}, {"text": "KR0GER"}, {"text": "publix aisle"}])
+    assert template.store_name == "Kroger"
+    assert template.parse([]) == {"store": "Kroger"}
+    assert registry.match([{"text": "Walmart"}]) is None
+
+
+def test_line_record_flags():
+    from scanner.parser import Line
+
+    line = Line("  1.23 lb @ 3.99/lb   4.91 ")
+    assert line.text == "1.23 lb @ 3.99/lb 4.91"
+    assert line.price == 1.23 and line.prices == [1.23, 3.99, 4.91]
+    assert line.weight is not None and not line.name and not line.bare_price
+
+    assert Line("12.O9").price == 12.09 and not Line("12.O9").bare_price
+    assert Line("-2.00").bare_price
+    assert Line("APPLE JUICE").name and Line("APPLE JUICE").price is None
+    assert Line("Grand Total").total and Line("Grand Total").stop
+    assert Line("VOIDED ITEM").voided and Line("You Saved 1.10").you_saved
+
+
+@pytest.mark.parametrize("boxes", [True, False])
+def test_synthetic_receipt_parses_to_expected(boxes):
+    from benchmarks.synthetic import synthetic_receipt
+    from scanner.parser import parse_receipt
+
+    tokens, expected = synthetic_receipt(lines=120, seed=3, noise=0, boxes=boxes)
+    result = parse_receipt(tokens)
+    assert len(result["items"]) == expected["items"]
+    assert result["total"] == expected["total"]
+
+
+def test_ocr_archive_roundtrip_and_reparse(tmp_path):
+    import json
+
+    from benchmarks.synthetic import synthetic_receipt
+    from scanner.archive import OcrArchive, reparse_archive
+
+    archive = OcrArchive(str(tmp_path / "ocr.bin"))
+    tokens, expected = synthetic_receipt(lines=40, seed=1, noise=0)
+    archive.append(tokens, path="a.jpg", digest="aa", shape=[2000, 800], template=None)
+    archive.append(tokens[:5], path="b.jpg", digest="bb", shape=[2000, 800], template=None)
+    # A crash mid-append leaves a torn record behind; the next append must still be readable
+    with open(archive.path, "ab") as f:
+        f.write(b"OCR\x01\xff\x00")
+    archive.append(tokens, path="b.jpg", digest="bb", shape=[2000, 800], template=None)
+
+    records = list(archive.scan(with_tokens=True))
+    assert [meta["path"] for _, meta, _ in records] == ["a.jpg", "b.jpg", "b.jpg"]
+    assert records[0][2] == tokens
+    assert archive.read(records[2][0])[1] == tokens
+    assert archive.stats()["receipts"] == 2
+
+    out = tmp_path / "reparsed.jsonl"
+    stats = reparse_archive(archive, str(out), workers=2, chunk_size=1)
+    assert stats == {"records": 2, "ok": 2, "failed": 0}
+    rows = [json.loads(line) for line in out.read_text().splitlines()]
+    assert sorted(r["source"] for r in rows) == ["a.jpg", "b.jpg"]
+    assert all(r["total"] == expected["total"] for r in rows)
+
+
+def _write_receipts(path, worker, count, max_bytes):
+    from scanner.storage import ResultWriter
+
+    with ResultWriter(path, flush_every=3, fsync="never", max_bytes=max_bytes) as writer:
+        for i in range(count):
+            writer.write({"store": f"w{worker}", "items": [{"name": f"item {i}", "price": 1.5}], "total": 1.5})
+
+
+def test_result_writer_concurrent_appends_and_rotation(tmp_path):
+    import csv
+    import json
+    from concurrent.futures import ProcessPoolExecutor
+
+    from scanner.storage import ResultWriter
+
+    with pytest.raises(ValueError):
+        ResultWriter(str(tmp_path / "out.json"))
+
+    for ext, max_bytes in ((".jsonl", 0), (".csv", 0), (".jsonl", 2000), (".csv", 2000)):
+        out = tmp_path / f"{ext[1:]}-{max_bytes}" / f"out{ext}"
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            for fut in [pool.submit(_write_receipts, str(out), w, 50, max_bytes) for w in range(4)]:
+                fut.result()
+
+        files = sorted(out.parent.glob(f"out*{ext}"))
+        assert (len(files) > 1) == bool(max_bytes)
+        rows = []
+        for f in files:
+            if ext == ".csv":
+                with open(f, newline="") as fh:
+                    assert fh.readline().strip() == "store,item_name,price,total"
+                    rows += [(r["store"], r["item_name"]) for r in csv.DictReader(fh, fieldnames=["store", "item_name", "price", "total"])]
+            else:
+                rows += [(r["store"], r["items"][0]["name"]) for r in map(json.loads, f.read_text().splitlines())]
+        assert sorted(rows) == sorted((f"w{w}", f"item {i}") for w in range(4) for i in range(50))
+
+
+def test_receipt_store_bulk_insert_import_and_indexed_queries(tmp_path):
+    import json
+    import sqlite3
+    from scanner.database import ReceiptStore
+    from scanner.storage import save_to_file
+
+    jsonl, csv_path = str(tmp_path / "old.jsonl"), str(tmp_path / "old.csv")
+    receipts = [
+        {"store": "Publix", "items": [{"name": "MILK", "price": 3.49}, {"name": "BREAD", "price": 2.0}], "total": 5.49, "date": "2026-01-05"},
+        {"store": "Walmart", "items": [], "total": 10.0, "date": "2026-02-01"},
+        {"store": "publix", "items": [{"name": "Milk 2%", "price": 3.59}], "total": 3.59, "date": "2026-03-01"},
+    ]
+    for r in receipts:
+        save_to_file(r, jsonl)
+        save_to_file(r, csv_path)
+
+    with ReceiptStore(str(tmp_path / "r.sqlite"), flush_every=2) as store:
+        assert store.import_file(jsonl) == 3
+        assert store.import_file(csv_path) == 3
+        store.write({"store": "Target", "items": [{"name": "milk", "price": 4.0}], "total": 4.0})
+        assert store.stats()["receipts"] == 7
+
+        # CSV rows carry no date, so those receipts are dated by import day
+        spend = store.spend_by_store(since="2026-01-01")
+        assert ("Walmart", 2, 20.0) in spend and ("Publix", 4, 18.16) in spend
+        assert store.spend_by_store(until="2026-01-31") == [("Publix", 1, 5.49)]
+        assert [r["total"] for r in store.receipts(store="PUBLIX", until="2026-01-31")] == [5.49]
+        assert [p for *_, p in store.item_history("milk")] == [3.49, 3.49, 4.0]
+        assert len(store.item_history("MILK", prefix=True)) == 5
+
+        # A flagged copy is stored but not counted twice
+        store.write({"store": "Walmart", "items": [{"name": "MILK", "price": 9.0}], "total": 10.0,
+                     "date": "2026-02-01", "duplicate_of": {"source": "a.jpg", "distance": 3}})
+        assert ("Walmart", 2, 20.0) in store.spend_by_store(since="2026-01-01")
+        assert len(store.item_history("milk")) == 3 and store.stats()["receipts"] == 8
+        assert store._query("SELECT duplicate_of FROM receipts WHERE duplicate_of IS NOT NULL") == [("a.jpg",)]
+
+        plan = " ".join(row[-1] for row in store._conn.execute("EXPLAIN QUERY PLAN SELECT * FROM items WHERE name = 'x'"))
+        assert "items_name" in plan
+
+    # Databases from before the duplicate_of column get it, filled from the JSON
+    old = str(tmp_path / "old.sqlite")
+    with sqlite3.connect(old) as conn:
+        conn.execute("CREATE TABLE receipts (id INTEGER PRIMARY KEY, source TEXT, store TEXT, date TEXT,"
+                     " total REAL, scanned_at REAL NOT NULL, data TEXT NOT NULL)")
+        for data in ({"store": "Publix", "total": 5.0}, {"store": "Publix", "total": 5.0, "duplicate_of": {"source": None}}):
+            conn.execute("INSERT INTO receipts (store, date, total, scanned_at, data) VALUES (?, '2026-01-05', ?, 0, ?)",
+                         (data["store"], data["total"], json.dumps(data)))
+    conn.close()
+    with ReceiptStore(old) as store:
+        assert store.spend_by_store() == [("Publix", 1, 5.0)]
+
+
+def test_duplicate_receipt_skips_ocr(tmp_path, monkeypatch):
+    import cv2
+    import numpy as np
+    from benchmarks.synthetic import synthetic_receipt
+    from scanner import archive, dedup, fingerprint, manager
+    from scanner.preprocess import ReceiptImage
+
+    def render(seed):
+        tokens, _ = synthetic_receipt(lines=40, seed=seed, noise=0)
+        img = np.full((max(t["box"][3] for t in tokens) + 40, 760), 245, np.uint8)
+        for t in tokens:
+            cv2.putText(img, t["text"], (t["box"][0], t["box"][3]), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 20, 2)
+        return img
+
+    def rephoto(img):
+        # Another shot of the same receipt: darker, softer, at another scale
+        out = cv2.GaussianBlur(img, (5, 5), 1.0).astype(np.float32) * 0.8 + 10
+        return cv2.resize(np.clip(out, 0, 255).astype(np.uint8), None, fx=0.6, fy=0.6, interpolation=cv2.INTER_AREA)
+
+    first, other = render(1), render(2)
+    index = dedup.DuplicateIndex(str(tmp_path / "dups.jsonl"))
+    monkeypatch.setattr(dedup, "_INDEX", index)
+    monkeypatch.setattr(dedup, "_INDEX_READY", True)
+    monkeypatch.setattr(archive, "_ARCHIVE_READY", True)
+    monkeypatch.setattr(fingerprint, "_INDEX_READY", True)
+
+    routed = []
+
+    def fake_route(image, *args, **kwargs):
+        routed.append(image.shape)
+        yield {"event": "store", "store": "Publix", "via": "header"}
+        return {"store": "Publix", "items": [{"name": "MILK", "price": 3.49}], "total": 3.49}
+
+    monkeypatch.setattr(manager.ScannerManager, "_route", staticmethod(fake_route))
+    options = {"profile": "none", "crop": False}
+
+    manager.ScannerManager.process(ReceiptImage(image=first, **options))
+    result = manager.ScannerManager.process(ReceiptImage(image=rephoto(first), **options), reuse_duplicates=True)
+    assert len(routed) == 1
+    assert result["total"] == 3.49 and result["duplicate_of"]["distance"] <= index.max_distance
+
+    # An explicit re-scan runs, flagged as a copy
+    result = manager.ScannerManager.process(ReceiptImage(image=rephoto(first), **options))
+    assert len(routed) == 2 and result["duplicate_of"]["distance"] <= index.max_distance
+
+    # A different receipt of the same store is scanned; the index persists
+    result = manager.ScannerManager.process(ReceiptImage(image=other, **options), reuse_duplicates=True)
+    assert len(routed) == 3 and "duplicate_of" not in result
+    assert dedup.DuplicateIndex(index.path).stats()["receipts"] == 2
+
+
+def test_process_iter_streams_store_before_body_ocr(monkeypatch):
+    import numpy as np
+    from scanner import fingerprint, manager
+
+    calls = []
+
+    def fake_ocr(image, canvas_size=None):
+        calls.append(image.shape)
+        return [
+            {"text": "Publix", "confidence": 0.9},
+            {"text": "APPLE JUICE", "confidence": 0.9},
+            {"text": "4.50", "confidence": 0.99},
+            {"text": "MILK", "confidence": 0.9},
+            {"text": "3.00", "confidence": 0.99},
+            {"text": "TOTAL", "confidence": 0.9},
+            {"text": "7.50", "confidence": 0.99},
+        ]
+
+    monkeypatch.setattr(fingerprint, "_INDEX", None)
+    monkeypatch.setattr(fingerprint, "_INDEX_READY", True)
+    monkeypatch.setattr(manager, "run_ocr", fake_ocr)
+
+    stream = manager.ScannerManager.process_iter(np.full((800, 400), 255, np.uint8), single_pass=False, tile_workers=0)
+    store = next(stream)
+    # The header pass alone decided the store; the full page isn't read yet
+    assert store == {"event": "store", "store": "Publix", "via": "header"} and len(calls) == 1
+
+    events = list(stream)
+    assert [e["event"] for e in events] == ["item", "item", "total", "done"]
+    assert [e["item"]["price"] for e in events[:2]] == [4.50, 3.00]
+    assert events[-1]["result"]["total"] == events[2]["total"] == 7.50
+
+
+def test_pipeline_stages_overlap_with_bounded_queues():
+    import asyncio
+    from scanner.pipeline import Stage, run_stages
+
+    fed, stored, active = [], [], {"io": 0, "peak": 0}
+
+    def jobs():
+        for i in range(20):
+            fed.append(i)
+            # Nothing runs far ahead of the sink: 2 queues of 2, plus the workers
+            assert len(fed) - len(stored) <= 3 * 2 + 4 + 1 + 1
+            yield {"path": i}
+
+    async def cpu(job):
+        if job["path"] == 5:
+            raise ValueError("bad image")
+        job["cpu"] = True
+
+    async def io(job):
+        active["io"] += 1
+        active["peak"] = max(active["peak"], active["io"])
+        await asyncio.sleep(0.01)
+        active["io"] -= 1
+
+    async def sink(batch):
+        stored.extend(batch)
+        await asyncio.sleep(0.005)
+
+    stages = [Stage("cpu", cpu), Stage("io", io, workers=4), Stage("store", sink, batch=8)]
+    counters = asyncio.run(run_stages(jobs(), stages, queue_size=2))
+
+    # Every job reaches the sink once, the failed one with its error and
+    # without going through the stages after the one that failed
+    assert sorted(job["path"] for job in stored) == list(range(20))
+    failed = [job for job in stored if "error" in job]
+    assert [job["path"] for job in failed] == [5] and "cpu" not in failed[0]
+    assert active["peak"] == 4
+    assert counters["cpu"]["jobs"] == 20 and counters["io"]["jobs"] == 19 and counters["store"]["jobs"] == 20
+
+
+def test_vision_client_retries_pools_and_limits():
+    import asyncio
+    import json
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import numpy as np
+    import openai
+    from scanner.openai_service import VisionClient
+
+    state = {"codes": [429, 500], "ports": set(), "active": 0, "peak": 0}
+    lock = threading.Lock()
+    content = json.dumps({"store_name": "Publix", "items": [{"item_name": "MILK", "price": 3.0}], "total": 3.0})
+
+    class StubOpenAI(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            with lock:
+                state["ports"].add(self.client_address[1])
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+                code = state["codes"].pop(0) if state["codes"] else 200
+            time.sleep(0.05)
+            if code == 200:
+                body = {"id": "1", "object": "chat.completion", "created": 0, "model": "m", "choices": [
+                    {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}},
+                ]}
+            else:
+                body = {"error": {"message": "try again"}}
+            data = json.dumps(body).encode()
+            with lock:
+                state["active"] -= 1
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = VisionClient(
+            api_key="test", base_url=f"http://127.0.0.1:{server.server_port}/v1",
+            concurrency=2, backoff=0.01, backoff_max=0.05, deadline=5,
+        )
+        image = np.zeros((20, 20), np.uint8)
+
+        # 429 and 500 are retried, on the same kept-alive connection
+        result = client.extract(image)
+        assert result == {"store": "Publix", "items": [{"name": "MILK", "price": 3.0}], "total": 3.0}
+        assert len(state["ports"]) == 1 and client.client() is client.client()
+
+        async def scan_all(concurrency=None):
+            try:
+                return await asyncio.gather(*[client.extract_async(image, concurrency) for _ in range(6)])
+            finally:
+                await client.aclose()
+
+        assert len(asyncio.run(scan_all())) == 6
+        assert state["peak"] == 2
+
+        # A run's own limit doesn't change the client's, and its loop's client is closed
+        state["peak"] = 0
+        assert len(asyncio.run(scan_all(concurrency=3))) == 6
+        assert state["peak"] == 3 and client.concurrency == 2 and not client._async
+
+        # Errors outlasting the deadline are raised (the last request may
+        # instead time out, its timeout being what's left of the deadline)
+        client.deadline = 0.3
+        state["codes"] = [503] * 100
+        started = time.monotonic()
+        with pytest.raises((openai.InternalServerError, openai.APITimeoutError)):
+            client.extract(image)
+        assert time.monotonic() - started < 1
+    finally:
+        server.shutdown()
+
+
+def test_duplicate_hash_on_sample_photos(tmp_path):
+    import glob
+    from scanner.dedup import DuplicateIndex, receipt_hash
+    from scanner.preprocess import ReceiptImage
+
+    # publix_receipt4.jpg is 8.jpg with the contrast boosted
+    index = DuplicateIndex(str(tmp_path / "duplicates.jsonl"))
+    original = receipt_hash(ReceiptImage("samples/8.jpg").cropped)
+    index.add(original, {"store": "Publix", "items": [], "total": 1.0}, source="samples/8.jpg")
+
+    copy = receipt_hash(ReceiptImage("samples/publix_receipt4.jpg").cropped)
+    entry, distance = index.lookup(copy)
+    assert entry["source"] == "samples/8.jpg" and distance <= index.max_distance
+
+    # None of the other sample receipts is taken for it
+    for path in sorted(glob.glob("samples/*")):
+        if path not in ("samples/8.jpg", "samples/publix_receipt4.jpg"):
+            assert index.lookup(receipt_hash(ReceiptImage(path).cropped)) is None, path
+
+
+def test_tiled_route_skips_full_ocr_for_vision(monkeypatch):
+    import numpy as np
+    from scanner import fingerprint, manager
+
+    tiled, header_text = [], ["Publix"]
+    monkeypatch.setattr(fingerprint, "_INDEX", None)
+    monkeypatch.setattr(fingerprint, "_INDEX_READY", True)
+    monkeypatch.setattr(manager, "run_ocr", lambda image, canvas_size=None: [{"text": header_text[0], "confidence": 0.9}])
+    monkeypatch.setattr(manager, "run_ocr_tiled", lambda image, workers: tiled.append(image.shape) or [
+        {"text": "Publix", "confidence": 0.9}, {"text": "MILK", "confidence": 0.9}, {"text": "3.00", "confidence": 0.99},
+    ])
+    monkeypatch.setattr(manager.ScannerManager, "_try_vision", staticmethod(lambda image: {"store": "Corner", "items": [], "total": 1.0}))
+
+    long_page = np.full((manager.OCR_TILE_HEIGHT * 3, 400), 255, np.uint8)
+    result = manager.ScannerManager.process(long_page, tile_workers=2)
+    assert result["store"] == "Publix" and len(tiled) == 1
+
+    # No template: Vision AI reads it, the strips are never OCR-ed
+    header_text[0] = "CORNER SHOP"
+    result = manager.ScannerManager.process(long_page, tile_workers=2)
+    assert result["store"] == "Corner" and len(tiled) == 1
+
+
+def test_tile_pool_swaps_safely_between_concurrent_requests(monkeypatch):
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    from scanner import ocr
+
+    pools = []
+
+    class Pool(ThreadPoolExecutor):
+        def __init__(self, max_workers, initializer, initargs):
+            super().__init__(max_workers, initializer=initializer, initargs=initargs)
+            pools.append(self)
+
+    monkeypatch.setattr(ocr, "ProcessPoolExecutor", Pool)
+    monkeypatch.setattr(ocr, "warm_reader", lambda lang, gpu: None)
+    monkeypatch.setattr(ocr, "_TILE_POOL", None)
+    monkeypatch.setattr(ocr, "run_ocr", lambda strip, lang, gpu, canvas_size=None: (
+        time.sleep(0.001) or [{"text": "MILK", "confidence": 0.9, "box": [0, 10, 50, 30]}]
+    ))
+
+    page = np.full((ocr.OCR_TILE_HEIGHT * 3, 200), 255, np.uint8)
+    errors = []
+
+    def scan(workers, lang):
+        # Requests with other settings replace the pool while these still use it
+        try:
+            for _ in range(20):
+                assert ocr.run_ocr_tiled(page, lang=lang, workers=workers)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=scan, args=args) for args in ((2, ("en",)), (3, ("en",)), (2, ("es",)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors and len(pools) > 1
+
+    # Pools are keyed by workers, language set and device
+    ocr.run_ocr_tiled(page, lang=("es", "en"), workers=2)
+    created = len(pools)
+    ocr.run_ocr_tiled(page, lang=("en", "es"), workers=2)
+    assert len(pools) == created and ocr._TILE_POOL[0] == (2, ("en", "es"), False)
+    ocr._shutdown_tile_pool()
+
+
+def test_single_pass_detects_once_and_matches_on_header_boxes(monkeypatch):
+    import numpy as np
+    from scanner import fingerprint, manager, ocr
+
+    # Horizontal boxes are [x_min, x_max, y_min, y_max]; the header band of an 800px page ends at 200
+    lines = {
+        (10, 120, 20, 40): "Publix",
+        (10, 100, 300, 320): "MILK",
+        (300, 360, 300, 320): "3.00",
+        (10, 100, 500, 520): "TOTAL",
+        (300, 360, 500, 520): "3.00",
+    }
+    calls = {"detect": 0, "readtext": 0, "recognize": []}
+
+    class StubReader:
+        def detect(self, img, **params):
+            calls["detect"] += 1
+            return [[list(box) for box in lines]], [[]]
+
+        def recognize(self, img, horizontal_list=None, free_list=None, reformat=True, **params):
+            calls["recognize"].append([lines[tuple(box)] for box in horizontal_list])
+            return [
+                ([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], lines[(x0, x1, y0, y1)], 0.95)
+                for x0, x1, y0, y1 in horizontal_list
+            ]
+
+        def readtext(self, image, **params):
+            calls["readtext"] += 1
+            return []
+
+    pool = ocr.ReaderPool(size=1, factory=StubReader)
+    monkeypatch.setattr(ocr, "reader_pool", lambda lang=("en",), gpu=False: pool)
+    monkeypatch.setattr(ocr, "get_cache", lambda: None)
+    monkeypatch.setattr(fingerprint, "_INDEX", None)
+    monkeypatch.setattr(fingerprint, "_INDEX_READY", True)
+
+    stream = manager.ScannerManager.process_iter(np.full((800, 400), 255, np.uint8), single_pass=True, tile_workers=0)
+    # The template is matched on the header band's boxes alone
+    assert next(stream) == {"event": "store", "store": "Publix", "via": "header"}
+    assert calls["recognize"] == [["Publix"]]
+
+    result = [e for e in stream if e["event"] == "done"][0]["result"]
+    # One detection for the page; the body regions are recognized once, afterwards
+    assert calls["detect"] == 1 and calls["readtext"] == 0
+    assert calls["recognize"] == [["Publix"], ["MILK", "3.00", "TOTAL", "3.00"]]
+    assert result["items"] == [{"name": "MILK", "price": 3.00}] and result["total"] == 3.00